@@ -0,0 +1,328 @@
+"""
+Reconstrução da aba 'history' a partir de cotações históricas.
+
+A aba só tem os dias em que o cron rodou com sucesso; depois de uma falha
+ou de uma correção na carteira, este módulo recalcula um intervalo inteiro:
+
+1. Baixa em lote os fechamentos diários de todos os ativos (yf.download para
+   a B3 e o câmbio, fetch_ohlcv na Binance) e monta uma matriz datas x posições,
+   com forward-fill nos feriados.
+2. Renda Fixa vem do FixedIncomeEngine.value_matrix (fatores acumulados do BCB).
+3. Patrimonio, Investido, Resultado_R$ e Rentabilidade_% de cada Classe e do
+   Total Geral saem de operações de matriz (sem laço por dia), com o câmbio de
+   cada data e Moeda (fx_rates).
+4. Tudo é gravado com um único upsert na aba e no espelho local
+   (o mesmo save_history_rows do cálculo diário).
+
+Opções não têm fonte histórica: usam o Manual Price ou o Preço Médio, como no
+fallback do cálculo diário.
+
+Uso:
+    python update_prices.py --backfill 2023-01-01
+    python update_prices.py --backfill 2023-01-01 --backfill-end 2023-12-31
+"""
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+import fx_rates
+import resilience
+import sources
+import update_prices as up
+from fetch_scheduler import FetchScheduler
+from market_calendar import is_b3_trading_day
+
+OHLCV_LIMIT = 1000 # candles por chamada na Binance
+DAY_MS = 24 * 60 * 60 * 1000
+
+
+def backfill_dates(start, end):
+    """Dias de pregão da B3 entre `start` e `end` (inclusive)."""
+    days = pd.date_range(start, end, freq='D')
+    return pd.DatetimeIndex([d for d in days if is_b3_trading_day(d.date())])
+
+
+def _normalize_index(frame):
+    index = pd.to_datetime(frame.index)
+    if index.tz is not None:
+        index = index.tz_localize(None)
+    frame.index = index.normalize()
+    return frame[~frame.index.duplicated(keep='last')]
+
+
+# --- SÉRIES HISTÓRICAS ---
+def download_closes(symbols, start, end):
+    """Fechamentos diários do Yahoo: DataFrame datas x símbolos."""
+    data = sources.load('yfinance').download(
+        symbols, start=start.isoformat(), end=(end + timedelta(days=1)).isoformat(), interval="1d",
+        group_by='ticker', auto_adjust=False, progress=False, threads=True
+    )
+    closes = {}
+    for symbol in symbols:
+        try:
+            closes[symbol] = data[symbol]['Close'] if isinstance(data.columns, pd.MultiIndex) else data['Close']
+        except KeyError:
+            print(f"[WARN] Sem histórico para {symbol}")
+    if not closes:
+        return pd.DataFrame(columns=symbols, dtype=float)
+    return _normalize_index(pd.DataFrame(closes))
+
+
+def fetch_b3_closes(tickers, start, end):
+    """{ticker: Series de fechamentos} de um lote de ativos da B3."""
+    symbols = [up.to_yahoo_b3(t) for t in tickers]
+    closes = download_closes(symbols, start, end)
+    return {t: closes[s] for t, s in zip(tickers, symbols) if s in closes}
+
+
+def fetch_fx_closes(currency_list, start, end):
+    """{<MOEDA>BRL: Series} de todas as moedas num único download (triangulando pelo dólar)."""
+    closes = download_closes(fx_rates.symbols_for(currency_list), start, end)
+    return {fx_rates.pair(c): s for c, s in fx_rates.cross_series(closes, currency_list).items()}
+
+
+def fetch_ohlcv_closes(symbol, start, end):
+    """Fechamentos diários de um par da Binance, paginando de OHLCV_LIMIT em OHLCV_LIMIT dias."""
+    exchange = up.get_exchange()
+    # Candles diários da Binance começam à meia-noite UTC
+    since = pd.Timestamp(start).value // 10**6
+    until = pd.Timestamp(end).value // 10**6
+    values = {}
+    while since <= until:
+        candles = exchange.fetch_ohlcv(symbol, '1d', since=since, limit=OHLCV_LIMIT)
+        if not candles:
+            break
+        for ts, _, _, _, close, _ in candles:
+            values[pd.Timestamp(ts, unit='ms').normalize()] = float(close)
+        since = candles[-1][0] + DAY_MS
+    return pd.Series(values, dtype=float).sort_index()
+
+
+def crypto_plan(tickers):
+    """{ticker: pares a cotar} (ponte quando não há par direto, como no diário)."""
+    exchange = up.get_exchange()
+    return {t: up._crypto_legs(up.to_crypto_symbol(t), exchange.markets) for t in tickers}
+
+
+def chain_crypto_closes(plan, leg_closes, start):
+    """{ticker: Series em USDT} multiplicando as pernas de cada par."""
+    closes = {}
+    for ticker, symbols in plan.items():
+        if symbols is None or any(s not in leg_closes for s in symbols):
+            continue
+        if not symbols: # Ex: USDT/USDT vale 1 em todas as datas
+            closes[ticker] = pd.Series(1.0, index=pd.DatetimeIndex([pd.Timestamp(start)]))
+            continue
+        series = leg_closes[symbols[0]]
+        for symbol in symbols[1:]:
+            series = series.mul(leg_closes[symbol]).dropna()
+        closes[ticker] = series
+    return closes
+
+
+def fetch_history(df, start, end):
+    """
+    Baixa em paralelo (agendador com rate limit por fonte) tudo o que a carteira precisa.
+    Retorna ({(fonte, ticker): Series}, {moeda: Series da taxa em BRL}).
+    """
+    classes = df['Classe'].astype(str).str.strip()
+    tickers = df['Ticker'].astype(str).str.strip()
+    by_source = {}
+    for classe, ticker in zip(classes, tickers):
+        source = up.CLASS_SOURCES.get(classe)
+        if source in ('yfinance', 'binance') and ticker not in by_source.setdefault(source, []):
+            by_source[source].append(ticker)
+    currency_list = fx_rates.currencies(df['Moeda'])
+
+    needed = set(by_source) | ({'yfinance'} if currency_list else set())
+    for source in sources.preload(sorted(needed)):
+        by_source.pop(source, None)
+        if source == 'yfinance':
+            currency_list = []
+
+    series = {}
+    with FetchScheduler() as scheduler:
+        jobs = []
+        b3 = by_source.get('yfinance', [])
+        for i in range(0, len(b3), up.B3_BATCH_SIZE):
+            jobs.append(('yfinance', scheduler.submit('yfinance', fetch_b3_closes, b3[i:i + up.B3_BATCH_SIZE], start, end,
+                                                      is_failure=resilience.failed_history)))
+        if currency_list:
+            jobs.append((up.FX_SOURCE, scheduler.submit('yfinance', fetch_fx_closes, currency_list, start, end,
+                                                        is_failure=resilience.failed_history)))
+
+        # Cripto: um job por par (cada um pagina o OHLCV), encadeados depois
+        plan, leg_jobs = {}, {}
+        if by_source.get('binance'):
+            try:
+                plan = crypto_plan(by_source['binance'])
+            except Exception as e:
+                print(f"[WARN] Falha ao conectar na Binance: {e}")
+            legs = sorted({leg for symbols in plan.values() if symbols for leg in symbols})
+            leg_jobs = {leg: scheduler.submit('binance', fetch_ohlcv_closes, leg, start, end) for leg in legs}
+
+        for source, future in jobs:
+            try:
+                for ticker, values in future.result().items():
+                    series[(source, ticker)] = values
+            except Exception as e:
+                print(f"[WARN] Falha ao baixar histórico de {source}: {e}")
+        leg_closes = {}
+        for leg, future in leg_jobs.items():
+            try:
+                leg_closes[leg] = future.result()
+            except Exception as e:
+                print(f"[WARN] Falha no histórico de {leg} na Binance: {e}")
+        for ticker, values in chain_crypto_closes(plan, leg_closes, start).items():
+            series[('binance', ticker)] = values
+
+    fx = {fx_rates.currency_of(t): series.pop((s, t)) for s, t in list(series) if s == up.FX_SOURCE}
+    return series, fx
+
+
+# --- MATRIZES ---
+def price_matrix(df, series, dates):
+    """
+    Preço de mercado de cada posição (colunas, na ordem da carteira) em cada data.
+    Feriados e fins de semana da fonte repetem o último fechamento; sem histórico fica NaN.
+    """
+    classes = df['Classe'].astype(str).str.strip()
+    tickers = df['Ticker'].astype(str).str.strip()
+    keys = [(up.CLASS_SOURCES.get(c), t) for c, t in zip(classes, tickers)]
+
+    # Uma coluna por chave única; as posições repetidas (lotes) reaproveitam a coluna
+    unique_keys = [k for k in dict.fromkeys(keys) if k in series]
+    if not unique_keys:
+        return np.full((len(dates), len(df)), np.nan)
+    frame = pd.concat([series[k].rename(i) for i, k in enumerate(unique_keys)], axis=1)
+    frame = frame.sort_index()
+    frame = frame.reindex(frame.index.union(dates)).ffill().reindex(dates)
+
+    column = {k: i for i, k in enumerate(unique_keys)}
+    positions = np.array([column.get(k, -1) for k in keys])
+    matrix = frame.to_numpy()[:, np.maximum(positions, 0)]
+    matrix[:, positions < 0] = np.nan
+    return matrix
+
+
+def fx_matrix(moedas, fx, dates):
+    """
+    Taxa em BRL de cada posição (colunas, pela Moeda) em cada data, com forward-fill.
+    Moeda sem série usa o fallback do diário (fx_rates.with_fallbacks) em todas as datas.
+    """
+    codes = fx_rates.normalize(moedas).to_numpy()
+    currency_list = [c for c in dict.fromkeys(codes) if c != fx_rates.BASE_CURRENCY]
+    missing = [c for c in currency_list if c not in fx or fx[c].dropna().empty]
+    fallbacks = fx_rates.with_fallbacks({}, missing)
+
+    matrix = np.ones((len(dates), len(codes)))
+    for currency in currency_list:
+        if currency in missing:
+            values = np.full(len(dates), fallbacks[currency])
+        else:
+            series = fx[currency].dropna().sort_index()
+            values = series.reindex(series.index.union(dates)).ffill().bfill().reindex(dates).to_numpy()
+        matrix[:, codes == currency] = values[:, None]
+    return matrix
+
+
+def history_rows(df, dates, prices, fx, fixed_income=None):
+    """
+    Mesmas contas do valuate + build_history_rows, para todas as datas de uma vez.
+    `prices` é datas x posições (NaN = sem cotação), `fx` a taxa em BRL (datas x posições).
+    Retorna as linhas da aba 'history' (Total Geral primeiro em cada data).
+    """
+    classes = df['Classe'].astype(str).str.strip()
+    qty = up.to_number(df['Quantidade']).to_numpy()
+    avg_price = up.to_number(df['Preço Médio']).to_numpy()
+    manual_price = up.to_number(df['Manual Price']).to_numpy()
+    direction = df['Direção'].astype(str).str.strip().str.upper()
+    sign = np.where((classes == 'Opcao') & (direction == 'V'), -1.0, 1.0)
+
+    # Posição só existe a partir da Data Início (quando preenchida)
+    start = pd.to_datetime(df['Data Início'].astype(str), format="%Y-%m-%d", errors='coerce')
+    held = start.isna().to_numpy()[None, :] | (start.to_numpy()[None, :] <= dates.to_numpy()[:, None])
+
+    prices = np.where(prices > 0, prices, np.nan)
+    fallback = np.where(manual_price > 0, manual_price, avg_price)
+    final_price = np.where(np.isnan(prices), fallback[None, :], prices)
+
+    # Renda Fixa: valor total pelos fatores acumulados (o "preço" é o total / quantidade)
+    rf = (classes == 'RendaFixa').to_numpy()
+    if rf.any():
+        invested = qty[rf] * avg_price[rf]
+        if fixed_income is not None:
+            values = fixed_income.value_matrix(pd.Series(invested, index=df.index[rf]),
+                                               df.loc[rf, 'Data Início'], df.loc[rf, 'Indexador'], dates)
+        else:
+            values = np.tile(invested, (len(dates), 1))
+        values = np.where(np.isnan(values), invested[None, :], values)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            final_price[:, rf] = np.where(qty[rf] > 0, values / qty[rf], 0.0)
+
+    total_brl = qty * final_price * fx * held
+    cost_basis = qty * avg_price * fx * held
+    pnl = (total_brl - cost_basis) * sign
+
+    # Soma por Classe com uma multiplicação de matriz (posições x classes)
+    categories = list(dict.fromkeys(classes))
+    onehot = (classes.to_numpy()[:, None] == np.array(categories)[None, :]).astype(float)
+    patrimonio = np.column_stack([total_brl.sum(axis=1), total_brl @ onehot])
+    lucro = np.column_stack([pnl.sum(axis=1), pnl @ onehot])
+    active = np.column_stack([held.any(axis=1), held.astype(float) @ onehot > 0])
+    investido = patrimonio - lucro
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rentab = np.where(investido > 0, lucro / investido * 100, 0.0)
+
+    labels = ["Total Geral"] + categories
+    day_labels = dates.strftime("%Y-%m-%d")
+    d_idx, c_idx = np.nonzero(active)
+    return [
+        [day_labels[d], labels[c], float(patrimonio[d, c]), float(investido[d, c]), float(lucro[d, c]), float(rentab[d, c])]
+        for d, c in zip(d_idx, c_idx)
+    ]
+
+
+# --- ORQUESTRAÇÃO ---
+def run_backfill(store, start, end=None, phase=up._no_phase):
+    """Recalcula e grava o histórico de `start` a `end` (padrão: ontem). Retorna o nº de linhas."""
+    end = end or date.today() - timedelta(days=1)
+    dates = backfill_dates(start, end)
+    if dates.empty:
+        print("[WARN] Nenhum dia de pregão no intervalo informado.")
+        return 0
+    print(f"--- Backfill do histórico: {len(dates)} dia(s) de {dates[0].date()} a {dates[-1].date()} ---")
+
+    with phase('read_wallet'):
+        df = up.read_wallet(store)
+    if df is None:
+        return 0
+
+    fixed_income = None
+    classes = df['Classe'].astype(str).str.strip()
+    with phase('fetch'):
+        series, fx = fetch_history(df, dates[0].date(), dates[-1].date())
+        if (classes == 'RendaFixa').any():
+            rf_starts = pd.to_datetime(df.loc[classes == 'RendaFixa', 'Data Início'].astype(str), format="%Y-%m-%d", errors='coerce').dropna()
+            try:
+                fixed_income = sources.load('bcb').FixedIncomeEngine()
+                if not rf_starts.empty:
+                    fixed_income.sync(min(rf_starts.min().date(), dates[0].date()), dates[-1].date() + timedelta(days=1))
+            except Exception as e:
+                print(f"[WARN] Séries locais de Renda Fixa indisponíveis: {e}")
+    print(f"Séries históricas obtidas: {len(series)} ativo(s)")
+
+    try:
+        with phase('valuate'):
+            prices = price_matrix(df, series, dates)
+            rows = history_rows(df, dates, prices, fx_matrix(df['Moeda'], fx, dates), fixed_income)
+    finally:
+        if fixed_income is not None:
+            fixed_income.close()
+
+    with phase('write_history'):
+        summary = up.save_history_rows(store, rows)
+    if summary is not None:
+        print(f"   -> {summary['updated']} linha(s) atualizada(s), {summary['appended']} nova(s) na aba '{up.TAB_HISTORY}'.")
+    return len(rows)
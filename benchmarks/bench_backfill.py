@@ -0,0 +1,107 @@
+"""
+Benchmark offline do backfill do histórico (backfill.py).
+
+Roda run_backfill contra as fontes falsas de benchmarks/fakes.py, mede o tempo
+por fase e confere a Renda Fixa: o Patrimonio da classe no último dia
+reconstruído tem de bater com o FixedIncomeEngine.value_positions do cálculo
+diário nessa data.
+
+Uso:
+    python benchmarks/bench_backfill.py
+    python benchmarks/bench_backfill.py --size 500 --days 365
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+from contextlib import contextmanager, redirect_stdout
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pandas as pd
+
+import backfill
+import fetch_scheduler
+import fixed_income
+import storage
+import update_prices
+from bench_update_prices import UNLIMITED
+from fakes import FakeEnvironment, install_fakes, make_wallet
+
+TOLERANCE = 0.01 # R$
+
+
+def rf_expected(df, day):
+    """Renda Fixa da carteira em `day` pelo mesmo caminho do cálculo diário (value_positions)."""
+    rf = df[df['Classe'].astype(str).str.strip() == 'RendaFixa']
+    invested = update_prices.to_number(rf['Quantidade']) * update_prices.to_number(rf['Preço Médio'])
+    engine = fixed_income.FixedIncomeEngine()
+    try:
+        values = engine.value_positions(invested, rf['Data Início'], rf['Indexador'], today=day)
+    finally:
+        engine.close()
+    started = pd.to_datetime(rf['Data Início'].astype(str), format="%Y-%m-%d", errors='coerce') <= pd.Timestamp(day)
+    return float(values.fillna(invested)[started].sum()), float(invested[started].sum())
+
+
+def run(args):
+    env = FakeEnvironment(make_wallet(args.size, seed=args.seed), seed=args.seed)
+    phases = {}
+
+    @contextmanager
+    def phase(name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            phases[name] = time.perf_counter() - start
+
+    end = date.today() - timedelta(days=1)
+    cwd = os.getcwd()
+    output = io.StringIO()
+    with tempfile.TemporaryDirectory() as workdir, install_fakes(env):
+        os.chdir(workdir)
+        try:
+            store = storage.SheetsStore(env.spreadsheet)
+            with redirect_stdout(output):
+                start = time.perf_counter()
+                n_rows = backfill.run_backfill(store, end - timedelta(days=args.days), end, phase=phase)
+                total = time.perf_counter() - start
+                df = update_prices.read_wallet(store)
+                history = store.read(update_prices.TAB_HISTORY)
+            last = history['Data'].max()
+            rows = history[(history['Data'] == last) & (history['Categoria'] == 'RendaFixa')]
+            backfilled = float(rows['Patrimonio'].sum())
+            expected, invested = rf_expected(df, last.date())
+        finally:
+            os.chdir(cwd)
+
+    if args.verbose:
+        print(output.getvalue())
+    for name, seconds in phases.items():
+        print(f"{name:<14} {seconds:>10.3f}")
+    print(f"{'TOTAL':<14} {total:>10.3f}  ({n_rows} linha(s))")
+    print(f"Renda Fixa em {last.date()}: backfill R$ {backfilled:,.2f}, diário R$ {expected:,.2f} (custo R$ {invested:,.2f})")
+    ok = abs(backfilled - expected) <= TOLERANCE
+    if not ok:
+        print("[ERRO] Renda Fixa do backfill diverge do cálculo diário")
+    return ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark offline do backfill")
+    parser.add_argument('--size', type=int, default=100, help="posições da carteira sintética")
+    parser.add_argument('--days', type=int, default=180, help="dias corridos reconstruídos (até ontem)")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--verbose', action='store_true', help="mostra os prints do backfill")
+    args = parser.parse_args(argv)
+    for source in list(fetch_scheduler.SOURCE_LIMITS):
+        fetch_scheduler.SOURCE_LIMITS[source] = dict(UNLIMITED)
+    sys.exit(0 if run(args) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Benchmark offline do modo daemon (daemon.PriceDaemon) com relógio simulado.
+
+Roda o daemon contra as fontes falsas de benchmarks/fakes.py, com preços
+andando um passeio aleatório, e mede quantas chamadas cada fonte recebeu,
+quantas células foram publicadas e quantas linhas ficaram seguradas pelo
+limite de variação, comparando com a publicação sem limite.
+
+Uso:
+    python benchmarks/bench_daemon.py
+    python benchmarks/bench_daemon.py --sizes 100 --minutes 120 --drift 0.002 --threshold 0.005
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import daemon
+import storage
+import fetch_scheduler
+from bench_update_prices import UNLIMITED
+from fakes import BACKENDS, FakeEnvironment, install_fakes, make_history, make_wallet
+
+# Segunda-feira, 11h em Brasília: pregão aberto
+SIM_START = datetime.fromisoformat("2024-03-04T11:00:00-03:00").timestamp()
+
+
+class SimClock:
+    """Relógio simulado: sleep() só avança o tempo."""
+
+    def __init__(self, start):
+        self.now = start
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def run_once(size, threshold, args):
+    env = FakeEnvironment(
+        make_wallet(size, seed=args.seed), make_history(5),
+        latency={b: args.latency for b in BACKENDS},
+        drift={'yfinance': args.drift, 'ccxt': args.drift},
+        seed=args.seed,
+    )
+    clock = SimClock(SIM_START)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir, install_fakes(env):
+        os.chdir(workdir)
+        start = time.perf_counter()
+        try:
+            worker = daemon.PriceDaemon(storage.SheetsStore(env.spreadsheet), threshold=threshold, clock=clock, sleep=clock.sleep)
+            output = io.StringIO()
+            with redirect_stdout(output):
+                stats = worker.run(duration=args.minutes * 60)
+        finally:
+            os.chdir(cwd)
+        wall = time.perf_counter() - start
+
+    calls = env.counter.snapshot()
+    return {
+        'size': size, 'threshold': threshold, 'wall_s': wall, 'stats': stats,
+        'calls': {b: sum(v for k, v in calls.items() if k.startswith(b + '.')) for b in BACKENDS},
+        'sheets_writes': calls['sheets.batch_update'] + calls['sheets.append_rows'],
+    }
+
+
+def print_report(results):
+    print(f"{'posições':>9} {'limite':>8} {'ciclos':>7} {'refresh':>8} {'células':>8} {'seguradas':>10} {'tempo (s)':>10}  chamadas")
+    for r in results:
+        stats = r['stats']
+        calls = ', '.join(f"{b}={n}" for b, n in r['calls'].items() if n)
+        print(f"{r['size']:>9} {r['threshold']:>8.2%} {stats['ticks']:>7} {stats['refreshes']:>8} "
+              f"{stats['cells']:>8} {stats['held']:>10} {r['wall_s']:>10.2f}  {calls}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark offline do modo daemon")
+    parser.add_argument('--sizes', default='10,100,1000', help="tamanhos de carteira separados por vírgula")
+    parser.add_argument('--minutes', type=float, default=30, help="minutos simulados de pregão")
+    parser.add_argument('--drift', type=float, default=0.001, help="desvio relativo do preço a cada cotação")
+    parser.add_argument('--threshold', type=float, default=daemon.PRICE_THRESHOLD,
+                        help="limite de publicação (comparado com 0, que publica toda variação)")
+    parser.add_argument('--latency', type=float, default=0.0, help="latência injetada (s) em todas as fontes")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', help="grava o resultado em JSON neste caminho")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    for source in list(fetch_scheduler.SOURCE_LIMITS):
+        fetch_scheduler.SOURCE_LIMITS[source] = dict(UNLIMITED)
+
+    results = []
+    for size in args.sizes.split(','):
+        for threshold in (0.0, args.threshold):
+            results.append(run_once(int(size), threshold, args))
+    print_report(results)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
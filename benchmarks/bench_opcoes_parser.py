@@ -0,0 +1,86 @@
+"""
+Benchmark offline do parser do opcoes.net.
+
+Compara o parser incremental (lxml) do opcoes_net.py com o parser antigo em
+BeautifulSoup usando as páginas salvas em fixtures/opcoes_net.
+
+Uso:
+    python benchmarks/bench_opcoes_parser.py [repeticoes]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from opcoes_net import CHUNK_SIZE, parse_br_number, parse_opcoes_net_price
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'opcoes_net')
+
+# Valores esperados de cada página salva (None = página fora do formato, erro para o chamador)
+EXPECTED = {
+    'PETRA370.html': 0.8,
+    'VALEB620.html': 1234.56,
+    'BOVAC130_sem_negocio.html': 0.0,
+    'ITUBX999_sem_tabela.html': None,
+}
+
+def parse_bs4_baseline(content):
+    """Parser original (BeautifulSoup + html.parser), usado como referência."""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(content, 'html.parser')
+    table = soup.find('table', {'class': 'top-buffer-20'})
+    if not table:
+        return None
+    cols = table.find('thead').find_all('tr')[-1].find_all(['td', 'th'])
+    ult_index = next((i for i, col in enumerate(cols) if "Ult" in col.get_text()), -1)
+    if ult_index == -1:
+        return None
+    tbody = table.find('tbody')
+    first_row = tbody.find('tr') if tbody else None
+    if not first_row:
+        return None
+    cells = first_row.find_all('td')
+    target_index = ult_index + 1
+    return parse_br_number(cells[target_index].get_text()) if len(cells) > target_index else None
+
+def parse_lxml_streaming(content):
+    chunks = (content[i:i + CHUNK_SIZE] for i in range(0, len(content), CHUNK_SIZE))
+    return parse_opcoes_net_price(chunks)
+
+def bench(fn, content, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn(content)
+    return result, (time.perf_counter() - start) / repeat * 1000
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    parsers = [('lxml incremental', parse_lxml_streaming)]
+    try:
+        import bs4 # noqa: F401
+        parsers.append(('bs4 html.parser', parse_bs4_baseline))
+    except ImportError:
+        print("[INFO] beautifulsoup4 não instalado, pulando a referência antiga.")
+
+    print(f"{'fixture':<30} {'parser':<18} {'preço':>10} {'ms/página':>10}")
+    failures = 0
+    for name in sorted(os.listdir(FIXTURES_DIR)):
+        with open(os.path.join(FIXTURES_DIR, name), 'rb') as f:
+            content = f.read()
+        for label, fn in parsers:
+            result, ms = bench(fn, content, repeat)
+            expected = EXPECTED.get(name, result)
+            if result is None or expected is None:
+                ok = result is expected
+            else:
+                ok = abs(result - expected) < 1e-9
+            failures += 0 if ok else 1
+            shown = f"{result:>10.4f}" if result is not None else f"{'None':>10}"
+            print(f"{name:<30} {label:<18} {shown} {ms:>10.3f}{'' if ok else '  <-- DIVERGENTE'}")
+
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
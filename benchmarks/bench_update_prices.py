@@ -0,0 +1,182 @@
+"""
+Benchmark offline de ponta a ponta do update_prices.py.
+
+Roda o pipeline real (run_update) contra as fontes falsas de benchmarks/fakes.py
+para carteiras sintéticas de vários tamanhos e mede, por fase
+(read_wallet, fetch, valuate, write_prices, write_history):
+tempo de parede, chamadas de API por backend e pico de memória.
+
+Uso:
+    python benchmarks/bench_update_prices.py
+    python benchmarks/bench_update_prices.py --sizes 10,100 --latency 0.05 --failure-rate 0.1
+    python benchmarks/bench_update_prices.py --latency-source opcoes_net=0.2 --json bench.json
+    python benchmarks/bench_update_prices.py --tail opcoes_net=0.05:5 --failure-rate 0.2
+    python benchmarks/bench_update_prices.py --storage local --latency-source sheets=0.3
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager, redirect_stdout
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import fetch_scheduler
+import storage
+import update_prices
+from fakes import BACKENDS, FakeEnvironment, install_fakes, make_history, make_wallet
+
+PHASES = ['read_wallet', 'fetch', 'valuate', 'write_prices', 'write_history']
+
+# Sem rate limit real por padrão: o benchmark mede o código, não a espera nos token buckets
+UNLIMITED = {'rate': 10000.0, 'burst': 10000, 'max_concurrency': 16}
+
+
+class PhaseRecorder:
+    """Passado como `phase` para run_update: mede cada fase."""
+
+    def __init__(self, counter):
+        self.counter = counter
+        self.results = {}
+
+    @contextmanager
+    def __call__(self, name):
+        before = self.counter.snapshot()
+        tracemalloc.reset_peak()
+        base_memory = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1] - base_memory
+            calls = self.counter.snapshot() - before
+            self.results[name] = {
+                'wall_s': wall,
+                'peak_mb': max(peak, 0) / 1024 / 1024,
+                'calls': {b: sum(v for k, v in calls.items() if k.startswith(b + '.')) for b in BACKENDS},
+            }
+
+
+def open_store(env, kind):
+    """Armazenamento do benchmark; o banco local é importado da planilha falsa antes de medir."""
+    sheets = storage.SheetsStore(env.spreadsheet)
+    if kind == 'sheets':
+        return sheets
+    local = storage.LocalStore()
+    storage.import_sheets(sheets, local)
+    return local if kind == 'local' else storage.MirroredStore(local, sheets)
+
+
+def run_once(size, args):
+    env = FakeEnvironment(
+        make_wallet(size, seed=args.seed),
+        make_history(args.history_days) if args.history_days else None,
+        latency={b: args.latency_by_source.get(b, args.latency) for b in BACKENDS},
+        failure_rate={b: args.sheets_failure_rate if b == 'sheets' else args.failure_rate for b in BACKENDS},
+        tail=args.tail_by_source,
+        seed=args.seed,
+    )
+    recorder = PhaseRecorder(env.counter)
+
+    # Caches locais (.cache/...) isolados por execução
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir, install_fakes(env):
+        os.chdir(workdir)
+        output = io.StringIO()
+        store = open_store(env, args.storage)
+        before = env.counter.snapshot()
+        tracemalloc.start()
+        start = time.perf_counter()
+        error = None
+        try:
+            if args.verbose:
+                update_prices.run_update(store, phase=recorder)
+            else:
+                with redirect_stdout(output):
+                    update_prices.run_update(store, phase=recorder)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        finally:
+            total = time.perf_counter() - start
+            tracemalloc.stop()
+            # Espelho do Sheets: espera o que ficou na fila (fora do tempo da execução)
+            flush_start = time.perf_counter()
+            with redirect_stdout(output):
+                storage.close_store(store)
+            flush = time.perf_counter() - flush_start
+            os.chdir(cwd)
+
+    return {
+        'size': size, 'storage': args.storage, 'total_s': total, 'flush_s': flush, 'error': error,
+        'phases': recorder.results, 'calls': dict(env.counter.snapshot() - before),
+    }
+
+
+def print_report(results):
+    print(f"{'posições':>9} {'fase':<14} {'tempo (s)':>10} {'pico (MB)':>10}  chamadas")
+    for result in results:
+        for name in PHASES:
+            phase = result['phases'].get(name)
+            if phase is None:
+                continue
+            calls = ', '.join(f"{b}={n}" for b, n in phase['calls'].items() if n)
+            print(f"{result['size']:>9} {name:<14} {phase['wall_s']:>10.3f} {phase['peak_mb']:>10.2f}  {calls or '-'}")
+        print(f"{result['size']:>9} {'TOTAL':<14} {result['total_s']:>10.3f}")
+        if result['storage'] == 'mirrored':
+            print(f"{result['size']:>9} {'espelho Sheets':<14} {result['flush_s']:>10.3f}  (espera no fim, fora do TOTAL)")
+        if result['error']:
+            print(f"{'':>9} [ERRO] execução interrompida: {result['error']}")
+        print()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark offline do update_prices.py")
+    parser.add_argument('--sizes', default='10,100,1000,10000', help="tamanhos de carteira separados por vírgula")
+    parser.add_argument('--latency', type=float, default=0.0, help="latência injetada (s) em todas as fontes")
+    parser.add_argument('--latency-source', action='append', default=[], metavar='FONTE=SEG',
+                        help=f"latência por fonte ({', '.join(BACKENDS)})")
+    parser.add_argument('--tail', action='append', default=[], metavar='FONTE=PROB:SEG',
+                        help="cauda de latência: com probabilidade PROB a chamada demora SEG a mais")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="probabilidade de falha por chamada às fontes de cotação")
+    parser.add_argument('--sheets-failure-rate', type=float, default=0.0, help="probabilidade de falha por chamada ao Sheets")
+    parser.add_argument('--history-days', type=int, default=500, help="dias úteis já existentes na aba history")
+    parser.add_argument('--storage', choices=['sheets', 'local', 'mirrored'], default='sheets',
+                        help="armazenamento: Sheets falso, banco local ou local com espelho assíncrono (ver storage.py)")
+    parser.add_argument('--real-limits', action='store_true', help="usa os rate limits reais do fetch_scheduler")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', help="grava o resultado em JSON neste caminho")
+    parser.add_argument('--verbose', action='store_true', help="mostra os prints do update_prices")
+    args = parser.parse_args(argv)
+    args.latency_by_source = {}
+    for item in args.latency_source:
+        name, value = item.split('=', 1)
+        args.latency_by_source[name] = float(value)
+    args.tail_by_source = {}
+    for item in args.tail:
+        name, value = item.split('=', 1)
+        prob, seconds = value.split(':', 1)
+        args.tail_by_source[name] = (float(prob), float(seconds))
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not args.real_limits:
+        for source in list(fetch_scheduler.SOURCE_LIMITS):
+            fetch_scheduler.SOURCE_LIMITS[source] = dict(UNLIMITED)
+
+    results = [run_once(int(size), args) for size in args.sizes.split(',')]
+    print_report(results)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
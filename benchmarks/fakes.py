@@ -0,0 +1,509 @@
+"""
+Fontes externas falsas para rodar o update_prices.py sem rede.
+
+Cada backend (Sheets, yfinance, ccxt, opcoes.net, BCB) conta as chamadas e
+aceita latência e taxa de falha configuráveis. `install_fakes` troca os
+clientes reais dos módulos do projeto pelos falsos.
+"""
+import hashlib
+import os
+import random
+import threading
+import time
+import types
+from collections import Counter
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+OPTION_FIXTURE = os.path.join(FIXTURES_DIR, 'opcoes_net', 'PETRA370.html')
+
+BACKENDS = ['sheets', 'yfinance', 'ccxt', 'opcoes_net', 'bcb']
+CLASS_WEIGHTS = {'Acao': 35, 'FII': 15, 'ETF': 10, 'Opcao': 15, 'Cripto': 15, 'RendaFixa': 10}
+
+
+class FakeSourceError(Exception):
+    pass
+
+
+def fake_price(symbol, low=1.0, high=200.0):
+    """Preço determinístico por símbolo (mesmo valor em todas as execuções)."""
+    digest = int(hashlib.md5(symbol.encode()).hexdigest()[:8], 16)
+    return round(low + (digest % 100000) / 100000 * (high - low), 4)
+
+
+def fake_quote(symbol):
+    """Preço base de um símbolo: câmbio do Yahoo (=X, -USD) em faixas plausíveis, demais via fake_price."""
+    if symbol == 'BRL=X':
+        return 5.0 + fake_price(symbol, 0, 1)
+    if symbol.endswith('=X') or symbol.endswith('-USD'):
+        return fake_price(symbol, 0.5, 7.0)
+    return fake_price(symbol)
+
+
+class CallCounter:
+    def __init__(self):
+        self.counts = Counter()
+        self.lock = threading.Lock()
+
+    def add(self, key):
+        with self.lock:
+            self.counts[key] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return Counter(self.counts)
+
+
+class Backend:
+    """
+    Simula uma fonte: conta a chamada, espera a latência e falha com a probabilidade dada.
+    `tail` = (probabilidade, segundos extras) simula a cauda de latência de uma fonte degradada.
+    """
+
+    def __init__(self, name, counter, latency=0.0, failure_rate=0.0, seed=0, drift=0.0, tail=(0.0, 0.0)):
+        self.name = name
+        self.counter = counter
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.tail = tail
+        self.drift = drift
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.moves = {}
+
+    def call(self, op):
+        self.counter.add(f"{self.name}.{op}")
+        with self.lock:
+            slow = self.random.random() < self.tail[0]
+            failed = self.random.random() < self.failure_rate
+        if self.latency or slow:
+            time.sleep(self.latency + (self.tail[1] if slow else 0.0))
+        if failed:
+            raise FakeSourceError(f"{self.name}.{op} falhou (injetado)")
+
+    def quote(self, symbol):
+        """Preço do símbolo; com `drift`, anda um passeio aleatório (desvio relativo) a cada cotação."""
+        if not self.drift:
+            return fake_quote(symbol)
+        with self.lock:
+            move = self.moves.get(symbol, 1.0) * (1 + self.random.gauss(0, self.drift))
+            self.moves[symbol] = move
+        return round(fake_quote(symbol) * move, 4)
+
+
+# --- GOOGLE SHEETS ---
+class FakeWorksheet:
+    def __init__(self, backend, title, rows=None, sheet_id=0):
+        self.backend = backend
+        self.title = title
+        self.id = sheet_id
+        self.grid = [list(r) for r in (rows or [])]
+        self.row_count = max(1000, len(self.grid))
+        self.spreadsheet = None
+
+    @property
+    def col_count(self):
+        return max(26, max((len(r) for r in self.grid), default=0))
+
+    def _values(self):
+        width = max((len(r) for r in self.grid), default=0)
+        values = [list(r) + [''] * (width - len(r)) for r in self.grid]
+        while values and all(v == '' for v in values[-1]):
+            values.pop()
+        return values
+
+    def get_all_records(self, **kwargs):
+        self.backend.call('get_all_records')
+        values = self._values()
+        if not values:
+            return []
+        header = values[0]
+        return [dict(zip(header, row)) for row in values[1:]]
+
+    def get_all_values(self, **kwargs):
+        self.backend.call('get_all_values')
+        return self._values()
+
+    def batch_get(self, ranges, **kwargs):
+        self.backend.call('batch_get')
+        values = self._values()
+        return [self._slice(values, rng) for rng in ranges]
+
+    @staticmethod
+    def _slice(values, rng):
+        """'A:C' (colunas inteiras) ou 'A2:Z' / 'A1:Z1' (a partir de uma linha), sem as células vazias à direita."""
+        from gspread.utils import a1_to_rowcol
+
+        first, last = rng.split(':')
+        first_col, first_row = first.rstrip('0123456789'), first[len(first.rstrip('0123456789')):]
+        last_col, last_row = last.rstrip('0123456789'), last[len(last.rstrip('0123456789')):]
+        col_start = a1_to_rowcol(first_col + '1')[1] - 1
+        col_end = a1_to_rowcol(last_col + '1')[1]
+        row_start = int(first_row) - 1 if first_row else 0
+        row_end = int(last_row) if last_row else len(values)
+        result = []
+        for row in values[row_start:row_end]:
+            row = row[col_start:col_end]
+            while row and row[-1] == '':
+                row = row[:-1]
+            result.append(row)
+        return result
+
+    def batch_update(self, data, **kwargs):
+        self.backend.call('batch_update')
+        from gspread.utils import a1_to_rowcol
+
+        for item in data:
+            row, col = a1_to_rowcol(item['range'].split(':')[0])
+            for r_offset, values in enumerate(item['values']):
+                self._write(row + r_offset, col, values)
+
+    def _write(self, row, col, values):
+        while len(self.grid) < row:
+            self.grid.append([])
+        target = self.grid[row - 1]
+        while len(target) < col - 1 + len(values):
+            target.append('')
+        target[col - 1:col - 1 + len(values)] = list(values)
+
+    def append_rows(self, rows, **kwargs):
+        self.backend.call('append_rows')
+        start = len(self._values()) + 1
+        for offset, values in enumerate(rows):
+            self._write(start + offset, 1, values)
+        self.row_count = max(self.row_count, len(self.grid))
+
+    def append_row(self, values, **kwargs):
+        self.append_rows([values])
+
+    def update(self, values, range_name=None, **kwargs):
+        from gspread.utils import a1_to_rowcol
+
+        self.backend.call('update')
+        row, col = a1_to_rowcol((range_name or 'A1').split(':')[0])
+        for offset, row_values in enumerate(values):
+            self._write(row + offset, col, row_values)
+
+    def add_rows(self, rows):
+        self.backend.call('add_rows')
+        self.row_count += rows
+
+    def clear(self):
+        self.backend.call('clear')
+        self.grid = []
+
+
+class FakeSpreadsheet:
+    def __init__(self, backend, tabs):
+        self.backend = backend
+        self.title = 'fake-sheet'
+        self.tabs = {}
+        for sheet_id, (title, rows) in enumerate(tabs.items()):
+            ws = FakeWorksheet(backend, title, rows, sheet_id)
+            ws.spreadsheet = self
+            self.tabs[title] = ws
+
+    def worksheet(self, title):
+        import gspread
+
+        self.backend.call('worksheet')
+        if title not in self.tabs:
+            raise gspread.WorksheetNotFound(title)
+        return self.tabs[title]
+
+    def worksheets(self):
+        self.backend.call('worksheets')
+        return list(self.tabs.values())
+
+    def add_worksheet(self, title, rows=1000, cols=26, **kwargs):
+        self.backend.call('add_worksheet')
+        ws = FakeWorksheet(self.backend, title, sheet_id=len(self.tabs))
+        ws.spreadsheet = self
+        self.tabs[title] = ws
+        return ws
+
+    def values_batch_get(self, ranges, params=None):
+        """Leitura de várias abas ("'aba'" inteira ou "'aba'!A:Z"); aba inexistente falha a chamada inteira, como na API."""
+        import gspread
+        from gspread.utils import rowcol_to_a1
+
+        self.backend.call('values_batch_get')
+        value_ranges = []
+        for rng in ranges:
+            title, _, cells = rng.rpartition('!') if '!' in rng else (rng, '', None)
+            title = title[1:-1].replace("''", "'") if title.startswith("'") else title
+            if title not in self.tabs:
+                error = {'error': {'code': 400, 'message': f"Unable to parse range: {rng}", 'status': 'INVALID_ARGUMENT'}}
+                raise gspread.exceptions.APIError(FakeResponse(status_code=400, payload=error))
+            ws = self.tabs[title]
+            # Só o nome da aba: a grade inteira
+            cells = cells or f"A:{rowcol_to_a1(1, ws.col_count).rstrip('0123456789')}"
+            value_ranges.append({'range': rng, 'values': ws._slice(ws._values(), cells)})
+        return {'valueRanges': value_ranges}
+
+    def batch_update(self, body):
+        self.backend.call('spreadsheet_batch_update')
+        by_id = {ws.id: ws for ws in self.tabs.values()}
+        for request in body.get('requests', []):
+            rng = request['deleteDimension']['range']
+            ws = by_id[rng['sheetId']]
+            del ws.grid[rng['startIndex']:rng['endIndex']]
+            ws.row_count -= rng['endIndex'] - rng['startIndex']
+
+    def get_lastUpdateTime(self):
+        self.backend.call('get_lastUpdateTime')
+        return datetime.now().isoformat()
+
+
+# --- YFINANCE ---
+def make_fake_yfinance(backend):
+    def download(tickers, period="5d", interval="1d", start=None, end=None, **kwargs):
+        backend.call('download')
+        tickers = [tickers] if isinstance(tickers, str) else list(tickers)
+        if start is not None:
+            # Histórico: `end` é exclusivo, como no yfinance
+            index = pd.bdate_range(start, pd.Timestamp(end) - timedelta(days=1))
+        else:
+            index = pd.bdate_range(end=date.today(), periods=5)
+        steps = range(1 - len(index), 1)
+        frames = {}
+        for symbol in tickers:
+            close = backend.quote(symbol)
+            frames[(symbol, 'Close')] = [close * (1 + 0.0005 * i) for i in steps]
+            frames[(symbol, 'Open')] = frames[(symbol, 'Close')]
+        df = pd.DataFrame(frames, index=index)
+        df.columns = pd.MultiIndex.from_tuples(df.columns)
+        return df
+
+    class Ticker:
+        def __init__(self, symbol):
+            self.symbol = symbol
+
+        @property
+        def info(self):
+            backend.call('info')
+            price = fake_quote(self.symbol)
+            return {'regularMarketPrice': price, 'previousClose': price}
+
+        def history(self, period="1d", **kwargs):
+            backend.call('history')
+            return pd.DataFrame({'Close': [fake_price(self.symbol)]}, index=[pd.Timestamp(date.today())])
+
+    return types.SimpleNamespace(download=download, Ticker=Ticker)
+
+
+# --- CCXT ---
+def make_fake_ccxt(backend, symbols):
+    class FakeExchange:
+        def __init__(self, config=None):
+            backend.call('init')
+            self.markets = {}
+
+        def load_markets(self):
+            backend.call('load_markets')
+            self.markets = {s: {'symbol': s} for s in symbols}
+            return self.markets
+
+        def fetch_tickers(self, requested=None):
+            backend.call('fetch_tickers')
+            return {s: {'symbol': s, 'last': backend.quote(s)} for s in (requested or self.markets)}
+
+        def fetch_ohlcv(self, symbol, timeframe='1d', since=None, limit=1000):
+            backend.call('fetch_ohlcv')
+            day = 24 * 60 * 60 * 1000
+            now = int(time.time() * 1000) // day * day
+            first = (since // day * day) if since is not None else now - (limit - 1) * day
+            close = backend.quote(symbol)
+            candles = []
+            for ts in range(first, min(now, first + (limit - 1) * day) + 1, day):
+                price = close * (1 + 0.0005 * (ts - now) / day)
+                candles.append([ts, price, price, price, price, 1.0])
+            return candles
+
+        def fetch_ticker(self, symbol):
+            backend.call('fetch_ticker')
+            return {'symbol': symbol, 'last': backend.quote(symbol)}
+
+    return types.SimpleNamespace(binance=FakeExchange)
+
+
+# --- OPCOES.NET ---
+class FakeResponse:
+    def __init__(self, content=b'', status_code=200, payload=None):
+        self.content = content
+        self.status_code = status_code
+        self.payload = payload
+
+    def iter_content(self, chunk_size=16384):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+    def json(self):
+        return self.payload
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class FakeOpcoesSession:
+    def __init__(self, backend):
+        self.backend = backend
+        with open(OPTION_FIXTURE, 'rb') as f:
+            self.page = f.read()
+
+    def get(self, url, **kwargs):
+        self.backend.call('get')
+        return FakeResponse(self.page)
+
+
+# --- BCB ---
+def make_fake_bcb_requests(backend):
+    def get(url, params=None, timeout=None, **kwargs):
+        backend.call('get')
+        params = params or {}
+        if 'ultimos' in url:
+            return FakeResponse(payload=[{'data': date.today().strftime("%d/%m/%Y"), 'valor': '14.90'}])
+        start = datetime.strptime(params['dataInicial'], "%d/%m/%Y")
+        end = datetime.strptime(params['dataFinal'], "%d/%m/%Y")
+        if 'sgs.433/' in url:
+            days = pd.date_range(start.replace(day=1), end, freq='MS')
+            value = '0.40'
+        else:
+            days = pd.bdate_range(start, end)
+            value = '0.055131'
+        payload = [{'data': d.strftime("%d/%m/%Y"), 'valor': value} for d in days if start <= d <= end]
+        return FakeResponse(payload=payload, status_code=200 if payload else 404)
+
+    return types.SimpleNamespace(get=get)
+
+
+# --- CARTEIRA SINTÉTICA ---
+WALLET_HEADER = [
+    'Ticker', 'Classe', 'Quantidade', 'Moeda', 'Preço Médio', 'Manual Price',
+    'Direção', 'Data Início', 'Indexador', 'Vencimento'
+]
+
+
+def make_wallet(n_positions, seed=42):
+    """Carteira sintética com todas as Classes; alguns ativos aparecem em mais de um lote."""
+    rng = random.Random(seed)
+    classes = rng.choices(list(CLASS_WEIGHTS), weights=list(CLASS_WEIGHTS.values()), k=n_positions)
+    universe = max(1, int(n_positions * 0.8))
+    rows = [WALLET_HEADER]
+    today = date.today()
+    for i, classe in enumerate(classes):
+        n = rng.randrange(universe)
+        qty = rng.choice([1, 10, 100, 250])
+        start = today - timedelta(days=rng.randrange(30, 1500))
+        row = {col: '' for col in WALLET_HEADER}
+        row.update({'Classe': classe, 'Quantidade': qty, 'Moeda': 'BRL', 'Direção': 'C'})
+        if classe in ('Acao', 'FII', 'ETF'):
+            suffix = {'Acao': '3', 'FII': '11', 'ETF': '11'}[classe]
+            row['Ticker'] = f"{classe[:3].upper()}{n}{suffix}"
+            row['Preço Médio'] = round(fake_price(row['Ticker']) * rng.uniform(0.7, 1.2), 2)
+        elif classe == 'Opcao':
+            row['Ticker'] = f"OPC{n}A{rng.randint(10, 99)}"
+            row['Preço Médio'] = round(rng.uniform(0.2, 3), 2)
+            row['Direção'] = rng.choice(['C', 'V'])
+            row['Vencimento'] = (today + timedelta(days=rng.randrange(-30, 120))).isoformat()
+        elif classe == 'Cripto':
+            row['Ticker'] = f"CR{n}"
+            row['Moeda'] = 'USD'
+            row['Preço Médio'] = round(fake_price(f"CR{n}/USDT") * rng.uniform(0.5, 1.5), 4)
+        else:
+            row['Ticker'] = f"CDB{i}"
+            row['Quantidade'] = 1
+            row['Preço Médio'] = rng.choice([1000, 5000, 20000])
+            row['Data Início'] = start.isoformat()
+            row['Indexador'] = rng.choice(['100% CDI', '110% CDI', '12% PRE', 'IPCA+6%'])
+            row['Vencimento'] = rng.choice(['Liquido', (today + timedelta(days=rng.randrange(100, 2000))).isoformat()])
+        rows.append([row[col] for col in WALLET_HEADER])
+    return rows
+
+
+def crypto_markets(wallet_rows):
+    """Mercados da Binance falsa: a maioria com par USDT direto, alguns só via BTC."""
+    markets = {'BTC/USDT', 'ETH/USDT', 'BNB/USDT'}
+    for row in wallet_rows[1:]:
+        if row[1] == 'Cripto':
+            ticker = row[0]
+            markets.add(f"{ticker}/BTC" if int(ticker[2:]) % 10 == 0 else f"{ticker}/USDT")
+    return sorted(markets)
+
+
+def make_history(days, categories=('Total Geral', 'Acao', 'FII', 'ETF', 'Opcao', 'Cripto', 'RendaFixa')):
+    rows = [["Data", "Categoria", "Patrimonio", "Investido", "Resultado_R$", "Rentabilidade_%"]]
+    for d in pd.bdate_range(end=date.today() - timedelta(days=1), periods=days):
+        for cat in categories:
+            rows.append([d.strftime("%Y-%m-%d"), cat, 1000.0, 900.0, 100.0, 11.1])
+    return rows
+
+
+# --- INSTALAÇÃO ---
+class FakeEnvironment:
+    """Conjunto de backends falsos + planilha falsa para uma execução."""
+
+    def __init__(self, wallet_rows, history_rows=None, latency=None, failure_rate=None, seed=0, drift=None, tail=None):
+        latency = latency or {}
+        failure_rate = failure_rate or {}
+        drift = drift or {}
+        tail = tail or {}
+        self.counter = CallCounter()
+        self.backends = {
+            name: Backend(name, self.counter, latency.get(name, 0.0), failure_rate.get(name, 0.0), seed + i,
+                          drift.get(name, 0.0), tail.get(name, (0.0, 0.0)))
+            for i, name in enumerate(BACKENDS)
+        }
+        self.spreadsheet = FakeSpreadsheet(self.backends['sheets'], {
+            'wallet': wallet_rows,
+            'prices': [],
+            'history': history_rows or [],
+        })
+        self.crypto_symbols = crypto_markets(wallet_rows)
+
+
+@contextmanager
+def install_fakes(env):
+    """Troca yfinance, ccxt, a sessão do opcoes.net e o requests do BCB pelos falsos."""
+    import fixed_income
+    import opcoes_net
+    import resilience
+    import sources
+    import update_prices
+
+    saved = {
+        (update_prices, '_EXCHANGE'): update_prices._EXCHANGE,
+        (update_prices, 'CURRENT_CDI_RATE'): update_prices.CURRENT_CDI_RATE,
+        (opcoes_net, 'get_session'): opcoes_net.get_session,
+        (fixed_income, 'requests'): fixed_income.requests,
+    }
+    fake_session = FakeOpcoesSession(env.backends['opcoes_net'])
+    fake_bcb = make_fake_bcb_requests(env.backends['bcb'])
+    # yfinance e ccxt entram pelo registro de fontes (nunca são importados de verdade)
+    saved_sources = {
+        'yfinance': sources.override('yfinance', make_fake_yfinance(env.backends['yfinance'])),
+        'binance': sources.override('binance', make_fake_ccxt(env.backends['ccxt'], env.crypto_symbols)),
+    }
+    update_prices._EXCHANGE = None
+    update_prices.CURRENT_CDI_RATE = None
+    opcoes_net.get_session = lambda: fake_session
+    fixed_income.requests = fake_bcb
+    # Circuitos e latências da camada de resiliência são do processo: cada ambiente começa do zero
+    resilience.reset()
+    try:
+        yield env
+    finally:
+        for (module, attr), value in saved.items():
+            setattr(module, attr, value)
+        for source, module in saved_sources.items():
+            sources.override(source, module)
+        resilience.reset()
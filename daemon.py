@@ -0,0 +1,195 @@
+"""
+Modo daemon do atualizador: atualização intradiária com processo "quente".
+
+Armazenamento (Sheets ou banco local, ver storage.py), cache local, motor de
+Renda Fixa, exchange da Binance e sessão do opcoes.net são abertos uma única
+vez. Cada Classe tem o seu intervalo de atualização (Cripto a cada minuto, B3
+a cada poucos minutos e só durante o pregão) e só as linhas cujo preço andou
+mais que o limite são publicadas na aba 'prices'.
+
+Uso:
+    python update_prices.py --daemon
+    python update_prices.py --daemon --threshold 0.005 --interval Cripto=30
+"""
+import time
+from datetime import datetime
+
+import pandas as pd
+
+import fx_rates
+import sources
+import update_prices as up
+from market_calendar import b3_is_open
+from quote_cache import QuoteCache
+from sheets_sync import hold_small_moves
+
+# --- CONFIG ---
+# Intervalo de atualização (segundos) por Classe
+DAEMON_INTERVALS = {
+    'Cripto': 60,
+    'Acao': 5 * 60,
+    'FII': 5 * 60,
+    'ETF': 5 * 60,
+    'Opcao': 5 * 60,
+    'RendaFixa': 60 * 60,
+}
+DEFAULT_INTERVAL = 5 * 60
+TICK_SECONDS = 5
+WALLET_RELOAD_SECONDS = 15 * 60
+HISTORY_SECONDS = 60 * 60
+
+# Variação relativa mínima do Preço Atual para a linha ser republicada (0.1%)
+PRICE_THRESHOLD = 0.001
+# Colunas da aba 'prices' que derivam do preço (podem ficar "seguradas" junto com ele)
+PRICE_DERIVED_COLUMNS = [
+    "Total (Moeda Origem)", "Total (BRL)", "Lucro/Prej (R$)", "Rentabilidade (%)", "Atualização"
+]
+
+# Classes negociadas na B3 só são atualizadas durante o pregão (calendário da B3)
+MARKET_CLASSES = up.B3_CLASSES + ['Opcao']
+
+
+class PriceDaemon:
+    """
+    Estado quente entre os ciclos. `clock`/`sleep` podem ser trocados por um
+    relógio simulado (ver benchmarks/bench_daemon.py).
+    """
+
+    def __init__(self, store, intervals=None, threshold=PRICE_THRESHOLD, clock=time.time, sleep=time.sleep):
+        self.store = store
+        self.intervals = dict(DAEMON_INTERVALS)
+        self.intervals.update(intervals or {})
+        self.threshold = threshold
+        self.clock = clock
+        self.sleep = sleep
+
+        try:
+            self.cache = QuoteCache()
+        except Exception as e:
+            print(f"[WARN] Cache local indisponível, seguindo sem cache: {e}")
+            self.cache = None
+        self.fixed_income = None
+
+        self.df = None           # carteira
+        self.current = None      # aba 'prices' calculada (todas as posições)
+        self.published = None    # conteúdo da aba após a última escrita
+        self.last_refresh = {}   # Classe -> epoch do último refresh
+        self.wallet_loaded_at = 0.0
+        self.history_written_at = 0.0
+        self.stats = {'ticks': 0, 'refreshes': 0, 'ranges': 0, 'held': 0, 'cells': 0}
+
+    # --- CARTEIRA ---
+    def _reload_wallet(self, now):
+        df = up.read_wallet(self.store)
+        self.wallet_loaded_at = now
+        if df is None:
+            return
+        if self.df is None or not df.equals(self.df):
+            # Posições mudaram: todas as Classes são recalculadas no próximo ciclo
+            self.df = df
+            self.current = None
+            self.last_refresh = {}
+            has_rf = (df['Classe'].astype(str).str.strip() == 'RendaFixa').any()
+            if has_rf and self.fixed_income is None:
+                try:
+                    self.fixed_income = sources.load('bcb').FixedIncomeEngine()
+                except Exception as e:
+                    print(f"[WARN] Séries locais de Renda Fixa indisponíveis: {e}")
+
+    def due_classes(self, now):
+        """Classes cujo intervalo venceu (no primeiro ciclo todas, mesmo fora do pregão)."""
+        classes = self.df['Classe'].astype(str).str.strip().unique()
+        due = []
+        for classe in classes:
+            last = self.last_refresh.get(classe)
+            if last is None:
+                due.append(classe)
+            elif now - last >= self.intervals.get(classe, DEFAULT_INTERVAL):
+                if classe in MARKET_CLASSES and not b3_is_open(now):
+                    continue
+                due.append(classe)
+        return due
+
+    # --- CICLO ---
+    def tick(self):
+        """Um ciclo: recalcula as Classes vencidas e publica o que mudou. Retorna um resumo ou None."""
+        now = self.clock()
+        self.stats['ticks'] += 1
+        if self.df is None or now - self.wallet_loaded_at >= WALLET_RELOAD_SECONDS:
+            self._reload_wallet(now)
+        if self.df is None:
+            return None
+
+        due = self.due_classes(now)
+        if not due:
+            return None
+
+        classes = self.df['Classe'].astype(str).str.strip()
+        sub = self.df[classes.isin(due)]
+        quotes, fx, stale = up.fetch_quotes(sub, self.cache, self.fixed_income, force=set(due))
+        _, model_quotes = up.price_options(sub, quotes, stale, self.cache)
+        prices, updated_at, _ = up.resolve_current_prices(sub, quotes, stale, self.fixed_income, model_quotes)
+        valued = up.valuate(sub, prices, fx_rates.rates_for(sub['Moeda'], fx), updated_at)
+        for classe in due:
+            self.last_refresh[classe] = now
+        self.stats['refreshes'] += len(due)
+
+        if self.current is None:
+            self.current = valued
+        else:
+            self.current = pd.concat([self.current.drop(valued.index, errors='ignore'), valued]).loc[self.df.index]
+
+        summary = self.publish()
+        if now - self.history_written_at >= HISTORY_SECONDS:
+            up.write_history(self.store, self.current)
+            self.history_written_at = now
+        summary['classes'] = due
+        return summary
+
+    def publish(self):
+        """Envia à aba 'prices' só as linhas cujo preço andou mais que o limite."""
+        rows = self.current.values.tolist()
+        rows, held = hold_small_moves(
+            self.published, up.PRICES_COLUMNS, rows, up.PRICES_KEY_COLUMNS,
+            "Preço Atual", self.threshold, PRICE_DERIVED_COLUMNS
+        )
+        summary = self.store.sync(up.TAB_PRICES, up.PRICES_COLUMNS, rows, up.PRICES_KEY_COLUMNS, current=self.published)
+        self.published = summary.pop('values')
+        summary['held'] = held
+        self.stats['held'] += held
+        self.stats['cells'] += summary['cells']
+        self.stats['ranges'] += summary['ranges']
+        return summary
+
+    def run(self, max_ticks=None, duration=None):
+        """Loop principal; para com Ctrl+C, após `max_ticks` ciclos ou `duration` segundos."""
+        started = self.clock()
+        ticks = 0
+        try:
+            while (max_ticks is None or ticks < max_ticks) and (duration is None or self.clock() - started < duration):
+                try:
+                    summary = self.tick()
+                except Exception as e:
+                    # Um ciclo ruim (ex: Sheets fora do ar) não derruba o daemon
+                    print(f"[ERRO] Ciclo do daemon falhou: {e}")
+                    summary = None
+                    self.published = None # relê a aba no próximo ciclo
+                if summary:
+                    stamp = datetime.fromtimestamp(self.clock()).strftime("%H:%M:%S")
+                    print(f"[{stamp}] {', '.join(summary['classes'])}: {summary['cells']} célula(s), "
+                          f"{summary['held']} linha(s) sem variação relevante")
+                ticks += 1
+                self.sleep(TICK_SECONDS)
+        except KeyboardInterrupt:
+            print("--- Daemon interrompido ---")
+        finally:
+            self.close()
+        return self.stats
+
+    def close(self):
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
+        if self.fixed_income is not None:
+            self.fixed_income.close()
+            self.fixed_income = None
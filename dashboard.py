@@ -1,7 +1,13 @@
+import os
+import numpy as np
 import streamlit as st
 import pandas as pd
 import plotly.express as px
 import gspread
+from history_store import HistoryMirror, chart_resolution, downsample_history
+import risk
+import schema
+import storage
 
 # --- CONFIGURAÇÃO DA PÁGINA ---
 st.set_page_config(page_title="Investimentos", layout="wide")
@@ -18,23 +24,105 @@ def connect_google_sheets():
         st.error("Não foi possível encontrar as credenciais (Secrets ou JSON local).")
         return None
 
-# --- FUNÇÃO DE CARGA (MANTIDA ORIGINAL) ---
-def load_data():
+# --- CAMADA DE DADOS (CACHE) ---
+SHEET_NAME = "portifolio-management-sheet"
+# O update_prices.py roda 1x por dia útil: os dados podem ficar em cache por 1h,
+# e a data de modificação da planilha é conferida no máximo a cada minuto.
+DATA_TTL = 60 * 60
+MODIFIED_CHECK_TTL = 60
+# 'local' lê direto do banco local do update_prices.py (--storage local), sem o Sheets
+STORAGE = os.environ.get(storage.STORAGE_ENV, 'sheets')
+
+@st.cache_resource
+def get_spreadsheet():
+    """
+    Cliente gspread + planilha abertos uma única vez por processo. Falha levanta
+    exceção, que o Streamlit não guarda no cache: a próxima execução tenta de novo.
+    """
     gc = connect_google_sheets()
-    if not gc: return pd.DataFrame() # Retorna vazio se falhar
+    if not gc:
+        raise RuntimeError("credenciais do Google Sheets indisponíveis")
+    return gc.open(SHEET_NAME)
 
-    sh = gc.open("portifolio-management-sheet") 
-    ws = sh.worksheet("prices")
-    df = pd.DataFrame(ws.get_all_records())
-    
-    # Tratamento de tipos
-    numeric_cols = ['Total (BRL)', 'Rentabilidade (%)', 'Lucro/Prej (R$)']
-    for col in numeric_cols:
-        if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
+def open_spreadsheet(show_error=True):
+    """Planilha ou None se a conexão falhar nesta execução."""
+    try:
+        return get_spreadsheet()
+    except Exception as e:
+        if show_error:
+            st.error(f"Não foi possível abrir a planilha '{SHEET_NAME}': {e}")
+        return None
+
+def read_tabs(tabs):
+    """Abas como DataFrames tipados (None nas que não existirem), do banco local ou do Sheets."""
+    if STORAGE == 'local':
+        # Uma conexão por leitura: o Streamlit roda cada sessão numa thread
+        store = storage.LocalStore()
+        try:
+            return schema.read_tabs(store, tabs)
+        finally:
+            store.close()
+    sh = open_spreadsheet()
+    if sh is None: return {tab: None for tab in tabs}
+    return schema.read_tabs(storage.SheetsStore(sh), tabs)
+
+@st.cache_data(ttl=MODIFIED_CHECK_TTL, show_spinner=False)
+def get_last_modified():
+    """Data de modificação da planilha no Drive (chamada barata, sem baixar as abas)."""
+    if STORAGE == 'local':
+        store = storage.LocalStore()
+        try:
+            return store.last_modified()
+        finally:
+            store.close()
+    sh = open_spreadsheet(show_error=False)
+    if sh is None: return None
+    try:
+        return sh.get_lastUpdateTime()
+    except Exception:
+        return None
+
+def history_mirror_fresh(last_modified):
+    """
+    O espelho local em Parquet só substitui a aba 'history' se foi sincronizado depois
+    da última alteração da planilha (o cron diário pode rodar em outra máquina).
+    """
+    if STORAGE == 'local' or last_modified is None:
+        return False
+    synced = HistoryMirror().synced_at()
+    if synced is None:
+        return False
+    try:
+        modified = pd.Timestamp(last_modified)
+        if modified.tzinfo is None:
+            modified = modified.tz_localize('UTC')
+        return synced >= modified
+    except (ValueError, TypeError):
+        return False
+
+# --- FUNÇÃO DE CARGA ---
+# `last_modified` entra na chave do cache: as abas só são baixadas de novo quando a planilha muda
+@st.cache_data(ttl=DATA_TTL, show_spinner="Carregando carteira...")
+def load_tabs(last_modified=None):
+    """Todas as abas do painel numa única leitura em lote, já tipadas (schema.py)."""
+    tabs = ["prices", "greeks", "runs"]
+    # Com o espelho local em Parquet em dia o histórico não precisa vir do Sheets
+    if not history_mirror_fresh(last_modified):
+        tabs.append("history")
+    return read_tabs(tabs)
+
+def load_data(tabs):
+    df = tabs.get("prices")
+    if df is None: return pd.DataFrame() # Retorna vazio se falhar
+
+    # Tipos já vêm do schema.py; valor vazio conta como zero nos totais
+    numeric_cols = [c for c in ['Total (BRL)', 'Rentabilidade (%)', 'Lucro/Prej (R$)'] if c in df.columns]
+    df[numeric_cols] = df[numeric_cols].fillna(0)
     return df
 
-df = load_data()
+last_modified = get_last_modified()
+sheet_tabs = load_tabs(last_modified)
+df = load_data(sheet_tabs)
 
 if df.empty:
     st.warning("Sem dados para exibir. Verifique a planilha 'prices'.")
@@ -54,14 +142,12 @@ total_reserva = df.loc[filtro_reserva, 'Total (BRL)'].sum()
 total_investimentos = df.loc[~filtro_reserva, 'Total (BRL)'].sum()
 
 # Lógica de Resumo por Classe (MANTIDA ORIGINAL)
-class_summary = df.groupby('Classe').agg(
+class_summary = df.groupby('Classe', observed=True).agg(
     total_brl=('Total (BRL)', 'sum'),
     total_pnl=('Lucro/Prej (R$)', 'sum')
 ).reset_index()
-class_summary['Rentabilidade (%)'] = class_summary.apply(
-    lambda row: (row['total_pnl'] / row['total_brl']) * 100 if row['total_brl'] else 0.0,
-    axis=1
-)
+with np.errstate(divide='ignore', invalid='ignore'):
+    class_summary['Rentabilidade (%)'] = (class_summary['total_pnl'] / class_summary['total_brl'] * 100).where(class_summary['total_brl'] != 0, 0.0)
 
 # --- CABEÇALHO (BIG NUMBERS) ---
 st.title("💰 Painel de Controle Financeiro")
@@ -126,15 +212,8 @@ if 'Vencimento' in df.columns:
     # Define HOJE para usar nos casos "Liquido"
     hoje = pd.Timestamp.now().normalize()
     
-    # Função para converter "Liquido" em DATA DE HOJE, e texto normal em Data
-    def converter_data_vencimento(val):
-        s = str(val).strip().lower()
-        if s == 'liquido':
-            return hoje
-        return pd.to_datetime(val, errors='coerce')
-
-    # Cria coluna auxiliar de data
-    df_timeline['Vencimento_liq'] = df_timeline['Vencimento'].apply(converter_data_vencimento)
+    # Coluna auxiliar de data: "Liquido" vira HOJE, o resto é convertido de uma vez (schema.py)
+    df_timeline['Vencimento_liq'] = schema.parse_dates(df_timeline['Vencimento']).mask(filtro_reserva, hoje)
     
     # Remove linhas onde não conseguimos determinar uma data (ex: ações vazias)
     df_timeline = df_timeline.dropna(subset=['Vencimento_liq'])
@@ -142,10 +221,9 @@ if 'Vencimento' in df.columns:
     if not df_timeline.empty:
         df_timeline = df_timeline.sort_values(by='Vencimento_liq')
 
-        # Cria categoria visual para pintar a Reserva de vermelho e o resto pela Classe
-        df_timeline['Categoria_Visual'] = df_timeline.apply(
-            lambda x: '🚨 RESERVA' if str(x['Vencimento_liq']).strip().lower() == 'liquido' else x['Ticker'], 
-            axis=1
+        # Cria categoria visual para pintar a Reserva de vermelho e o resto pelo Ticker
+        df_timeline['Categoria_Visual'] = np.where(
+            filtro_reserva[df_timeline.index], '🚨 RESERVA', df_timeline['Ticker'].astype(str)
         )
 
         fig_timeline = px.bar(
@@ -185,39 +263,46 @@ st.markdown("---")
 st.markdown("---")
 st.subheader("📈 Evolução Histórica (Patrimônio & Rentabilidade)")
 
-def load_history():
-    gc = connect_google_sheets()
-    if not gc: return pd.DataFrame()
-    
-    try:
-        ws = gc.open("portifolio-management-sheet").worksheet("history")
-        data = ws.get_all_records()
-        df_h = pd.DataFrame(data)
-        
-        # Conversão de tipos
-        df_h['Patrimonio'] = pd.to_numeric(df_h['Patrimonio'], errors='coerce')
-        df_h['Investido'] = pd.to_numeric(df_h['Investido'], errors='coerce')
-        df_h['Rentabilidade_%'] = pd.to_numeric(df_h['Rentabilidade_%'], errors='coerce')
-        df_h['Resultado_R$'] = pd.to_numeric(df_h['Resultado_R$'], errors='coerce')
-        df_h['Data'] = pd.to_datetime(df_h['Data'], errors='coerce')
-        
-        # TRATAMENTO DE DUPLICATAS (O Pulo do Gato)
-        # Se rodou o script 2x no mesmo dia, pega apenas o último registro de cada categoria/dia
-        df_h = df_h.sort_values('Data').drop_duplicates(subset=['Data', 'Categoria'], keep='last')
-        
-        return df_h
-    except Exception as e:
-        st.error(f"Erro ao ler histórico: {e}")
+@st.cache_data(ttl=DATA_TTL, show_spinner="Carregando histórico...")
+def load_history(last_modified=None, _tabs=None):
+    # Espelho local em Parquet (gravado pelo update_prices.py): já vem tipado e sem duplicatas
+    if history_mirror_fresh(last_modified):
+        try:
+            return HistoryMirror().read()
+        except Exception as e:
+            st.warning(f"Falha ao ler o espelho local do histórico, usando o Sheets: {e}")
+
+    # Aba já tipada pelo schema.py (vem na leitura em lote do load_tabs, ou sozinha se o espelho falhou)
+    df_h = _tabs["history"] if _tabs and "history" in _tabs else read_tabs(["history"])["history"]
+    if df_h is None or df_h.empty or 'Data' not in df_h.columns:
         return pd.DataFrame()
 
-df_history = load_history()
+    # TRATAMENTO DE DUPLICATAS (O Pulo do Gato)
+    # Se rodou o script 2x no mesmo dia, pega apenas o último registro de cada categoria/dia
+    return df_h.dropna(subset=['Data']).sort_values('Data').drop_duplicates(subset=['Data', 'Categoria'], keep='last')
+
+df_history = load_history(last_modified, sheet_tabs)
+
+# Janela exibida (dias corridos até o último registro); None = histórico inteiro
+HISTORY_WINDOWS = {"1M": 31, "6M": 183, "1A": 366, "5A": 5 * 366, "Tudo": None}
+RESOLUTION_LABELS = {'D': 'diária', 'W': 'semanal', 'M': 'mensal', 'Q': 'trimestral', 'Y': 'anual'}
 
 if not df_history.empty and 'Total Geral' in df_history['Categoria'].values:
+    window = st.radio("Período", list(HISTORY_WINDOWS), index=len(HISTORY_WINDOWS) - 1, horizontal=True)
+    df_window = df_history
+    if HISTORY_WINDOWS[window] is not None:
+        df_window = df_history[df_history['Data'] >= df_history['Data'].max() - pd.Timedelta(days=HISTORY_WINDOWS[window])]
+
+    # Resolução pelo intervalo exibido: o gráfico recebe no máximo CHART_MAX_POINTS pontos por série
+    resolution = chart_resolution(df_window['Data'].min(), df_window['Data'].max())
+    df_window = downsample_history(df_window, resolution)
+    st.caption(f"Resolução {RESOLUTION_LABELS[resolution]} ({df_window['Data'].nunique()} ponto(s) por série).")
+
     # Cria abas para os gráficos históricos
     tab1, tab2, tab3 = st.tabs(["💰 Patrimônio vs Investido", "🚀 Rentabilidade (%)", "📊 Composição da Carteira"])
     
     # Separa dados do Total Geral
-    df_total_hist = df_history[df_history['Categoria'] == 'Total Geral'].sort_values('Data')
+    df_total_hist = df_window[df_window['Categoria'] == 'Total Geral'].sort_values('Data')
     
     with tab1:
         if not df_total_hist.empty:
@@ -253,7 +338,7 @@ if not df_history.empty and 'Total Geral' in df_history['Categoria'].values:
 
     with tab3:
         # Gráfico de área empilhada por categoria (Exclui Total Geral)
-        df_cats_hist = df_history[df_history['Categoria'] != 'Total Geral'].sort_values('Data')
+        df_cats_hist = df_window[df_window['Categoria'] != 'Total Geral'].sort_values('Data')
         
         if not df_cats_hist.empty:
             fig_area = px.area(df_cats_hist, x='Data', y='Patrimonio', color='Categoria',
@@ -268,10 +353,101 @@ else:
 
 st.markdown("---")
 
+# --- RISCO DA CARTEIRA ---
+st.subheader("⚠️ Risco da Carteira")
+
+@st.cache_data(ttl=DATA_TTL, show_spinner="Calculando risco da carteira...")
+def load_risk(df_prices, n_sims):
+    """Volatilidade, correlação, contribuição por Classe e VaR (risk.py); séries históricas em cache diário."""
+    try:
+        return risk.analyze(df_prices, n_sims=n_sims)
+    except Exception as e:
+        return {'error': str(e)}
+
+n_sims = st.select_slider("Simulações Monte Carlo", options=[10000, 20000, 50000, 100000, 200000], value=risk.MC_SIMULATIONS)
+risk_report = load_risk(df, n_sims)
+
+if 'error' in risk_report:
+    st.warning(f"Não foi possível calcular o risco: {risk_report['error']}")
+elif 'vol_annual' not in risk_report:
+    st.info("Sem histórico de preços suficiente para calcular o risco.")
+else:
+    conf = f"{risk_report['confidence']:.0%}"
+    k1, k2, k3, k4, k5 = st.columns(5)
+    k1.metric("Volatilidade (a.a.)", f"{risk_report['vol_annual']:.1%}")
+    k2.metric(f"VaR 1d {conf} (hist.)", f"R$ {risk_report['var_hist_1d']:,.0f}")
+    k3.metric(f"VaR 10d {conf} (hist.)", f"R$ {risk_report['var_hist_10d']:,.0f}")
+    k4.metric(f"VaR 1d {conf} (MC)", f"R$ {risk_report['var_mc_1d']:,.0f}")
+    k5.metric(f"VaR 10d {conf} (MC)", f"R$ {risk_report['var_mc_10d']:,.0f}")
+    st.caption(
+        f"{risk_report['n_assets']} ativo(s), {risk_report['n_days']} dia(s) de retornos, "
+        f"{risk_report['n_sims']:,} simulações. Fora do modelo (sem série de mercado): "
+        f"R$ {risk_report['unmodeled_value']:,.2f} ({', '.join(risk_report['unmodeled_classes']) or '-'})."
+    )
+
+    c_risk, c_corr = st.columns(2)
+    with c_risk:
+        fig_contrib = px.bar(risk_report['risk_by_class'], x='Classe', y='Contribuição (%)',
+                             hover_data=['Exposição (R$)', 'Contribuição (R$/dia)'],
+                             title="Contribuição para o Risco por Classe")
+        st.plotly_chart(fig_contrib, use_container_width=True)
+    with c_corr:
+        fig_corr = px.imshow(risk_report['class_correlation'], text_auto='.2f', zmin=-1, zmax=1,
+                             color_continuous_scale='RdBu_r', title="Correlação entre Classes")
+        st.plotly_chart(fig_corr, use_container_width=True)
+
+st.markdown("---")
+
+# --- GREGAS DAS OPÇÕES (ABA GREEKS) ---
+def load_greeks(tabs):
+    """Livro de opções gravado pelo update_prices.py (preço teórico, vol implícita e gregas)."""
+    df_g = tabs.get("greeks")
+    if df_g is None or df_g.empty: return pd.DataFrame()
+    return df_g
+
+df_greeks = load_greeks(sheet_tabs)
+if not df_greeks.empty:
+    st.subheader("🧮 Gregas das Opções")
+    g1, g2, g3, g4 = st.columns(4)
+    g1.metric("Delta (R$)", f"R$ {df_greeks['Delta (R$)'].sum():,.2f}", help="Exposição equivalente ao ativo objeto")
+    g2.metric("Gamma (R$ por 1%)", f"R$ {df_greeks['Gamma (R$)'].sum():,.2f}", help="Variação do delta para 1% de alta no objeto")
+    g3.metric("Vega (R$ por 1 p.p.)", f"R$ {df_greeks['Vega (R$)'].sum():,.2f}")
+    g4.metric("Theta (R$/dia útil)", f"R$ {df_greeks['Theta (R$/dia)'].sum():,.2f}")
+
+    by_underlying = df_greeks.groupby('Ativo Objeto', observed=True)[['Delta (R$)', 'Gamma (R$)', 'Vega (R$)', 'Theta (R$/dia)']].sum().reset_index()
+    fig_greeks = px.bar(by_underlying, x='Ativo Objeto', y='Delta (R$)', hover_data=['Gamma (R$)', 'Vega (R$)', 'Theta (R$/dia)'],
+                        title="Delta por Ativo Objeto")
+    st.plotly_chart(fig_greeks, use_container_width=True)
+    with st.expander("Livro de opções"):
+        st.dataframe(df_greeks)
+
+    st.markdown("---")
+
+# --- SAÚDE DO ATUALIZADOR (ABA RUNS) ---
+def load_runs(tabs):
+    """Uma linha por execução do update_prices.py com --telemetry."""
+    df_r = tabs.get("runs")
+    if df_r is None or df_r.empty: return pd.DataFrame()
+    return df_r.sort_values('Início')
+
+df_runs = load_runs(sheet_tabs)
+if not df_runs.empty:
+    with st.expander("⏱️ Execuções do Atualizador"):
+        last_run = df_runs.iloc[-1]
+        r1, r2, r3 = st.columns(3)
+        r1.metric("Última Execução", f"{last_run['Duração (s)']:.1f} s", help=f"Fase mais lenta: {last_run['Fase Mais Lenta']}")
+        r2.metric("Falhas", int(last_run['Falhas']), help="Cotações sem preço da fonte nem do cache")
+        r3.metric("Cotações do Cache (stale)", int(last_run['Stale']))
+        fig_runs = px.bar(df_runs.tail(60), x='Início', y='Duração (s)', color='Falhas',
+                          title="Duração das Últimas Execuções")
+        st.plotly_chart(fig_runs, use_container_width=True)
+
 # --- TABELA DETALHADA ---
 st.subheader("Detalhamento Completo")
 st.dataframe(df)
 
 if st.button('Atualizar Dados'):
     st.cache_data.clear()
+    # Também reabre a planilha (ex: credencial renovada)
+    get_spreadsheet.clear()
     st.rerun()
\ No newline at end of file
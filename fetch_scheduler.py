@@ -0,0 +1,218 @@
+"""
+Agendador de buscas de preço concorrentes.
+
+Cada fonte externa (yfinance, binance, opcoes.net, bcb) tem o seu próprio
+token bucket (taxa de chamadas) e um limite de chamadas simultâneas, de forma
+que todas as fontes rodam ao mesmo tempo sem estourar o rate limit de nenhuma.
+
+Cada job passa pela camada de resiliência (resilience.py): retries com backoff,
+circuit breaker por fonte, hedge depois do p95 de latência e um prazo total.
+Um job que estoura o prazo é abandonado (a chamada segue em segundo plano, mas
+o resultado é descartado) e levanta TimeoutError no future.
+"""
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, CancelledError, ThreadPoolExecutor, wait
+
+import resilience
+import telemetry
+
+# --- CONFIG ---
+# rate = chamadas por segundo, burst = capacidade do balde,
+# max_concurrency = chamadas simultâneas permitidas na fonte
+SOURCE_LIMITS = {
+    'yfinance': {'rate': 2.0, 'burst': 4, 'max_concurrency': 4},
+    'binance': {'rate': 10.0, 'burst': 10, 'max_concurrency': 4},
+    'opcoes_net': {'rate': 2.0, 'burst': 2, 'max_concurrency': 2},
+    'bcb': {'rate': 1.0, 'burst': 2, 'max_concurrency': 1},
+}
+DEFAULT_LIMIT = {'rate': 2.0, 'burst': 2, 'max_concurrency': 2}
+MAX_WORKERS = 16
+
+
+class TokenBucket:
+    """Token bucket thread-safe: acquire() bloqueia até existir um token livre."""
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.capacity = float(burst)
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class FetchScheduler:
+    """
+    Pool de threads compartilhado entre as fontes.
+    Uso:
+        with FetchScheduler() as scheduler:
+            future = scheduler.submit('yfinance', get_b3_prices, tickers)
+    """
+
+    def __init__(self, limits=None, max_workers=MAX_WORKERS):
+        self.limits = dict(SOURCE_LIMITS)
+        self.limits.update(limits or {})
+        self.buckets = {}
+        self.semaphores = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='fetch')
+        # Chamadas de fato (principal e hedge): o job espera com prazo e pode abandonar a chamada
+        self.calls = ThreadPoolExecutor(max_workers=max_workers * 2, thread_name_prefix='call')
+        self.closed = threading.Event()
+
+    def _controls(self, source):
+        with self.lock:
+            if source not in self.buckets:
+                cfg = self.limits.get(source, DEFAULT_LIMIT)
+                self.buckets[source] = TokenBucket(cfg['rate'], cfg['burst'])
+                self.semaphores[source] = threading.BoundedSemaphore(cfg['max_concurrency'])
+            return self.buckets[source], self.semaphores[source]
+
+    def _call(self, source, fn, args, kwargs, started=None, stop=None):
+        """
+        Uma chamada respeitando o rate limit da fonte; a latência alimenta o p95 do hedge.
+        Se a tentativa já terminou (`stop`) enquanto esperava a vez, não chama a fonte.
+        """
+        bucket, semaphore = self._controls(source)
+        with semaphore:
+            bucket.acquire()
+            if self.closed.is_set() or (stop is not None and stop.is_set()):
+                raise CancelledError()
+            if started is not None:
+                started.set()
+            start = time.perf_counter()
+            result = fn(*args, **kwargs)
+            resilience.LATENCIES.record(source, time.perf_counter() - start)
+            return result
+
+    def _attempt(self, source, fn, args, kwargs, deadline, span, is_failure):
+        """
+        Uma tentativa: a chamada principal e, se ela passar do atraso de hedge, uma
+        duplicata. Vale a primeira resposta boa; sem nenhuma, devolve a última
+        resposta ruim ou levanta o último erro.
+        """
+        started, stop = threading.Event(), threading.Event()
+        try:
+            return self._race(source, fn, args, kwargs, deadline, span, started, stop, is_failure)
+        finally:
+            stop.set()
+
+    def _race(self, source, fn, args, kwargs, deadline, span, started, stop, is_failure):
+        tm = telemetry.get()
+        policy = resilience.policy_for(source)
+        pending = {self.calls.submit(self._call, source, fn, args, kwargs, started, stop)}
+        delay = resilience.LATENCIES.hedge_delay(source, policy)
+        hedge = None
+        if delay is not None:
+            # O atraso conta a partir do início da chamada (a espera na fila do rate limit não é lentidão da fonte)
+            while not started.wait(0.05) and not all(f.done() for f in pending) and time.monotonic() < deadline:
+                pass
+            done, _ = wait(pending, timeout=max(0.0, min(delay, deadline - time.monotonic())))
+            if not done and time.monotonic() < deadline:
+                hedge = self.calls.submit(self._call, source, fn, args, kwargs, None, stop)
+                pending.add(hedge)
+                span['hedged'] = True
+                tm.count(f"hedge.sent.{source}")
+
+        last_result, last_error = None, None
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                for future in pending:
+                    future.cancel()
+                raise TimeoutError(f"{source}: prazo de {policy['deadline']:.0f}s esgotado")
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    last_error = e
+                    continue
+                if not is_failure(result):
+                    # A chamada perdedora ainda na fila nem chega a sair
+                    for other in pending:
+                        other.cancel()
+                    if future is hedge:
+                        span['hedge_won'] = True
+                        tm.count(f"hedge.won.{source}")
+                    return result
+                last_result = result
+        if last_result is None and last_error is not None:
+            raise last_error
+        return last_result
+
+    def _run(self, source, fn, args, kwargs, is_failure):
+        """
+        Job resiliente: circuit breaker, tentativas com backoff e prazo total.
+        `is_failure(resultado)` diz se uma resposta sem erro conta como falha (retry e breaker).
+        """
+        tm = telemetry.get()
+        policy = resilience.policy_for(source)
+        breaker = resilience.breaker(source)
+        deadline = time.monotonic() + policy['deadline']
+
+        with tm.span(source, getattr(fn, '__name__', 'call')) as span:
+            result, error = None, None
+            for attempt in range(policy['attempts']):
+                if not breaker.allow():
+                    tm.count(f"breaker.skip.{source}")
+                    raise resilience.SourceUnavailable(f"{source}: circuito aberto após falhas seguidas")
+                if attempt:
+                    span['retries'] = attempt
+                    tm.count(f"retry.sent.{source}")
+                try:
+                    result, error = self._attempt(source, fn, args, kwargs, deadline, span, is_failure), None
+                except TimeoutError as e:
+                    # Prazo esgotado: não adianta tentar de novo
+                    breaker.record(False)
+                    tm.count(f"deadline.hit.{source}")
+                    raise e
+                except Exception as e:
+                    result, error = None, e
+
+                ok = error is None and not is_failure(result)
+                if breaker.record(ok):
+                    tm.event('breaker_open', source=source)
+                    print(f"[WARN] Fonte {source} com falhas seguidas: circuito aberto")
+                if ok:
+                    return result
+
+                wait_s = resilience.backoff_delay(attempt)
+                if attempt + 1 >= policy['attempts'] or time.monotonic() + wait_s >= deadline:
+                    break
+                time.sleep(wait_s)
+
+            if error is not None:
+                raise error
+            return result
+
+    def submit(self, source, fn, *args, is_failure=resilience.failed_result, **kwargs):
+        """
+        Agenda fn(*args, **kwargs) na fonte. O padrão de `is_failure` vale para mapas
+        {ticker: preço}; jobs que devolvem outra coisa (séries históricas) passam o seu.
+        """
+        return self.executor.submit(self._run, source, fn, args, kwargs, is_failure)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+        self.closed.set()
+        # Chamadas abandonadas pelo prazo não seguram a execução; as que ainda estão na fila são canceladas
+        self.calls.shutdown(wait=False, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        return False
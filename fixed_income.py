@@ -0,0 +1,325 @@
+"""
+Motor de Renda Fixa baseado nas séries diárias de índices do Banco Central.
+
+As séries (CDI diário e IPCA mensal) ficam guardadas num SQLite local e a cada
+execução só os dias novos são baixados. Sobre o calendário de dias úteis da
+série do CDI são pré-calculados fatores acumulados, então o valor de qualquer
+posição entre a 'Data Início' e hoje é uma consulta e uma multiplicação:
+
+    valor_hoje = valor_inicial * F[hoje] / F[data_inicio]
+
+Suporta '105% CDI', '12% PRE' e 'IPCA+6%', todos na convenção de 252 dias úteis.
+"""
+import os
+import sqlite3
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import requests
+
+from market_calendar import b3_holidays, is_b3_trading_day
+
+# --- CONFIG ---
+INDEX_STORE_PATH = os.environ.get('INDEX_STORE_PATH', os.path.join('.cache', 'indices.sqlite'))
+BCB_SERIES_URL = "https://api.bcb.gov.br/dados/serie/bcdata.sgs.{code}/dados"
+BCB_MAX_WINDOW_DAYS = 3650 # A API limita consultas de séries diárias a 10 anos
+BUSINESS_DAYS_YEAR = 252
+
+# code = série SGS, freq = 'D' (diária, % a.d.) ou 'M' (mensal, % a.m.)
+INDEX_SERIES = {
+    'CDI': {'code': 12, 'freq': 'D'},
+    'IPCA': {'code': 433, 'freq': 'M'},
+}
+
+# Fallback quando o indexador não traz uma taxa legível (mesmo valor do cálculo antigo)
+DEFAULT_ANNUAL_RATE = 0.10
+
+
+class IndexStore:
+    """Armazena as séries do BCB em SQLite: (série, data) -> valor em %."""
+
+    def __init__(self, path=INDEX_STORE_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # A sincronização roda numa thread do agendador
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS index_values (
+                series TEXT NOT NULL,
+                date TEXT NOT NULL,
+                value REAL NOT NULL,
+                PRIMARY KEY (series, date)
+            )
+            """
+        )
+        self.conn.execute("CREATE TABLE IF NOT EXISTS index_sync (series TEXT PRIMARY KEY, synced_on TEXT NOT NULL)")
+        self.conn.commit()
+
+    def load(self, series):
+        rows = self.conn.execute(
+            "SELECT date, value FROM index_values WHERE series = ? ORDER BY date", (series,)
+        ).fetchall()
+        if not rows:
+            return pd.Series(dtype=float, index=pd.DatetimeIndex([]))
+        dates, values = zip(*rows)
+        return pd.Series(values, index=pd.to_datetime(dates), dtype=float)
+
+    def save(self, series, values):
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO index_values (series, date, value) VALUES (?, ?, ?)",
+            [(series, d.strftime("%Y-%m-%d"), float(v)) for d, v in values.items()],
+        )
+        self.conn.commit()
+
+    def synced_on(self, series):
+        row = self.conn.execute("SELECT synced_on FROM index_sync WHERE series = ?", (series,)).fetchone()
+        return row[0] if row else None
+
+    def mark_synced(self, series, day):
+        self.conn.execute("INSERT OR REPLACE INTO index_sync (series, synced_on) VALUES (?, ?)", (series, day))
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+def fetch_bcb_series(code, start, end):
+    """Baixa uma série SGS entre `start` e `end` (date), em janelas de até 10 anos."""
+    values = {}
+    window_start = start
+    while window_start <= end:
+        window_end = min(end, window_start + timedelta(days=BCB_MAX_WINDOW_DAYS))
+        params = {
+            'formato': 'json',
+            'dataInicial': window_start.strftime("%d/%m/%Y"),
+            'dataFinal': window_end.strftime("%d/%m/%Y"),
+        }
+        response = requests.get(BCB_SERIES_URL.format(code=code), params=params, timeout=15)
+        # Janela sem dados (ex: feriado) volta como 404
+        if response.status_code == 200:
+            for item in response.json():
+                values[datetime.strptime(item['data'], "%d/%m/%Y")] = float(item['valor'])
+        window_start = window_end + timedelta(days=1)
+    return pd.Series(values, dtype=float).sort_index()
+
+
+def fetch_bcb_latest(code):
+    """Último valor publicado de uma série SGS (ex: 1178, Selic anualizada em %)."""
+    response = requests.get(BCB_SERIES_URL.format(code=code) + "/ultimos/1", params={'formato': 'json'}, timeout=5)
+    return float(response.json()[0]['valor'])
+
+
+def _business_day_between(last, today):
+    """Existe dia útil em (last, today]? Sem nenhum, a série diária não pode ter ponto novo."""
+    day = last + timedelta(days=1)
+    while day <= today:
+        if is_b3_trading_day(day):
+            return True
+        day += timedelta(days=1)
+    return False
+
+
+def _holidays(first_year, last_year):
+    """Feriados da B3 dos anos [first_year, last_year] (datetime64[D], para o numpy)."""
+    days = sorted(d for year in range(first_year, last_year + 1) for d in b3_holidays(year))
+    return np.array(days, dtype='datetime64[D]')
+
+
+def _by_position(values, index):
+    """Series com `index`, casada por posição (pd.Series(s, index=...) reindexaria por rótulo)."""
+    return pd.Series(pd.Series(values).to_numpy(), index=index)
+
+
+def parse_indexers(indexador):
+    """
+    Decodifica a coluna Indexador em (tipo, taxa):
+    '105% CDI' -> ('CDI', 1.05), '12,5% PRE' -> ('PRE', 0.125), 'IPCA+6%' -> ('IPCA', 0.06).
+    """
+    idx = indexador.fillna('').astype(str).str.upper().str.replace(' ', '', regex=False).str.replace(',', '.', regex=False)
+    kind = pd.Series(None, index=idx.index, dtype=object)
+    rate = pd.Series(np.nan, index=idx.index, dtype=float)
+
+    is_cdi = idx.str.contains('CDI', regex=False)
+    is_pre = ~is_cdi & idx.str.contains('PRE', regex=False)
+    is_ipca = ~is_cdi & ~is_pre & idx.str.contains('IPCA+', regex=False)
+
+    cdi_pct = pd.to_numeric(idx.str.extract(r'^([\d.]+)%CDI', expand=False), errors='coerce') / 100
+    pre_rate = pd.to_numeric(idx.str.extract(r'^([\d.]+)%PRE', expand=False), errors='coerce') / 100
+    ipca_spread = pd.to_numeric(idx.str.extract(r'IPCA\+([\d.]+)', expand=False), errors='coerce') / 100
+
+    kind[is_cdi & cdi_pct.notna()] = 'CDI'
+    rate[is_cdi] = cdi_pct[is_cdi]
+    # '%CDI' ou '%PRE' ilegível cai numa taxa pré de segurança
+    kind[(is_cdi & cdi_pct.isna()) | is_pre] = 'PRE'
+    rate[is_pre] = pre_rate[is_pre]
+    rate[kind.eq('PRE') & rate.isna()] = DEFAULT_ANNUAL_RATE
+    kind[is_ipca] = 'IPCA'
+    rate[is_ipca] = ipca_spread[is_ipca].fillna(0.0)
+    return kind, rate
+
+
+class FixedIncomeEngine:
+    def __init__(self, store=None):
+        self.store = store or IndexStore()
+        self._today = None
+        self._calendar = None
+        self._cdi_daily = None
+        self._ipca_factor = None
+        self._cdi_factors = {}
+
+    # --- SINCRONIZAÇÃO ---
+    def sync(self, start_date, today=None):
+        """Baixa apenas os trechos das séries que ainda não estão no store."""
+        today = today or date.today()
+        for series, cfg in INDEX_SERIES.items():
+            try:
+                self._sync_series(series, cfg, start_date, today)
+            except Exception as e:
+                print(f"   [WARN] Falha ao atualizar a série {series} no BCB: {e}")
+        self._calendar = None
+
+    def _sync_series(self, series, cfg, start_date, today):
+        if cfg['freq'] == 'M':
+            start_date = start_date.replace(day=1)
+            head_tolerance = timedelta(days=31)
+        else:
+            head_tolerance = timedelta(days=7)
+
+        have = self.store.load(series)
+        ranges = []
+        if have.empty:
+            ranges.append((start_date, today))
+        else:
+            first, last = have.index[0].date(), have.index[-1].date()
+            if start_date < first - head_tolerance:
+                ranges.append((start_date, first - timedelta(days=1)))
+            # A ponta da série só é consultada uma vez por dia, e a diária só se houve dia útil desde o último ponto
+            if (last < today and self.store.synced_on(series) != today.isoformat()
+                    and (cfg['freq'] == 'M' or _business_day_between(last, today))):
+                ranges.append((last + timedelta(days=1), today))
+
+        for start, end in ranges:
+            values = fetch_bcb_series(cfg['code'], start, end)
+            if not values.empty:
+                self.store.save(series, values)
+            print(f"   [INFO] Série {series}: {len(values)} novo(s) ponto(s) de {start} a {end}")
+        if ranges:
+            self.store.mark_synced(series, today.isoformat())
+
+    # --- FATORES ACUMULADOS ---
+    def _prepare(self, today):
+        if self._calendar is not None and self._today == today:
+            return
+        self._today = today
+        self._cdi_factors = {}
+
+        cdi = self.store.load('CDI') / 100 # % a.d. -> decimal
+        cdi = cdi[cdi.index < pd.Timestamp(today)]
+        if cdi.empty:
+            self._calendar = pd.DatetimeIndex([])
+            self._cdi_daily = np.array([])
+            self._ipca_factor = np.array([1.0])
+            return
+
+        # Dias úteis ainda não publicados (até ontem) usam a última taxa conhecida
+        tail = pd.bdate_range(cdi.index[-1] + timedelta(days=1), pd.Timestamp(today) - timedelta(days=1),
+                              freq='C', holidays=_holidays(cdi.index[-1].year, today.year))
+        if len(tail):
+            cdi = pd.concat([cdi, pd.Series(cdi.iloc[-1], index=tail)])
+        self._calendar = cdi.index
+        self._cdi_daily = cdi.to_numpy()
+
+        # IPCA mensal distribuído pelos dias úteis do mês; meses sem divulgação repetem o último
+        ipca = self.store.load('IPCA') / 100
+        months = self._calendar.to_period('M')
+        if ipca.empty:
+            monthly = np.zeros(len(self._calendar))
+        else:
+            ipca.index = ipca.index.to_period('M')
+            monthly = ipca.reindex(months.unique()).ffill().fillna(ipca.iloc[0]).reindex(months).to_numpy()
+        month_start = months.to_timestamp().to_numpy().astype('datetime64[D]')
+        next_month = (months + 1).to_timestamp().to_numpy().astype('datetime64[D]')
+        # Mesmos feriados da B3 do calendário do CDI: o fator do mês fecha no IPCA divulgado
+        holidays = _holidays(self._calendar[0].year, self._calendar[-1].year)
+        bdays_in_month = np.busday_count(month_start, next_month, holidays=holidays)
+        daily_ipca = (1 + monthly) ** (1 / bdays_in_month)
+        self._ipca_factor = np.concatenate([[1.0], np.cumprod(daily_ipca)])
+
+    def _cdi_factor(self, percent):
+        # Fator acumulado de p% do CDI: prod(1 + p * CDI_dia)
+        if percent not in self._cdi_factors:
+            self._cdi_factors[percent] = np.concatenate([[1.0], np.cumprod(1 + percent * self._cdi_daily)])
+        return self._cdi_factors[percent]
+
+    def current_cdi_annual(self, today=None):
+        """CDI anualizado (252 d.u.) da última taxa diária disponível."""
+        self._prepare(today or date.today())
+        if not len(self._cdi_daily):
+            return None
+        return (1 + self._cdi_daily[-1]) ** BUSINESS_DAYS_YEAR - 1
+
+    # --- VALORIZAÇÃO EM LOTE ---
+    def value_positions(self, valor_inicial, data_inicio, indexador, today=None):
+        """
+        Valor atualizado de todas as posições de uma vez (Series alinhadas).
+        Posições sem cobertura das séries locais voltam como NaN.
+        """
+        today = today or date.today()
+        valor_inicial = pd.Series(valor_inicial, dtype=float)
+        values = self.value_matrix(valor_inicial, data_inicio, indexador, [today])
+        return pd.Series(values[0], index=valor_inicial.index)
+
+    def value_matrix(self, valor_inicial, data_inicio, indexador, dates):
+        """
+        Valor de cada posição (colunas) em cada data de `dates` (linhas), num array
+        datas x posições. O valor numa data usa os índices até o dia anterior.
+        Antes da 'Data Início', sem data ou com indexador desconhecido: valor investido.
+        Posições sem cobertura das séries locais: NaN.
+        As três entradas são casadas por posição (o índice de quem chega é ignorado).
+        """
+        dates = pd.DatetimeIndex(pd.to_datetime(list(dates))).normalize()
+        self._prepare(dates.max().date())
+
+        valor_inicial = pd.Series(valor_inicial, dtype=float)
+        v0 = valor_inicial.to_numpy()
+        start = pd.to_datetime(_by_position(data_inicio, valor_inicial.index).astype(str), format="%Y-%m-%d", errors='coerce')
+        kind, rate = parse_indexers(_by_position(indexador, valor_inicial.index))
+        kind, rate = kind.to_numpy(), rate.to_numpy()
+
+        result = np.tile(v0, (len(dates), 1))
+        valid = (start.notna() & pd.notna(kind)).to_numpy()
+        if not valid.any():
+            return result
+
+        calendar = self._calendar
+        covered = valid & (len(calendar) > 0)
+        if len(calendar):
+            covered &= (start >= calendar[0] - timedelta(days=7)).to_numpy()
+        result[:, valid & ~covered] = np.nan
+
+        i_start = np.zeros(len(v0), dtype=int)
+        i_start[covered] = calendar.searchsorted(start[covered].to_numpy(), side='left')
+        i_end = calendar.searchsorted(dates, side='left')
+        business_days = i_end[:, None] - i_start[None, :] # datas x posições
+
+        for percent in np.unique(rate[covered & (kind == 'CDI')]):
+            cols = covered & (kind == 'CDI') & (rate == percent)
+            factors = self._cdi_factor(percent)
+            result[:, cols] = v0[cols] * factors[i_end][:, None] / factors[i_start[cols]][None, :]
+
+        cols = covered & (kind == 'PRE')
+        result[:, cols] = v0[cols] * (1 + rate[cols]) ** (business_days[:, cols] / BUSINESS_DAYS_YEAR)
+
+        cols = covered & (kind == 'IPCA')
+        ipca = self._ipca_factor[i_end][:, None] / self._ipca_factor[i_start[cols]][None, :]
+        result[:, cols] = v0[cols] * ipca * (1 + rate[cols]) ** (business_days[:, cols] / BUSINESS_DAYS_YEAR)
+
+        # Datas anteriores ao início da aplicação mantêm o valor investido
+        not_started = valid[None, :] & (start.to_numpy()[None, :] > dates.to_numpy()[:, None])
+        result[not_started] = np.broadcast_to(v0, result.shape)[not_started]
+        return result
+
+    def close(self):
+        self.store.close()
@@ -0,0 +1,148 @@
+"""
+Câmbio da carteira: uma taxa <MOEDA>/BRL para cada Moeda presente na carteira.
+
+Todas as taxas saem de um único yf.download com:
+- BRL=X (USD/BRL), a perna comum;
+- <MOEDA>BRL=X, o cruzamento direto com o real, quando o Yahoo tem;
+- <MOEDA>USD=X (moedas) ou <MOEDA>-USD (stablecoins e cripto), para triangular
+  pelo dólar quando o cruzamento direto não vem.
+
+No cálculo diário cada par entra no fetch_quotes como a fonte 'fx' (ticker
+<MOEDA>BRL): o QuoteCache aplica o TTL da classe 'FX', serve a última taxa boa
+se a busca falhar e o planejamento reaproveita a taxa com o câmbio fechado.
+O backfill usa as mesmas regras sobre as séries diárias.
+"""
+import pandas as pd
+
+import sources
+
+# --- CONFIG ---
+BASE_CURRENCY = 'BRL'
+PIVOT_CURRENCY = 'USD'
+PIVOT_SYMBOL = "BRL=X" # USD/BRL no Yahoo
+
+# Grafias aceitas na coluna Moeda
+CURRENCY_ALIASES = {'': 'BRL', 'R$': 'BRL', 'REAL': 'BRL', 'US$': 'USD', 'DOLAR': 'USD', 'EURO': 'EUR'}
+
+# Moedas cotadas como cripto no Yahoo (<MOEDA>-USD), sem cruzamento direto com o real
+CRYPTO_CURRENCIES = {'USDT', 'USDC', 'BUSD', 'DAI', 'BTC', 'ETH'}
+USD_PEGGED = {'USDT', 'USDC', 'BUSD', 'DAI'}
+
+# Fallback quando nem a fonte nem o cache têm a taxa (stablecoins usam a do dólar)
+FALLBACK_RATES = {'USD': 5.0, 'EUR': 5.5}
+
+
+def normalize(moedas):
+    """Coluna Moeda -> códigos em maiúsculas (vazio e 'R$' viram BRL)."""
+    codes = pd.Series(moedas).astype(str).str.strip().str.upper()
+    return codes.replace(CURRENCY_ALIASES)
+
+
+def currencies(moedas):
+    """Moedas distintas diferentes do real, na ordem em que aparecem."""
+    return [c for c in dict.fromkeys(normalize(moedas)) if c != BASE_CURRENCY]
+
+
+def pair(currency):
+    return f"{currency}{BASE_CURRENCY}"
+
+
+def currency_of(pair_name):
+    return pair_name[:-len(BASE_CURRENCY)]
+
+
+def yahoo_symbols(currency):
+    """(cruzamento direto ou None, símbolo para triangular pelo dólar ou None)."""
+    if currency == PIVOT_CURRENCY:
+        return PIVOT_SYMBOL, None
+    if currency in CRYPTO_CURRENCIES:
+        return None, f"{currency}-USD"
+    return f"{currency}{BASE_CURRENCY}=X", f"{currency}{PIVOT_CURRENCY}=X"
+
+
+def symbols_for(currency_list):
+    """Símbolos do Yahoo que cobrem todas as moedas (sempre inclui o USD/BRL)."""
+    symbols = [PIVOT_SYMBOL]
+    for currency in currency_list:
+        symbols.extend(s for s in yahoo_symbols(currency) if s)
+    return list(dict.fromkeys(symbols))
+
+
+def cross_series(closes, currency_list):
+    """
+    {moeda: Series da taxa em BRL} a partir dos fechamentos (DataFrame datas x símbolos).
+    O cruzamento direto tem prioridade; nas datas em que falta, vale o triangulado pelo dólar.
+    """
+    closes = closes.where(closes > 0)
+    usd = closes[PIVOT_SYMBOL] if PIVOT_SYMBOL in closes else None
+    crosses = {}
+    for currency in currency_list:
+        direct, pivot = yahoo_symbols(currency)
+        series = closes[direct] if direct in closes else None
+        if pivot in closes and usd is not None:
+            triangulated = closes[pivot] * usd
+            series = triangulated if series is None else series.combine_first(triangulated)
+        if series is not None and series.notna().any():
+            crosses[currency] = series
+    return crosses
+
+
+def download_closes(symbols, **kwargs):
+    """Fechamentos do Yahoo num único download: DataFrame datas x símbolos."""
+    data = sources.load('yfinance').download(
+        symbols, interval="1d", group_by='ticker', auto_adjust=False, progress=False, threads=True, **kwargs
+    )
+    closes = {}
+    for symbol in symbols:
+        try:
+            closes[symbol] = data[symbol]['Close'] if isinstance(data.columns, pd.MultiIndex) else data['Close']
+        except KeyError:
+            continue
+    return pd.DataFrame(closes)
+
+
+def fetch_rates(pairs):
+    """{<MOEDA>BRL: taxa} de todos os pares numa única chamada (0.0 = sem taxa)."""
+    currency_list = [currency_of(p) for p in pairs]
+    try:
+        closes = download_closes(symbols_for(currency_list), period="5d")
+    except Exception as e:
+        print(f"[WARN] Falha no download do câmbio: {e}")
+        return {p: 0.0 for p in pairs}
+    crosses = cross_series(closes, currency_list)
+    rates = {}
+    for p, currency in zip(pairs, currency_list):
+        valid = crosses[currency].dropna() if currency in crosses else pd.Series(dtype=float)
+        rates[p] = float(valid.iloc[-1]) if not valid.empty else 0.0
+    return rates
+
+
+def fallback_rate(currency, table=None):
+    """Taxa de segurança (stablecoins seguem o dólar da tabela). None se não houver."""
+    table = table or {}
+    if currency in USD_PEGGED:
+        return table.get(PIVOT_CURRENCY) or FALLBACK_RATES[PIVOT_CURRENCY]
+    return FALLBACK_RATES.get(currency)
+
+
+def with_fallbacks(table, currency_list):
+    """Completa a tabela {moeda: taxa} com os fallbacks; moeda sem taxa nenhuma fica como BRL."""
+    table = dict(table)
+    table[BASE_CURRENCY] = 1.0
+    for currency in currency_list:
+        if table.get(currency, 0.0) > 0:
+            continue
+        rate = fallback_rate(currency, table)
+        if rate is None:
+            print(f"[ERRO] Câmbio {currency}/BRL indisponível e sem fallback, tratando como BRL")
+            rate = 1.0
+        else:
+            print(f"[WARN] Câmbio {currency}/BRL indisponível, usando fallback R$ {rate:.2f}")
+        table[currency] = rate
+    return table
+
+
+def rates_for(moedas, table):
+    """Taxa de cada linha por lookup na tabela {moeda: taxa} (moeda desconhecida vale 1)."""
+    codes = normalize(moedas)
+    return codes.map(table).fillna(1.0).astype(float)
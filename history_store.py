@@ -0,0 +1,125 @@
+"""
+Espelho local (Parquet) da aba 'history', particionado por mês.
+
+Cada mês é um arquivo `month=AAAA-MM/history.parquet`; gravar o dia de hoje só
+reescreve a partição do mês corrente, e a leitura pode filtrar meses sem
+abrir o histórico inteiro. O arquivo `_synced_at` guarda quando o espelho foi
+sincronizado pela última vez com a planilha (fim de uma execução local): o
+dashboard só confia no espelho se a planilha não mudou depois disso.
+
+downsample_history reduz o histórico para os gráficos do dashboard: a
+resolução (diária, semanal, mensal...) é escolhida pelo intervalo exibido,
+de modo que cada série nunca passa de CHART_MAX_POINTS pontos.
+"""
+import os
+
+import pandas as pd
+
+# --- CONFIG ---
+HISTORY_MIRROR_PATH = os.environ.get('HISTORY_MIRROR_PATH', os.path.join('.cache', 'history'))
+HISTORY_COLUMNS = ["Data", "Categoria", "Patrimonio", "Investido", "Resultado_R$", "Rentabilidade_%"]
+HISTORY_KEY_COLUMNS = ["Data", "Categoria"]
+NUMERIC_COLUMNS = ["Patrimonio", "Investido", "Resultado_R$", "Rentabilidade_%"]
+SYNC_MARKER = '_synced_at'
+
+# Pontos por série enviados aos gráficos e resoluções tentadas, da mais fina para a mais grossa
+CHART_MAX_POINTS = 400
+CHART_RESOLUTIONS = ['D', 'W', 'M', 'Q', 'Y']
+
+
+def normalize_history(df):
+    """Tipos fixos do histórico: Data como datetime, Categoria como texto, resto float."""
+    df = df.reindex(columns=HISTORY_COLUMNS).copy()
+    df['Data'] = pd.to_datetime(df['Data'], errors='coerce')
+    df['Categoria'] = df['Categoria'].astype(str)
+    for col in NUMERIC_COLUMNS:
+        df[col] = pd.to_numeric(df[col], errors='coerce').astype(float)
+    return df.dropna(subset=['Data'])
+
+
+class HistoryMirror:
+    def __init__(self, root=HISTORY_MIRROR_PATH):
+        self.root = root
+
+    def _partition_path(self, month):
+        return os.path.join(self.root, f"month={month}", "history.parquet")
+
+    def exists(self):
+        return os.path.isdir(self.root) and any(
+            name.startswith('month=') for name in os.listdir(self.root)
+        )
+
+    def mark_synced(self, when=None):
+        """Registra (UTC) que o espelho está em dia com a planilha; chamado depois da última escrita da execução."""
+        if not self.exists():
+            return
+        when = pd.Timestamp(when) if when is not None else pd.Timestamp.now(tz='UTC')
+        with open(os.path.join(self.root, SYNC_MARKER), 'w') as f:
+            f.write(when.isoformat())
+
+    def synced_at(self):
+        """Quando o espelho foi sincronizado com a planilha (Timestamp UTC) ou None."""
+        try:
+            with open(os.path.join(self.root, SYNC_MARKER)) as f:
+                when = pd.Timestamp(f.read().strip())
+        except (OSError, ValueError):
+            return None
+        return when.tz_localize('UTC') if when.tzinfo is None else when
+
+    def upsert(self, df):
+        """Grava as linhas substituindo as que tiverem a mesma (Data, Categoria)."""
+        df = normalize_history(df)
+        for month, part in df.groupby(df['Data'].dt.strftime('%Y-%m')):
+            path = self._partition_path(month)
+            if os.path.exists(path):
+                part = pd.concat([pd.read_parquet(path), part], ignore_index=True)
+            part = part.drop_duplicates(subset=HISTORY_KEY_COLUMNS, keep='last').sort_values(HISTORY_KEY_COLUMNS)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = path + '.tmp'
+            part.to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, path)
+
+    def read(self, start=None, end=None):
+        """Histórico completo (ou só os meses entre `start` e `end`), já sem duplicatas."""
+        if not self.exists():
+            return pd.DataFrame(columns=HISTORY_COLUMNS)
+
+        months = sorted(name[len('month='):] for name in os.listdir(self.root) if name.startswith('month='))
+        if start is not None:
+            months = [m for m in months if m >= pd.Timestamp(start).strftime('%Y-%m')]
+        if end is not None:
+            months = [m for m in months if m <= pd.Timestamp(end).strftime('%Y-%m')]
+        parts = [pd.read_parquet(self._partition_path(m)) for m in months if os.path.exists(self._partition_path(m))]
+        if not parts:
+            return pd.DataFrame(columns=HISTORY_COLUMNS)
+
+        df = pd.concat(parts, ignore_index=True)
+        if start is not None:
+            df = df[df['Data'] >= pd.Timestamp(start)]
+        if end is not None:
+            df = df[df['Data'] <= pd.Timestamp(end)]
+        return df.reset_index(drop=True)
+
+
+# --- AMOSTRAGEM PARA GRÁFICOS ---
+def chart_resolution(start, end, max_points=CHART_MAX_POINTS):
+    """Resolução mais fina (frequência de período do pandas) em que o intervalo cabe em `max_points` pontos."""
+    for freq in CHART_RESOLUTIONS:
+        if len(pd.period_range(start, end, freq=freq)) <= max_points:
+            return freq
+    return CHART_RESOLUTIONS[-1]
+
+
+def downsample_history(df, freq):
+    """
+    Um ponto por Categoria em cada período de `freq`: o último registro do período
+    (patrimônio e rentabilidade são saldos, vale o fechamento). Todas as Categorias
+    do período vão para a mesma data (a última do período), para o gráfico empilhado.
+    """
+    if freq == 'D' or df.empty:
+        return df
+    df = df.sort_values('Data', kind='stable').reset_index(drop=True)
+    period = df['Data'].dt.to_period(freq)
+    last = df.groupby([df['Categoria'], period], observed=True, sort=False).tail(1).copy()
+    last['Data'] = last['Data'].groupby(period[last.index]).transform('max')
+    return last.sort_values(['Data', 'Categoria'], kind='stable').reset_index(drop=True)
@@ -0,0 +1,269 @@
+"""
+Livro de operações: posições (quantidade, preço médio e lucro realizado)
+derivadas das compras e vendas da aba 'trades'.
+
+Cada linha da aba é uma operação: Data, Ticker, Classe, Operação (C/V),
+Quantidade, Preço e, opcionais, Taxas e Moeda. As operações são aplicadas na
+ordem das linhas:
+
+- compra sobre posição comprada (ou zerada) soma à quantidade e o preço médio
+  passa a ser o custo total (com as taxas) dividido pela quantidade;
+- venda sobre posição comprada realiza (preço - médio) * quantidade - taxas;
+- venda além da posição (ou sobre posição vendida) abre/aumenta a posição
+  vendida, com o prêmio líquido das taxas como preço médio: é assim que entram
+  as pernas vendidas de opções (Direção 'V' na carteira);
+- compra sobre posição vendida realiza (médio - preço) * quantidade - taxas.
+
+O estado de cada (Classe, Ticker) fica num checkpoint local (SQLite) junto
+com o número de linhas já aplicadas e a última delas: cada execução lê só as
+linhas novas da aba. Se a última linha aplicada mudou ou a aba encolheu, o
+livro é reprocessado do zero. A aba é tratada como só de acréscimos: para
+corrigir uma operação antiga, apague o checkpoint (LEDGER_PATH).
+"""
+import os
+import sqlite3
+import time
+
+import pandas as pd
+
+import schema
+
+# --- CONFIG ---
+LEDGER_PATH = os.environ.get('LEDGER_PATH', os.path.join('.cache', 'ledger.sqlite'))
+LEDGER_COLUMNS = ["Data", "Ticker", "Classe", "Operação", "Quantidade", "Preço", "Taxas", "Moeda"]
+REQUIRED_LEDGER_COLUMNS = ["Data", "Ticker", "Classe", "Operação", "Quantidade", "Preço"]
+
+# Layout da aba 'positions' (posições derivadas, inclusive as zeradas com lucro realizado)
+POSITIONS_COLUMNS = [
+    "Ticker", "Classe", "Moeda", "Direção", "Quantidade", "Preço Médio",
+    "Custo (Moeda Origem)", "Lucro Realizado", "Operações", "Abertura", "Última Operação"
+]
+POSITIONS_KEY_COLUMNS = ["Ticker", "Classe"]
+
+SIDES = {'C': 'C', 'COMPRA': 'C', 'BUY': 'C', 'V': 'V', 'VENDA': 'V', 'SELL': 'V'}
+QTY_EPSILON = 1e-9 # quantidades fracionárias (cripto): abaixo disso a posição está zerada
+
+
+# --- MOTOR ---
+def new_state(moeda='BRL'):
+    return {'qty': 0.0, 'avg': 0.0, 'realized': 0.0, 'trades': 0, 'opened': '', 'last': '', 'moeda': moeda}
+
+
+def apply_trade(state, side, qty, price, fees=0.0, day=''):
+    """Aplica uma operação ao estado da posição (quantidade com sinal: negativa = vendida)."""
+    signed = qty if side == 'C' else -qty
+    held = state['qty']
+    if abs(held) < QTY_EPSILON or (held > 0) == (signed > 0):
+        # Abre ou aumenta: o médio da compra inclui as taxas, o da venda desconta
+        cost = abs(held) * state['avg'] + qty * price + (fees if signed > 0 else -fees)
+        if abs(held) < QTY_EPSILON:
+            state['opened'] = day
+        state['qty'] = held + signed
+        state['avg'] = cost / abs(state['qty'])
+    else:
+        # Reduz, zera ou inverte: a parte que fecha realiza o resultado com taxas proporcionais
+        closing = min(qty, abs(held))
+        closing_fees = fees * closing / qty
+        direction = 1.0 if held > 0 else -1.0
+        state['realized'] += direction * closing * (price - state['avg']) - closing_fees
+        state['qty'] = held + signed
+        rest = qty - closing
+        if rest > QTY_EPSILON:
+            state['avg'] = price + (fees - closing_fees) / rest * (1.0 if signed > 0 else -1.0)
+            state['opened'] = day
+        elif abs(state['qty']) < QTY_EPSILON:
+            state['qty'], state['avg'] = 0.0, 0.0
+    state['trades'] += 1
+    state['last'] = day
+    return state
+
+
+def parse_trades(header, rows):
+    """Linhas da aba -> DataFrame de operações válidas (as inválidas são avisadas e ignoradas)."""
+    header = [str(h).strip() for h in header]
+    missing = [c for c in REQUIRED_LEDGER_COLUMNS if c not in header]
+    if missing:
+        raise ValueError(f"colunas faltando na aba de operações: {missing}")
+    trades = pd.DataFrame([list(r) + [''] * (len(header) - len(r)) for r in rows], columns=header, dtype=object)
+    trades = trades.reindex(columns=LEDGER_COLUMNS, fill_value='')
+    for col in ('Ticker', 'Classe'):
+        trades[col] = trades[col].astype(str).str.strip()
+    trades['Operação'] = trades['Operação'].astype(str).str.strip().str.upper().map(SIDES)
+    trades['Moeda'] = trades['Moeda'].astype(str).str.strip().replace('', 'BRL')
+    trades['Data'] = schema.parse_days(trades['Data'])
+    for col in ('Quantidade', 'Preço', 'Taxas'):
+        trades[col] = schema.parse_numbers(trades[col].replace('', 0))
+
+    valid = (trades['Ticker'] != '') & trades['Operação'].notna() & (trades['Quantidade'] > 0) & (trades['Preço'] >= 0)
+    valid &= trades['Taxas'].notna()
+    blank = (trades[['Ticker', 'Operação']].isna() | (trades[['Ticker', 'Operação']] == '')).all(axis=1)
+    if (~valid & ~blank).any():
+        print(f"[WARN] {int((~valid & ~blank).sum())} operação(ões) inválida(s) ignorada(s) na aba de operações")
+    return trades[valid]
+
+
+def fold(positions, trades):
+    """Aplica as operações (na ordem) ao dicionário {(Classe, Ticker): estado}."""
+    for classe, ticker, side, qty, price, fees, moeda, day in zip(
+        trades['Classe'], trades['Ticker'], trades['Operação'], trades['Quantidade'],
+        trades['Preço'], trades['Taxas'], trades['Moeda'], trades['Data']
+    ):
+        state = positions.setdefault((classe, ticker), new_state(moeda))
+        apply_trade(state, side, float(qty), float(price), float(fees), day)
+    return positions
+
+
+def positions_frame(positions):
+    """Estados -> tabela da aba 'positions' (colunas POSITIONS_COLUMNS)."""
+    rows = []
+    for (classe, ticker), s in positions.items():
+        qty = s['qty']
+        rows.append([
+            ticker, classe, s['moeda'], 'V' if qty < 0 else 'C', abs(qty), s['avg'],
+            abs(qty) * s['avg'], s['realized'], s['trades'], s['opened'], s['last'],
+        ])
+    return pd.DataFrame(rows, columns=POSITIONS_COLUMNS)
+
+
+# --- CHECKPOINT ---
+class LedgerStore:
+    """Checkpoint local do livro: linhas já aplicadas e estado de cada posição, por aba."""
+
+    def __init__(self, path=LEDGER_PATH):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                ledger TEXT PRIMARY KEY,
+                rows INTEGER NOT NULL,
+                last_row TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS positions (
+                ledger TEXT NOT NULL,
+                classe TEXT NOT NULL,
+                ticker TEXT NOT NULL,
+                qty REAL NOT NULL,
+                avg REAL NOT NULL,
+                realized REAL NOT NULL,
+                trades INTEGER NOT NULL,
+                opened TEXT NOT NULL,
+                last TEXT NOT NULL,
+                moeda TEXT NOT NULL,
+                PRIMARY KEY (ledger, classe, ticker)
+            );
+            """
+        )
+        self.conn.commit()
+
+    def load(self, ledger):
+        """(linhas aplicadas, última linha aplicada, {(Classe, Ticker): estado}); (0, '', {}) se não houver."""
+        row = self.conn.execute("SELECT rows, last_row FROM checkpoints WHERE ledger = ?", (ledger,)).fetchone()
+        if row is None:
+            return 0, '', {}
+        positions = {}
+        for classe, ticker, qty, avg, realized, trades, opened, last, moeda in self.conn.execute(
+            "SELECT classe, ticker, qty, avg, realized, trades, opened, last, moeda FROM positions WHERE ledger = ?",
+            (ledger,)
+        ):
+            positions[(classe, ticker)] = {'qty': qty, 'avg': avg, 'realized': realized, 'trades': trades,
+                                           'opened': opened, 'last': last, 'moeda': moeda}
+        return row[0], row[1], positions
+
+    def save(self, ledger, rows, last_row, positions):
+        with self.conn:
+            self.conn.execute("DELETE FROM positions WHERE ledger = ?", (ledger,))
+            self.conn.executemany(
+                "INSERT INTO positions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(ledger, c, t, s['qty'], s['avg'], s['realized'], s['trades'], s['opened'], s['last'], s['moeda'])
+                 for (c, t), s in positions.items()]
+            )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?)", (ledger, rows, last_row, time.time())
+            )
+
+    def close(self):
+        self.conn.close()
+
+
+def row_fingerprint(row):
+    """Conteúdo da linha (sem as células vazias do fim) para reconhecer a última linha aplicada."""
+    cells = [str(v).strip() for v in row]
+    while cells and cells[-1] == '':
+        cells.pop()
+    return '\t'.join(cells)
+
+
+def read_new_rows(store, tab, done, last_row):
+    """
+    Cabeçalho e linhas da aba depois das `done` já aplicadas, numa única leitura.
+    Retorna (cabeçalho, linhas novas, reconstruir), com reconstruir=True quando a
+    última linha aplicada não confere (aba editada): aí as linhas são todas.
+    """
+    # Linha 1 = cabeçalho; a linha `done` + 1 da aba é a última aplicada
+    header, tail = store.read_range(tab, done + 1 if done else 2)
+    if not done:
+        return header, tail, False
+    if tail and row_fingerprint(tail[0]) == last_row:
+        return header, tail[1:], False
+    header, rows = store.read_range(tab, 2)
+    return header, rows, True
+
+
+def sync(store, tab, checkpoint):
+    """
+    Aplica ao `checkpoint` (LedgerStore) as operações novas da aba `tab` do armazenamento.
+    Retorna ({(Classe, Ticker): estado}, nº de operações novas aplicadas, reconstruiu).
+    """
+    ledger = store.key(tab)
+    done, last_row, positions = checkpoint.load(ledger)
+    header, rows, rebuild = read_new_rows(store, tab, done, last_row)
+    while rows and not any(str(v).strip() for v in rows[-1]):
+        rows = rows[:-1]
+    if rebuild:
+        print(f"[INFO] Aba de operações alterada antes do checkpoint, reprocessando {len(rows)} linha(s)")
+        done, positions = 0, {}
+    if not rows:
+        if rebuild:
+            checkpoint.save(ledger, 0, '', positions)
+        return positions, 0, rebuild
+
+    trades = parse_trades(header, rows)
+    fold(positions, trades)
+    checkpoint.save(ledger, done + len(rows), row_fingerprint(rows[-1]), positions)
+    return positions, len(trades), rebuild
+
+
+# --- CARTEIRA ---
+def apply_positions(df, positions):
+    """
+    Substitui Quantidade, Preço Médio e Direção da carteira pelas posições do livro.
+    Lotes do mesmo (Classe, Ticker) viram uma linha (a primeira guarda os demais campos),
+    posições zeradas saem e posições que não estão na carteira entram com os dados do livro.
+    Ativos sem operações (ex: Renda Fixa lançada à mão) continuam como estão.
+    """
+    keys = list(zip(df['Classe'].astype(str).str.strip(), df['Ticker'].astype(str).str.strip()))
+    in_ledger = pd.Series([k in positions for k in keys], index=df.index)
+    first = ~pd.Series(keys, index=df.index).duplicated()
+
+    manual = df[~in_ledger]
+    derived = df[in_ledger & first].copy()
+    derived_keys = [k for k, keep in zip(keys, in_ledger & first) if keep]
+    derived['Quantidade'] = [abs(positions[k]['qty']) for k in derived_keys]
+    derived['Preço Médio'] = [positions[k]['avg'] for k in derived_keys]
+    derived['Direção'] = ['V' if positions[k]['qty'] < 0 else 'C' for k in derived_keys]
+
+    derived = derived[derived['Quantidade'] >= QTY_EPSILON]
+
+    known = set(keys)
+    extra = pd.DataFrame([
+        {'Ticker': t, 'Classe': c, 'Quantidade': abs(s['qty']), 'Moeda': s['moeda'], 'Preço Médio': s['avg'],
+         'Manual Price': '', 'Direção': 'V' if s['qty'] < 0 else 'C', 'Data Início': s['opened'], 'Indexador': ''}
+        for (c, t), s in positions.items() if (c, t) not in known and abs(s['qty']) >= QTY_EPSILON
+    ], columns=df.columns)
+    # Ordem da carteira, com as posições novas no final
+    result = pd.concat([pd.concat([manual, derived]).sort_index(kind='stable'), extra], ignore_index=True, sort=False)
+    return result.fillna('')
@@ -0,0 +1,134 @@
+"""
+Calendário de mercado usado para planejar as buscas de cotação.
+
+- B3 (Acao, FII, ETF, Opcao): pregão nos dias úteis que não são feriado da
+  bolsa (nacionais, Carnaval, Sexta-feira Santa, Corpus Christi, véspera de
+  Natal e último dia útil do ano), das 10h até o fechamento.
+- Câmbio (USD/BRL): negociado de domingo à noite até sexta à noite.
+- Cripto: 24/7, qualquer cotação pode ter mudado.
+
+`quote_still_valid` diz se uma cotação buscada em `fetched_at` ainda é a
+resposta atual, isto é, se o mercado dela não negociou desde então.
+"""
+from datetime import date, datetime, time, timedelta
+from functools import lru_cache
+
+from zoneinfo import ZoneInfo
+
+MARKET_TZ = ZoneInfo("America/Sao_Paulo")
+
+# Abertura e horário a partir do qual o preço de fechamento do dia já está
+# estável no Yahoo (fechamento + call de fechamento + atraso da cotação)
+B3_OPEN = time(10, 0)
+B3_SETTLED = time(18, 30)
+
+# Câmbio: fecha sexta e reabre domingo às 17h de Nova York (~19h de Brasília)
+FX_WEEKEND_START = (4, time(19, 0)) # (dia da semana, hora)
+FX_WEEKEND_END = (6, time(19, 0))
+
+# Fonte -> mercado
+SOURCE_MARKETS = {
+    'yfinance': 'b3',
+    'opcoes_net': 'b3',
+    'fx': 'fx',
+    'binance': 'crypto',
+}
+
+
+def easter(year):
+    """Domingo de Páscoa (algoritmo de Meeus/Jones/Butcher)."""
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return date(year, month, day + 1)
+
+
+@lru_cache(maxsize=None)
+def b3_holidays(year):
+    """Dias sem pregão na B3 além dos fins de semana."""
+    pascoa = easter(year)
+    holidays = {
+        date(year, 1, 1),               # Confraternização Universal
+        pascoa - timedelta(days=48),    # Carnaval (segunda)
+        pascoa - timedelta(days=47),    # Carnaval (terça)
+        pascoa - timedelta(days=2),     # Sexta-feira Santa
+        date(year, 4, 21),              # Tiradentes
+        date(year, 5, 1),               # Dia do Trabalho
+        pascoa + timedelta(days=60),    # Corpus Christi
+        date(year, 9, 7),               # Independência
+        date(year, 10, 12),             # Nossa Senhora Aparecida
+        date(year, 11, 2),              # Finados
+        date(year, 11, 15),             # Proclamação da República
+        date(year, 12, 24),             # Véspera de Natal
+        date(year, 12, 25),             # Natal
+    }
+    if year >= 2024:
+        holidays.add(date(year, 11, 20)) # Consciência Negra (feriado nacional desde 2024)
+    # Último dia útil do ano não tem pregão
+    last = date(year, 12, 31)
+    while last.weekday() >= 5 or last in holidays:
+        last -= timedelta(days=1)
+    holidays.add(last)
+    return frozenset(holidays)
+
+
+def is_b3_trading_day(day):
+    return day.weekday() < 5 and day not in b3_holidays(day.year)
+
+
+def _local(ts):
+    return datetime.fromtimestamp(ts, MARKET_TZ)
+
+
+def b3_is_open(ts):
+    """`ts` em segundos (epoch). Pregão aberto (ou fechamento ainda não estabilizado)?"""
+    now = _local(ts)
+    return is_b3_trading_day(now.date()) and B3_OPEN <= now.time() < B3_SETTLED
+
+
+def b3_last_settled(ts):
+    """Epoch do último fechamento estável da B3 antes de `ts`."""
+    now = _local(ts)
+    day = now.date()
+    if not (is_b3_trading_day(day) and now.time() >= B3_SETTLED):
+        day -= timedelta(days=1)
+        while not is_b3_trading_day(day):
+            day -= timedelta(days=1)
+    return datetime.combine(day, B3_SETTLED, MARKET_TZ).timestamp()
+
+
+def _fx_weekend_start(now):
+    """Início (datetime) do último fechamento de fim de semana do câmbio até `now`."""
+    weekday, at = FX_WEEKEND_START
+    start = datetime.combine(now.date() - timedelta(days=(now.weekday() - weekday) % 7), at, MARKET_TZ)
+    return start if start <= now else start - timedelta(days=7)
+
+
+def fx_is_open(ts):
+    now = _local(ts)
+    start = _fx_weekend_start(now)
+    weekday, at = FX_WEEKEND_END
+    end = datetime.combine(start.date() + timedelta(days=(weekday - start.weekday()) % 7), at, MARKET_TZ)
+    return not (start <= now < end)
+
+
+def quote_still_valid(source, fetched_at, now, expiry=None):
+    """
+    True se a cotação de `source` buscada em `fetched_at` (epoch) não pode ter
+    mudado até `now`: mercado fechado desde a busca ou opção já vencida (`expiry`, date).
+    """
+    if expiry is not None and expiry < _local(now).date():
+        return True
+    market = SOURCE_MARKETS.get(source)
+    if market == 'b3':
+        return not b3_is_open(now) and fetched_at >= b3_last_settled(now)
+    if market == 'fx':
+        return not fx_is_open(now) and fetched_at >= _fx_weekend_start(_local(now)).timestamp()
+    return False # Cripto (24/7) e fontes desconhecidas sempre vão à rede
@@ -0,0 +1,144 @@
+"""
+Cotação de opções via opcoes.net.br.
+
+Usa uma sessão HTTP compartilhada (keep-alive + pool de conexões) e um parser
+incremental em lxml que lê a página em pedaços e para assim que encontra a
+célula "Ult" da primeira linha da tabela de cotações.
+
+0.0 é a cotação de uma opção sem negócio ("-" na célula); erro de rede ou página
+fora do formato esperado devolve None, para a camada de resiliência tentar de
+novo e contar a falha no circuito da fonte.
+"""
+import threading
+
+import requests
+from lxml import etree
+from requests.adapters import HTTPAdapter
+
+# --- CONFIG ---
+OPCOES_NET_URL = "https://opcoes.net.br/{ticker}"
+OPCOES_NET_TIMEOUT = 10
+OPCOES_NET_POOL_SIZE = 4
+CHUNK_SIZE = 16 * 1024
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+}
+
+# Sessão única por processo (requests.Session é seguro para GETs concorrentes no mesmo pool)
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+
+def get_session():
+    global _SESSION
+    with _SESSION_LOCK:
+        if _SESSION is None:
+            session = requests.Session()
+            session.headers.update(HEADERS)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=OPCOES_NET_POOL_SIZE)
+            session.mount("https://", adapter)
+            _SESSION = session
+    return _SESSION
+
+def parse_br_number(raw_value):
+    """Tratamento Brasil -> Python ("1.234,56" -> 1234.56). Vazio ou "-" vira 0.0."""
+    clean_value = raw_value.strip().replace('.', '').replace(',', '.')
+    if not clean_value or clean_value == '-':
+        return 0.0
+    return float(clean_value)
+
+def _text(element):
+    return ''.join(element.itertext())
+
+def parse_opcoes_net_price(chunks, ticker=''):
+    """
+    Extrai o último preço ("Ult") da tabela "top-buffer-20" a partir de pedaços
+    (bytes) do HTML. Interrompe a leitura assim que a célula alvo é fechada.
+    Retorna None se a página não tiver a tabela, a coluna ou a linha esperadas.
+    """
+    parser = etree.HTMLPullParser(events=('start', 'end'))
+
+    table_found = False
+    table_depth = 0      # > 0 enquanto estamos dentro da tabela alvo
+    section = None       # 'thead' ou 'tbody'
+    header_rows = []     # células de cada linha do cabeçalho
+    ult_index = None
+    target_index = None
+    body_cells = None    # células da primeira linha do corpo
+
+    for chunk in chunks:
+        parser.feed(chunk)
+        for event, element in parser.read_events():
+            tag = element.tag if isinstance(element.tag, str) else ''
+
+            if table_depth == 0:
+                # 1. Localiza a tabela específica pela classe única "top-buffer-20"
+                if table_found:
+                    continue
+                if event == 'start' and tag == 'table' and 'top-buffer-20' in (element.get('class') or '').split():
+                    table_found = True
+                    table_depth = 1
+                continue
+
+            if tag == 'table':
+                table_depth += 1 if event == 'start' else -1
+                continue
+
+            if event == 'start':
+                if tag == 'thead' and section is None:
+                    section = 'thead'
+                elif tag == 'tbody' and section != 'tbody':
+                    section = 'tbody'
+                elif tag == 'tr' and section == 'thead':
+                    header_rows.append([])
+                elif tag == 'tr' and section == 'tbody' and body_cells is None:
+                    body_cells = []
+                continue
+
+            # event == 'end'
+            if section == 'thead':
+                if tag in ('td', 'th') and header_rows:
+                    header_rows[-1].append(_text(element))
+                elif tag == 'thead':
+                    # 2. Mapeamento do Cabeçalho
+                    # A tabela tem 2 linhas de header; a última tem "Min, Pri, Med, Ult..."
+                    cols = header_rows[-1] if header_rows else []
+                    # IMPORTANTE: o primeiro "Ult" é o da cotação, não o da volatilidade
+                    ult_index = next((i for i, col in enumerate(cols) if "Ult" in col), -1)
+                    if ult_index == -1:
+                        print(f"[WARN] Coluna 'Ult' não encontrada no cabeçalho.")
+                        return None
+                    # O TRUQUE DO OFFSET:
+                    # A linha de dados tem uma célula a mais no início (a Data) que não existe
+                    # na segunda linha do cabeçalho (por causa do rowspan).
+                    target_index = ult_index + 1
+
+            elif section == 'tbody' and body_cells is not None:
+                if tag == 'td':
+                    body_cells.append(_text(element))
+                    # 3. Extração do Dado: para no primeiro "Ult" do corpo
+                    if target_index is not None and len(body_cells) > target_index:
+                        return parse_br_number(body_cells[target_index])
+                elif tag in ('tr', 'tbody'):
+                    return None
+
+        if table_found and table_depth == 0:
+            break # Tabela alvo já terminou sem o dado
+
+    if not table_found:
+        print(f"[WARN] Tabela principal não encontrada para {ticker}")
+    return None
+
+def get_price_opcoes_net(ticker):
+    """Último preço da opção (0.0 = sem negócio) ou None se a busca falhar."""
+    clean_ticker = ticker.replace('.SA', '').upper()
+    url = OPCOES_NET_URL.format(ticker=clean_ticker)
+
+    try:
+        with get_session().get(url, timeout=OPCOES_NET_TIMEOUT, stream=True) as response:
+            if response.status_code != 200:
+                print(f"[WARN] opcoes.net respondeu {response.status_code} para {clean_ticker}")
+                return None
+            return parse_opcoes_net_price(response.iter_content(chunk_size=CHUNK_SIZE), clean_ticker)
+    except Exception as e:
+        print(f"[ERRO SCRAPING] {clean_ticker}: {e}")
+        return None
@@ -0,0 +1,271 @@
+"""
+Motor de opções (Classe 'Opcao'): Black-Scholes em lote sobre o livro inteiro.
+
+Para cada opção com Strike, Vencimento e ativo objeto cotado calcula, em uma
+única passada vetorizada (NumPy):
+
+- volatilidade implícita a partir do preço de mercado (Newton em lote com
+  bisseção de segurança dentro de um intervalo que sempre contém a raiz);
+- preço teórico, usado como fonte de reserva quando o opcoes.net falha
+  (com a última volatilidade implícita guardada no cache de cotações);
+- delta, gamma, vega e theta por opção e da posição (Direção 'V' inverte o sinal).
+
+Modelo europeu sem dividendos, tempo em dias úteis da B3 / 252 e taxa livre de
+risco contínua a partir do CDI anual.
+"""
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+from market_calendar import b3_holidays
+
+# --- CONFIG ---
+BUSINESS_DAYS_YEAR = 252
+IV_BOUNDS = (1e-4, 5.0)     # 0,01% a 500% a.a.
+IV_TOLERANCE = 1e-6         # erro de preço aceito (R$)
+IV_MAX_ITER = 100
+IV_CACHE_SOURCE = 'iv'      # fonte usada no QuoteCache para a última vol implícita de cada opção
+IV_CACHE_MAX_AGE = 30 * 24 * 60 * 60
+
+# Letra da série no ticker da B3 (5º caractere): A-L calls (jan-dez), M-X puts (jan-dez)
+CALL_SERIES = set("ABCDEFGHIJKL")
+PUT_SERIES = set("MNOPQRSTUVWX")
+
+GREEKS_COLUMNS = [
+    "Ticker", "Ativo Objeto", "Tipo", "Direção", "Quantidade", "Strike", "Vencimento",
+    "Spot", "Dias Úteis", "Preço Mercado", "Preço Teórico", "Vol Implícita (%)", "Fonte Vol",
+    "Delta", "Gamma", "Vega", "Theta", "Delta (R$)", "Gamma (R$)", "Vega (R$)", "Theta (R$/dia)",
+]
+GREEKS_KEY_COLUMNS = ["Ticker"]
+
+
+# --- BLACK-SCHOLES VETORIZADO ---
+def _erfc(z):
+    """erfc com erro relativo < 1.2e-7 (aproximação de Chebyshev, Numerical Recipes)."""
+    a = np.abs(z)
+    t = 1.0 / (1.0 + 0.5 * a)
+    poly = -a * a - 1.26551223 + t * (1.00002368 + t * (0.37409196 + t * (0.09678418 + t * (-0.18628806 + t * (
+        0.27886807 + t * (-1.13520398 + t * (1.48851587 + t * (-0.82215223 + t * 0.17087277))))))))
+    r = t * np.exp(poly)
+    return np.where(z >= 0, r, 2.0 - r)
+
+
+def norm_cdf(x):
+    return 0.5 * _erfc(-np.asarray(x, dtype=float) / np.sqrt(2.0))
+
+
+def norm_pdf(x):
+    return np.exp(-0.5 * np.asarray(x, dtype=float) ** 2) / np.sqrt(2.0 * np.pi)
+
+
+def _d1_d2(spot, strike, years, rate, vol):
+    sqrt_t = np.sqrt(years)
+    d1 = (np.log(spot / strike) + (rate + 0.5 * vol * vol) * years) / (vol * sqrt_t)
+    return d1, d1 - vol * sqrt_t
+
+
+def bs_price(spot, strike, years, rate, vol, is_call):
+    """Preço Black-Scholes (arrays alinhados). No vencimento (years = 0) vale o intrínseco."""
+    spot, strike, years, vol = (np.asarray(a, dtype=float) for a in (spot, strike, years, vol))
+    live = (years > 0) & (vol > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        d1, d2 = _d1_d2(spot, strike, years, rate, vol)
+        discount = strike * np.exp(-rate * years)
+        call = spot * norm_cdf(d1) - discount * norm_cdf(d2)
+        put = discount * norm_cdf(-d2) - spot * norm_cdf(-d1)
+    intrinsic = np.where(is_call, np.maximum(spot - strike, 0.0), np.maximum(strike - spot, 0.0))
+    return np.where(live, np.where(is_call, call, put), intrinsic)
+
+
+def bs_greeks(spot, strike, years, rate, vol, is_call):
+    """
+    Gregas por opção: delta, gamma (por R$ do objeto), vega (por 1 p.p. de vol)
+    e theta (R$ por dia útil). Opções vencidas ou sem vol têm gregas zeradas.
+    """
+    spot, strike, years, vol = (np.asarray(a, dtype=float) for a in (spot, strike, years, vol))
+    live = (years > 0) & (vol > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        d1, d2 = _d1_d2(spot, strike, years, rate, vol)
+        sqrt_t = np.sqrt(years)
+        pdf = norm_pdf(d1)
+        discount = strike * np.exp(-rate * years)
+        delta = np.where(is_call, norm_cdf(d1), norm_cdf(d1) - 1.0)
+        gamma = pdf / (spot * vol * sqrt_t)
+        vega = spot * pdf * sqrt_t
+        decay = -spot * pdf * vol / (2.0 * sqrt_t)
+        theta = np.where(is_call, decay - rate * discount * norm_cdf(d2), decay + rate * discount * norm_cdf(-d2))
+    zero = lambda a: np.where(live, a, 0.0)
+    return {
+        'delta': zero(delta),
+        'gamma': zero(gamma),
+        'vega': zero(vega) / 100,
+        'theta': zero(theta) / BUSINESS_DAYS_YEAR,
+    }
+
+
+def implied_vol(price, spot, strike, years, rate, is_call):
+    """
+    Volatilidade implícita de todas as opções de uma vez. Newton a partir de um
+    chute inicial; quando o passo sai do intervalo [lo, hi] (que sempre contém a
+    raiz, pois o preço cresce com a vol) cai para bisseção. NaN quando o preço
+    está fora dos limites de não-arbitragem ou a opção já venceu.
+    """
+    price, spot, strike, years = (np.asarray(a, dtype=float) for a in (price, spot, strike, years))
+    n = len(price)
+    lo = np.full(n, IV_BOUNDS[0])
+    hi = np.full(n, IV_BOUNDS[1])
+    lower = bs_price(spot, strike, years, rate, lo, is_call)
+    upper = bs_price(spot, strike, years, rate, hi, is_call)
+    solvable = (years > 0) & (price > 0) & (price >= lower) & (price <= upper)
+
+    # Chute de Brenner-Subrahmanyam (bom perto do dinheiro), limitado ao intervalo
+    with np.errstate(divide='ignore', invalid='ignore'):
+        guess = np.sqrt(2 * np.pi / years) * price / spot
+    vol = np.clip(np.nan_to_num(guess, nan=0.3), 0.05, 2.0)
+
+    active = solvable.copy()
+    for _ in range(IV_MAX_ITER):
+        if not active.any():
+            break
+        idx = np.flatnonzero(active)
+        diff = bs_price(spot[idx], strike[idx], years[idx], rate, vol[idx], is_call[idx]) - price[idx]
+        done = np.abs(diff) < IV_TOLERANCE
+        active[idx[done]] = False
+
+        # Preço acima do alvo: a raiz está abaixo da vol atual
+        above = diff > 0
+        hi[idx] = np.where(above, vol[idx], hi[idx])
+        lo[idx] = np.where(above, lo[idx], vol[idx])
+
+        vega = bs_greeks(spot[idx], strike[idx], years[idx], rate, vol[idx], is_call[idx])['vega'] * 100
+        with np.errstate(divide='ignore', invalid='ignore'):
+            step = vol[idx] - diff / vega
+        inside = np.isfinite(step) & (step > lo[idx]) & (step < hi[idx])
+        new_vol = np.where(inside, step, 0.5 * (lo[idx] + hi[idx]))
+        vol[idx] = np.where(done, vol[idx], new_vol)
+
+    return np.where(solvable, vol, np.nan)
+
+
+# --- LIVRO DE OPÇÕES DA CARTEIRA ---
+def option_type(tickers, tipo=None):
+    """True para call. Usa a coluna 'Tipo' (CALL/PUT, C/P) e, sem ela, a letra da série no ticker."""
+    tickers = pd.Series(tickers).astype(str).str.strip().str.upper()
+    series = tickers.str[4]
+    inferred = pd.Series(np.where(series.isin(CALL_SERIES), 'C', np.where(series.isin(PUT_SERIES), 'P', '')), index=tickers.index)
+    if tipo is not None:
+        given = pd.Series(tipo, index=tickers.index).astype(str).str.strip().str.upper().str[:1]
+        inferred = given.where(given.isin(['C', 'P']), inferred)
+    return inferred
+
+
+def underlyings(df):
+    """
+    Ativo objeto de cada opção da carteira ({índice: ticker}). Vem da coluna
+    'Ativo Objeto'; sem ela, usa o ativo da carteira com a mesma raiz do ticker (ex: PETR).
+    """
+    classes = df['Classe'].astype(str).str.strip()
+    tickers = df['Ticker'].astype(str).str.strip().str.upper()
+    options = classes == 'Opcao'
+    given = df['Ativo Objeto'].astype(str).str.strip().str.upper() if 'Ativo Objeto' in df.columns else pd.Series('', index=df.index)
+
+    roots = {}
+    for ticker in tickers[classes.isin(['Acao', 'ETF', 'FII'])]:
+        roots.setdefault(ticker[:4], ticker)
+    result = {}
+    for idx in df.index[options]:
+        underlying = given[idx] or roots.get(tickers[idx][:4], '')
+        if underlying:
+            result[idx] = underlying
+    return result
+
+
+def business_days_to(expiries, today):
+    """Dias úteis da B3 de amanhã até o vencimento (inclusive); 0 no dia do vencimento ou depois."""
+    valid = pd.notna(expiries)
+    if not valid.any():
+        return np.zeros(len(expiries))
+    last = max(e for e in expiries[valid])
+    holidays = [d for year in range(today.year, max(last.year, today.year) + 1) for d in b3_holidays(year)]
+    start = np.datetime64(today + timedelta(days=1))
+    ends = np.array([np.datetime64(e + timedelta(days=1)) if v else start for e, v in zip(expiries, valid)])
+    days = np.busday_count(start, ends, holidays=np.array(holidays, dtype='datetime64[D]'))
+    return np.maximum(days, 0).astype(float)
+
+
+def price_book(df, quotes, rate, spot_quotes, stale=(), cached_vols=None, today=None):
+    """
+    Livro de opções da carteira com preço teórico, vol implícita e gregas.
+
+    `quotes` é {ticker: preço de mercado} das opções (0 = sem cotação), `spot_quotes`
+    {ticker: preço} dos ativos objeto, `rate` o CDI anual e `cached_vols` a última vol
+    implícita conhecida de cada opção. Cotações em `stale` (servidas pelo cache) não
+    recalibram a vol. Retorna um DataFrame com GREEKS_COLUMNS indexado como `df`
+    (só as opções modeláveis).
+    """
+    today = today or date.today()
+    cached_vols = cached_vols or {}
+    objects = underlyings(df)
+    rows = df.loc[list(objects)]
+    if rows.empty:
+        return pd.DataFrame(columns=GREEKS_COLUMNS)
+
+    tickers = rows['Ticker'].astype(str).str.strip()
+    spot = np.array([spot_quotes.get(objects[i], 0.0) for i in rows.index], dtype=float)
+    strike = pd.to_numeric(rows['Strike'], errors='coerce').to_numpy(dtype=float) if 'Strike' in rows.columns else np.full(len(rows), np.nan)
+    expiry = pd.to_datetime(rows['Vencimento'].astype(str), errors='coerce') if 'Vencimento' in rows.columns else pd.Series(pd.NaT, index=rows.index)
+    kind = option_type(tickers, rows['Tipo'] if 'Tipo' in rows.columns else None).to_numpy()
+
+    ok = (spot > 0) & (strike > 0) & expiry.notna().to_numpy() & (kind != '')
+    rows, tickers, spot, strike, expiry, kind = rows[ok], tickers[ok], spot[ok], strike[ok], expiry[ok], kind[ok]
+    if rows.empty:
+        return pd.DataFrame(columns=GREEKS_COLUMNS)
+
+    is_call = kind == 'C'
+    days = business_days_to(np.array([e.date() for e in expiry], dtype=object), today)
+    years = days / BUSINESS_DAYS_YEAR
+    r = float(np.log1p(rate))
+
+    market = np.array([quotes.get(t, 0.0) for t in tickers], dtype=float)
+    fresh = market > 0
+    fresh &= np.array([t not in stale for t in tickers])
+    vol = np.full(len(rows), np.nan)
+    vol[fresh] = implied_vol(market[fresh], spot[fresh], strike[fresh], years[fresh], r, is_call[fresh])
+    from_market = np.isfinite(vol)
+    cached = np.array([cached_vols.get(t, np.nan) for t in tickers], dtype=float)
+    vol = np.where(from_market, vol, cached)
+    vol_source = np.where(from_market, 'mercado', np.where(np.isfinite(vol), 'cache', ''))
+
+    model_vol = np.nan_to_num(vol, nan=0.0)
+    theoretical = np.where(np.isfinite(vol) | (years == 0), bs_price(spot, strike, years, r, model_vol, is_call), np.nan)
+    greeks = bs_greeks(spot, strike, years, r, model_vol, is_call)
+
+    direction = rows['Direção'].astype(str).str.strip().str.upper() if 'Direção' in rows.columns else pd.Series('C', index=rows.index)
+    qty = pd.to_numeric(rows['Quantidade'], errors='coerce').fillna(0.0).to_numpy()
+    position = qty * np.where(direction == 'V', -1.0, 1.0)
+
+    return pd.DataFrame({
+        "Ticker": tickers,
+        "Ativo Objeto": [objects[i] for i in rows.index],
+        "Tipo": np.where(is_call, 'CALL', 'PUT'),
+        "Direção": direction,
+        "Quantidade": qty,
+        "Strike": strike,
+        "Vencimento": expiry.dt.strftime("%Y-%m-%d"),
+        "Spot": spot,
+        "Dias Úteis": days,
+        "Preço Mercado": market,
+        "Preço Teórico": theoretical,
+        "Vol Implícita (%)": vol * 100,
+        "Fonte Vol": vol_source,
+        "Delta": greeks['delta'],
+        "Gamma": greeks['gamma'],
+        "Vega": greeks['vega'],
+        "Theta": greeks['theta'],
+        # Posição: delta em R$ de exposição ao objeto, gamma como variação do delta (R$) para 1% no objeto
+        "Delta (R$)": position * greeks['delta'] * spot,
+        "Gamma (R$)": position * greeks['gamma'] * spot * spot / 100,
+        "Vega (R$)": position * greeks['vega'],
+        "Theta (R$/dia)": position * greeks['theta'],
+    }, index=rows.index)[GREEKS_COLUMNS]
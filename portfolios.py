@@ -0,0 +1,198 @@
+"""
+Execução em lote de várias carteiras (planilhas e/ou abas de carteira).
+
+Cada carteira é "PLANILHA" ou "PLANILHA:ABA" (aba da carteira; padrão 'wallet').
+As carteiras são lidas uma a uma e as cotações são buscadas uma única vez
+sobre a união de todas elas: o mesmo (fonte, ticker) em vários lotes ou em
+várias carteiras vira uma só chamada, o câmbio sai de um único download e as
+vols implícitas das opções são calibradas uma vez. Depois cada carteira é
+valorizada e gravada na própria planilha de forma independente: a falha de
+uma (planilha sem acesso, colunas faltando, erro na escrita) não interrompe
+as demais e aparece no resumo do fim.
+
+Abas de saída: com a aba padrão da carteira valem 'prices', 'history' e
+'greeks'; com outra aba (ex: 'wallet_joao') as saídas levam o sufixo
+('prices_joao', 'history_joao', 'greeks_joao', e o livro de operações é
+'trades_joao'), para que várias carteiras possam morar na mesma planilha. O espelho local do histórico também é
+separado por carteira (a carteira padrão continua no espelho do dashboard).
+"""
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+import update_prices as up
+from history_store import HISTORY_MIRROR_PATH
+
+# --- CONFIG ---
+PORTFOLIO_MIRRORS_PATH = os.path.join(os.path.dirname(HISTORY_MIRROR_PATH) or '.', 'history_portfolios')
+
+
+# --- CARTEIRAS ---
+def output_suffix(wallet_tab):
+    """Sufixo das abas de saída: vazio para a aba padrão, 'joao' para 'wallet_joao'."""
+    if wallet_tab == up.TAB_WALLET:
+        return ''
+    suffix = wallet_tab[len(up.TAB_WALLET):] if wallet_tab.startswith(up.TAB_WALLET) else wallet_tab
+    return '_' + (suffix.strip('_- ') or wallet_tab)
+
+
+def parse_portfolio(spec):
+    """'PLANILHA[:ABA]' -> dict com a planilha, a aba da carteira, as abas de saída e o espelho local."""
+    sheet, _, wallet_tab = spec.strip().partition(':')
+    sheet, wallet_tab = sheet.strip(), wallet_tab.strip() or up.TAB_WALLET
+    if not sheet:
+        raise ValueError(f"carteira sem planilha: '{spec}'")
+    suffix = output_suffix(wallet_tab)
+    name = sheet if wallet_tab == up.TAB_WALLET else f"{sheet}:{wallet_tab}"
+    if sheet == up.SHEET_NAME and not suffix:
+        mirror_root = HISTORY_MIRROR_PATH
+    else:
+        mirror_root = os.path.join(PORTFOLIO_MIRRORS_PATH, re.sub(r'[^\w-]+', '_', name))
+    return {
+        'name': name,
+        'sheet': sheet,
+        'wallet': wallet_tab,
+        'prices': up.TAB_PRICES + suffix,
+        'history': up.TAB_HISTORY + suffix,
+        'greeks': up.TAB_GREEKS + suffix,
+        'trades': up.TAB_LEDGER + suffix,
+        'positions': up.TAB_POSITIONS + suffix,
+        'mirror': mirror_root,
+    }
+
+
+def load_portfolios(specs=(), path=None):
+    """Carteiras da linha de comando e do arquivo (uma por linha, '#' comenta), sem repetição."""
+    specs = list(specs)
+    if path:
+        with open(path, encoding='utf-8') as f:
+            specs += [line.split('#', 1)[0] for line in f]
+    portfolios = {}
+    for spec in specs:
+        if not spec.strip():
+            continue
+        portfolio = parse_portfolio(spec)
+        portfolios.setdefault(portfolio['name'], portfolio)
+    return list(portfolios.values())
+
+
+def read_wallets(open_store, portfolios, phase):
+    """
+    Abre cada planilha uma única vez (`open_store(planilha)` devolve o armazenamento
+    dela, ver storage.py) e lê, numa só leitura em lote, as abas de carteira e de
+    preços de todas as carteiras dela.
+    Retorna ({nome: (armazenamento, carteira, aba de preços atual)}, {nome: erro}, [armazenamentos abertos]).
+    """
+    stores, values = {}, {}
+    wallets, errors = {}, {}
+    for sheet in dict.fromkeys(p['sheet'] for p in portfolios):
+        tabs = [tab for p in portfolios if p['sheet'] == sheet for tab in (p['wallet'], p['prices'])]
+        try:
+            with phase(f"read_sheet:{sheet}"):
+                stores[sheet] = open_store(sheet)
+                values[sheet] = stores[sheet].read_values(list(dict.fromkeys(tabs)))
+        except Exception as e:
+            print(f"[ERRO] Planilha '{sheet}': falha na leitura: {e}")
+            for p in portfolios:
+                if p['sheet'] == sheet:
+                    errors[p['name']] = f"leitura: {e}"
+
+    for portfolio in portfolios:
+        name = portfolio['name']
+        if portfolio['sheet'] not in values:
+            continue
+        store, sheet_values = stores[portfolio['sheet']], values[portfolio['sheet']]
+        try:
+            with phase(f"read_wallet:{name}"):
+                df = up.read_wallet(store, portfolio['wallet'], portfolio['trades'], portfolio['positions'],
+                                    values=sheet_values[portfolio['wallet']])
+        except Exception as e:
+            print(f"[ERRO] Carteira '{name}': falha na leitura: {e}")
+            errors[name] = f"leitura: {e}"
+            continue
+        if df is None:
+            errors[name] = "colunas obrigatórias faltando"
+        elif df.empty:
+            print(f"[WARN] Carteira '{name}' vazia, ignorada")
+            errors[name] = "carteira vazia"
+        else:
+            wallets[name] = (store, df, sheet_values[portfolio['prices']])
+    return wallets, errors, list(stores.values())
+
+
+def union_wallet(wallets):
+    """Todas as carteiras numa só tabela (índice próprio) e o nome da carteira de cada linha."""
+    frames = [df for _, df, _ in wallets.values()]
+    union = pd.concat(frames, ignore_index=True, sort=False).fillna('')
+    owners = np.repeat(list(wallets), [len(df) for df in frames])
+    return union, owners
+
+
+# --- LOTE ---
+def write_portfolio(portfolio, store, df_prices, book, phase, current=None):
+    """Grava as abas de saída de uma carteira (criadas na primeira vez). Retorna o erro da aba 'prices' (None se gravou)."""
+    name = portfolio['name']
+    with phase(f"write_prices:{name}"):
+        summary = up.write_prices(store, df_prices, portfolio['prices'], current)
+    if book is not None and not book.empty:
+        with phase(f"write_greeks:{name}"):
+            up.write_greeks(store, book, portfolio['greeks'])
+    with phase(f"write_history:{name}"):
+        up.write_history(store, df_prices, portfolio['history'], portfolio['mirror'])
+    return None if summary is not None else f"falha ao gravar a aba '{portfolio['prices']}'"
+
+
+def run_batch(open_store, portfolios, phase=up._no_phase):
+    """
+    Atualiza todas as carteiras com uma única busca de cotações.
+    Retorna ({nome: df_prices}, {nome: erro}, armazenamentos abertos).
+    """
+    by_name = {p['name']: p for p in portfolios}
+    wallets, errors, stores = read_wallets(open_store, portfolios, phase)
+    results = {}
+    if not wallets:
+        print("[ERRO] Nenhuma carteira pôde ser lida")
+        return results, errors, stores
+
+    union, owners = union_wallet(wallets)
+    print(f"--- {len(wallets)} carteira(s), {len(union)} posição(ões) no total ---")
+
+    cache, fixed_income = up.open_engines(union)
+    try:
+        with phase('fetch'):
+            quotes, fx, stale, book, model_quotes = up.fetch_all(union, cache, fixed_income)
+
+        for name, (store, _, current) in wallets.items():
+            print(f"--- Carteira '{name}' ---")
+            rows = union[owners == name]
+            try:
+                with phase(f"valuate:{name}"):
+                    df_prices, steps = up.valuate_wallet(rows, quotes, fx, stale, fixed_income, model_quotes)
+                print(f"Carteira valorizada: {len(df_prices)} posição(ões)")
+                up.record_fallbacks(rows, steps)
+                sub_book = book[book.index.isin(rows.index)] if book is not None else None
+                error = write_portfolio(by_name[name], store, df_prices, sub_book, phase, current)
+            except Exception as e:
+                print(f"[ERRO] Carteira '{name}': {e}")
+                errors[name] = str(e)
+                continue
+            results[name] = df_prices
+            if error:
+                errors[name] = error
+    finally:
+        up.close_engines(cache, fixed_income)
+    return results, errors, stores
+
+
+def print_summary(portfolios, results, errors):
+    print("--- Resumo das carteiras ---")
+    for portfolio in portfolios:
+        name = portfolio['name']
+        if name in errors:
+            print(f"   [ERRO] {name}: {errors[name]}")
+        else:
+            total = results[name]['Total (BRL)'].sum()
+            print(f"   [OK] {name}: {len(results[name])} posição(ões), R$ {total:,.2f}")
+    print(f"   -> {len(portfolios) - len(errors)} de {len(portfolios)} carteira(s) atualizada(s)")
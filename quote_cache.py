@@ -0,0 +1,106 @@
+"""
+Cache local (SQLite) das cotações, chaveado por (fonte, ticker).
+
+- Dentro do TTL da classe a cotação é reaproveitada e a rede nem é chamada.
+- Se a busca falhar, a última cotação boa é servida como "stale".
+- 0.0 só é guardado nas fontes em que zero é resposta (opção sem negócio).
+- O tamanho é limitado: as entradas mais antigas são descartadas.
+"""
+import os
+import sqlite3
+import time
+
+# --- CONFIG ---
+CACHE_PATH = os.environ.get('QUOTE_CACHE_PATH', os.path.join('.cache', 'quotes.sqlite'))
+CACHE_MAX_ENTRIES = 5000
+
+# TTL (segundos) por classe de ativo
+CACHE_TTLS = {
+    'Acao': 15 * 60,
+    'FII': 15 * 60,
+    'ETF': 15 * 60,
+    'Opcao': 15 * 60,
+    'Cripto': 60,
+    'FX': 15 * 60,
+}
+DEFAULT_TTL = 15 * 60
+
+# Idade máxima de uma cotação servida como stale após falha na fonte
+STALE_MAX_AGE = 7 * 24 * 60 * 60
+
+
+def ttl_for(classe):
+    return CACHE_TTLS.get(classe, DEFAULT_TTL)
+
+
+class QuoteCache:
+    def __init__(self, path=CACHE_PATH, max_entries=CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS quotes (
+                source TEXT NOT NULL,
+                ticker TEXT NOT NULL,
+                price REAL NOT NULL,
+                fetched_at REAL NOT NULL,
+                PRIMARY KEY (source, ticker)
+            )
+            """
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_quotes_fetched_at ON quotes (fetched_at)")
+        self.conn.commit()
+
+    def _row(self, source, ticker):
+        return self.conn.execute(
+            "SELECT price, fetched_at FROM quotes WHERE source = ? AND ticker = ?", (source, ticker)
+        ).fetchone()
+
+    def get_fresh(self, source, ticker, ttl):
+        """Preço em cache se ainda estiver dentro do TTL, senão None."""
+        row = self._row(source, ticker)
+        if row and time.time() - row[1] <= ttl:
+            return row[0]
+        return None
+
+    def get_stale(self, source, ticker, max_age=STALE_MAX_AGE):
+        """Última cotação boa (preço, fetched_at), ignorando o TTL. None se não existir."""
+        row = self._row(source, ticker)
+        if row and time.time() - row[1] <= max_age:
+            return row
+        return None
+
+    def put_many(self, source, prices, allow_zero=False):
+        """
+        Grava apenas cotações válidas (> 0; com `allow_zero`, >= 0) e aplica o limite de tamanho.
+        None (falha) nunca é gravado.
+        """
+        now = time.time()
+        rows = [(source, ticker, float(price), now) for ticker, price in prices.items()
+                if price is not None and (price > 0 or (allow_zero and price == 0))]
+        if not rows:
+            return
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO quotes (source, ticker, price, fetched_at) VALUES (?, ?, ?, ?)", rows
+        )
+        self.evict()
+        self.conn.commit()
+
+    def put(self, source, ticker, price):
+        self.put_many(source, {ticker: price})
+
+    def evict(self):
+        self.conn.execute(
+            """
+            DELETE FROM quotes WHERE rowid NOT IN (
+                SELECT rowid FROM quotes ORDER BY fetched_at DESC LIMIT ?
+            )
+            """,
+            (self.max_entries,),
+        )
+
+    def close(self):
+        self.conn.close()
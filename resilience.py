@@ -0,0 +1,164 @@
+"""
+Camada de resiliência das fontes de cotação (usada pelo FetchScheduler).
+
+Para cada chamada a uma fonte:
+- retries com backoff exponencial (com jitter), limitados em número e por um
+  prazo total por job, para que uma fonte degradada não segure a execução;
+- circuit breaker por fonte: depois de N falhas seguidas a fonte deixa de ser
+  chamada (falha rápida) até passar o tempo de espera, quando uma chamada de
+  teste decide se ela volta;
+- hedge: se a chamada passar do p95 de latência da fonte (medido nas chamadas
+  anteriores do processo), uma chamada duplicada é disparada e vale a primeira
+  resposta boa. Só para fontes idempotentes (leituras).
+
+Os fetchers devolvem {ticker: preço} com 0.0 quando falham em vez de lançar
+exceção; um resultado em que todos os preços são zero conta como falha.
+Breakers e latências são globais do processo (o modo daemon aproveita entre ciclos).
+"""
+import random
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+# --- CONFIG ---
+# attempts = tentativas por job, hedge_after = atraso do hedge antes de existir
+# histórico de latência (None = sem hedge), deadline = prazo total do job (s),
+# breaker_failures = falhas seguidas que abrem o circuito
+SOURCE_POLICIES = {
+    'yfinance': {'attempts': 3, 'hedge_after': 4.0, 'deadline': 45.0, 'breaker_failures': 3},
+    'binance': {'attempts': 3, 'hedge_after': 3.0, 'deadline': 30.0, 'breaker_failures': 3},
+    'opcoes_net': {'attempts': 2, 'hedge_after': 3.0, 'deadline': 20.0, 'breaker_failures': 5},
+    # As séries do BCB são gravadas no SQLite local: sem chamadas duplicadas
+    'bcb': {'attempts': 3, 'hedge_after': None, 'deadline': 60.0, 'breaker_failures': 3},
+}
+DEFAULT_POLICY = {'attempts': 2, 'hedge_after': None, 'deadline': 30.0, 'breaker_failures': 3}
+
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 4.0
+BREAKER_COOLDOWN = 5 * 60  # segundos com o circuito aberto até a chamada de teste
+
+HEDGE_PERCENTILE = 95
+HEDGE_MIN_SAMPLES = 5      # abaixo disso vale o hedge_after da política
+HEDGE_MIN_DELAY = 0.25
+LATENCY_WINDOW = 200       # últimas latências guardadas por fonte
+
+
+class SourceUnavailable(Exception):
+    """Circuito aberto: a fonte não é chamada nesta execução."""
+
+
+def policy_for(source):
+    return SOURCE_POLICIES.get(source, DEFAULT_POLICY)
+
+
+def failed_result(result):
+    """Dicionário de cotações sem nenhum preço válido conta como falha (vazio não)."""
+    if not isinstance(result, dict) or not result:
+        return False
+    return not any(isinstance(v, (int, float)) and v > 0 for v in result.values())
+
+
+def missing_quote(result):
+    """Cotação que não veio (None) conta como falha; 0.0 é resposta válida (ex: opção sem negócio)."""
+    return isinstance(result, dict) and any(v is None for v in result.values())
+
+
+def failed_history(result):
+    """Lote de séries históricas em que nenhum ativo trouxe fechamento conta como falha (vazio não)."""
+    if not isinstance(result, dict) or not result:
+        return False
+    return all(s is None or s.dropna().empty for s in result.values())
+
+
+def backoff_delay(attempt, rng=random):
+    """Espera antes da tentativa `attempt` + 1 (full jitter)."""
+    return rng.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """Fechado -> aberto após `failures` falhas seguidas -> meio-aberto após `cooldown` (uma chamada de teste)."""
+
+    def __init__(self, failures, cooldown=BREAKER_COOLDOWN, clock=time.monotonic):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.clock = clock
+        self.consecutive = 0
+        self.opened_at = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        return 'half_open' if self.clock() - self.opened_at >= self.cooldown else 'open'
+
+    def allow(self):
+        with self.lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def record(self, ok):
+        """Registra o resultado de uma chamada. Retorna True se o circuito acabou de abrir."""
+        with self.lock:
+            self.probing = False
+            if ok:
+                self.consecutive = 0
+                self.opened_at = None
+                return False
+            self.consecutive += 1
+            if self.opened_at is not None or self.consecutive >= self.failures:
+                just_opened = self.opened_at is None or self.clock() - self.opened_at >= self.cooldown
+                self.opened_at = self.clock()
+                return just_opened
+            return False
+
+
+class LatencyTracker:
+    """Últimas latências (s) de cada fonte; define o atraso do hedge pelo p95."""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self.samples = {}
+        self.window = window
+        self.lock = threading.Lock()
+
+    def record(self, source, seconds):
+        with self.lock:
+            self.samples.setdefault(source, deque(maxlen=self.window)).append(seconds)
+
+    def hedge_delay(self, source, policy):
+        if policy.get('hedge_after') is None:
+            return None
+        with self.lock:
+            samples = list(self.samples.get(source, ()))
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return policy['hedge_after']
+        return max(HEDGE_MIN_DELAY, float(np.percentile(samples, HEDGE_PERCENTILE)))
+
+
+# --- ESTADO DO PROCESSO ---
+_BREAKERS = {}
+_BREAKERS_LOCK = threading.Lock()
+LATENCIES = LatencyTracker()
+
+
+def breaker(source):
+    with _BREAKERS_LOCK:
+        if source not in _BREAKERS:
+            _BREAKERS[source] = CircuitBreaker(policy_for(source)['breaker_failures'])
+        return _BREAKERS[source]
+
+
+def reset():
+    """Fecha todos os circuitos e esquece as latências (nova execução no mesmo processo)."""
+    global LATENCIES
+    with _BREAKERS_LOCK:
+        _BREAKERS.clear()
+    LATENCIES = LatencyTracker()
@@ -0,0 +1,225 @@
+"""
+Análise de risco da carteira sobre uma matriz de retornos diários (NumPy).
+
+A partir da aba 'prices' (exposição em BRL de cada posição) e dos fechamentos
+históricos de cada ativo (os mesmos downloads em lote do backfill, em BRL e
+guardados num cache diário em Parquet) calcula:
+
+- volatilidade da carteira (diária e anualizada);
+- matriz de correlação (por ativo e por Classe);
+- contribuição de cada Classe para o risco (w_i * (Σw)_i / σ_p);
+- VaR histórico de 1 e 10 dias (janelas de 10 dias sobrepostas);
+- VaR Monte Carlo de 1 e 10 dias (log-retornos normais multivariados via
+  Cholesky; em 10 dias a soma de log-retornos é N(10μ, 10Σ)), em paralelo
+  num pool de processos quando o número de simulações é grande.
+
+Opções e Renda Fixa não têm série de preço de mercado e ficam fora do modelo
+(a exposição delas é reportada à parte).
+"""
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+# --- CONFIG ---
+RISK_CACHE_DIR = os.path.join('.cache', 'risk')
+LOOKBACK_DAYS = 2 * 365
+TRADING_DAYS_YEAR = 252
+CONFIDENCE = 0.95
+HORIZON_DAYS = 10
+
+MC_SIMULATIONS = 20000
+MC_PARALLEL_THRESHOLD = 50000 # a partir daqui as simulações vão para o pool de processos
+MC_MAX_WORKERS = os.cpu_count() or 2
+MC_CHUNK_FLOATS = 4_000_000   # tamanho máximo (em floats) de cada bloco simulado
+
+# Classes com série de preço de mercado (as demais ficam fora do modelo)
+MODELED_CLASSES = ['Acao', 'FII', 'ETF', 'Cripto']
+
+
+# --- MATRIZ DE RETORNOS ---
+def exposures(df_prices):
+    """Exposição em BRL por ativo (lotes somados) das Classes modeladas, na ordem da aba."""
+    classes = df_prices['Classe'].astype(str).str.strip()
+    modeled = df_prices[classes.isin(MODELED_CLASSES)].copy()
+    modeled['Ticker'] = modeled['Ticker'].astype(str).str.strip()
+    modeled['Classe'] = modeled['Classe'].astype(str).str.strip()
+    modeled['Total (BRL)'] = pd.to_numeric(modeled['Total (BRL)'], errors='coerce').fillna(0.0)
+    grouped = modeled.groupby(['Classe', 'Ticker'], sort=False).agg(
+        moeda=('Moeda', 'first'), exposure=('Total (BRL)', 'sum')
+    ).reset_index()
+    return grouped[grouped['exposure'] != 0].reset_index(drop=True)
+
+
+def _cache_path(day):
+    return os.path.join(RISK_CACHE_DIR, f"prices_{day.isoformat()}.parquet")
+
+
+def load_price_history(assets, lookback_days=LOOKBACK_DAYS, today=None):
+    """
+    Fechamentos diários em BRL (datas úteis da B3 x ativos, colunas 'Classe:Ticker').
+    Fica num cache diário em Parquet: só os ativos que faltam são baixados.
+    """
+    import backfill # downloads em lote (carrega o update_prices só quando precisa)
+
+    today = today or date.today()
+    start, end = today - timedelta(days=lookback_days), today - timedelta(days=1)
+    columns = [f"{c}:{t}" for c, t in zip(assets['Classe'], assets['Ticker'])]
+
+    path = _cache_path(today)
+    cached = pd.read_parquet(path) if os.path.exists(path) else pd.DataFrame()
+    missing = assets[[col not in cached.columns for col in columns]]
+    if missing.empty:
+        return cached[columns]
+
+    wallet = pd.DataFrame({'Ticker': missing['Ticker'], 'Classe': missing['Classe'], 'Moeda': missing['moeda']})
+    series, fx = backfill.fetch_history(wallet, start, end)
+    dates = backfill.backfill_dates(start, end)
+    prices = backfill.price_matrix(wallet, series, dates)
+    prices = prices * backfill.fx_matrix(wallet['Moeda'], fx, dates)
+
+    fetched = pd.DataFrame(prices, index=dates, columns=[f"{c}:{t}" for c, t in zip(missing['Classe'], missing['Ticker'])])
+    frame = fetched if cached.empty else cached.join(fetched, how='outer')
+    os.makedirs(RISK_CACHE_DIR, exist_ok=True)
+    for old in glob.glob(os.path.join(RISK_CACHE_DIR, "prices_*.parquet")):
+        if old != path:
+            os.remove(old)
+    frame.to_parquet(path)
+    return frame[columns]
+
+
+def returns_matrix(prices):
+    """Retornos simples diários (datas x ativos); ativos sem série completa são descartados."""
+    returns = prices.pct_change().iloc[1:]
+    returns = returns.loc[:, returns.notna().mean() > 0.9].fillna(0.0)
+    return returns
+
+
+# --- MÉTRICAS ---
+def historical_var(pnl, confidence=CONFIDENCE):
+    """VaR (valor positivo = perda) pelo quantil empírico do P&L."""
+    if len(pnl) == 0:
+        return 0.0
+    return float(-np.quantile(pnl, 1 - confidence))
+
+
+def horizon_returns(returns, horizon=HORIZON_DAYS):
+    """Retornos compostos em janelas sobrepostas de `horizon` dias (soma de log-retornos por cumsum)."""
+    log_cum = np.vstack([np.zeros(returns.shape[1]), np.cumsum(np.log1p(returns), axis=0)])
+    return np.expm1(log_cum[horizon:] - log_cum[:-horizon])
+
+
+def _cholesky(cov):
+    """Cholesky com um pequeno reforço na diagonal quando a covariância não é positiva definida."""
+    jitter = 0.0
+    scale = np.mean(np.diag(cov)) if len(cov) else 1.0
+    for _ in range(6):
+        try:
+            return np.linalg.cholesky(cov + np.eye(len(cov)) * jitter)
+        except np.linalg.LinAlgError:
+            jitter = scale * 1e-10 if jitter == 0 else jitter * 100
+    raise np.linalg.LinAlgError("covariância não é positiva semidefinida")
+
+
+def _simulate_chunk(args):
+    """Um bloco de simulações: devolve (P&L em 1 dia, P&L em `horizon` dias)."""
+    chol, mean, weights, n_sims, horizon, seed = args
+    rng = np.random.default_rng(seed)
+    one_day = rng.standard_normal((n_sims, len(weights))) @ chol.T + mean
+    # Soma de `horizon` log-retornos diários independentes: N(horizon * μ, horizon * Σ)
+    h_days = rng.standard_normal((n_sims, len(weights))) @ chol.T * np.sqrt(horizon) + mean * horizon
+    return np.expm1(one_day) @ weights, np.expm1(h_days) @ weights
+
+
+def monte_carlo_pnl(returns, weights, n_sims=MC_SIMULATIONS, horizon=HORIZON_DAYS, seed=0):
+    """P&L simulado (1 dia e `horizon` dias) com log-retornos normais correlacionados."""
+    log_returns = np.log1p(returns)
+    mean = log_returns.mean(axis=0)
+    chol = _cholesky(np.cov(log_returns, rowvar=False).reshape(len(weights), len(weights)))
+
+    chunk = max(100, MC_CHUNK_FLOATS // max(len(weights), 1))
+    tasks = []
+    for i, start in enumerate(range(0, n_sims, chunk)):
+        tasks.append((chol, mean, weights, min(chunk, n_sims - start), horizon, seed + i))
+
+    if n_sims >= MC_PARALLEL_THRESHOLD and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=min(MC_MAX_WORKERS, len(tasks))) as pool:
+            results = list(pool.map(_simulate_chunk, tasks))
+    else:
+        results = [_simulate_chunk(task) for task in tasks]
+    return np.concatenate([r[0] for r in results]), np.concatenate([r[1] for r in results])
+
+
+def analyze(df_prices, prices=None, n_sims=MC_SIMULATIONS, confidence=CONFIDENCE, seed=0):
+    """
+    Relatório de risco da carteira. `prices` (fechamentos em BRL, colunas 'Classe:Ticker')
+    pode ser passado pronto; senão vem do load_price_history.
+    """
+    assets = exposures(df_prices)
+    if prices is None:
+        prices = load_price_history(assets) if not assets.empty else pd.DataFrame()
+    returns = returns_matrix(prices) if not prices.empty else pd.DataFrame()
+
+    keys = [f"{c}:{t}" for c, t in zip(assets['Classe'], assets['Ticker'])]
+    modeled = assets[[k in returns.columns for k in keys]].reset_index(drop=True)
+    columns = [f"{c}:{t}" for c, t in zip(modeled['Classe'], modeled['Ticker'])]
+
+    classes = df_prices['Classe'].astype(str).str.strip()
+    total = float(pd.to_numeric(df_prices['Total (BRL)'], errors='coerce').fillna(0.0).sum())
+    report = {
+        'total_value': total,
+        'modeled_value': float(modeled['exposure'].sum()),
+        'unmodeled_value': total - float(modeled['exposure'].sum()),
+        'unmodeled_classes': sorted(set(classes) - set(MODELED_CLASSES)),
+        'n_assets': len(modeled),
+        'n_days': len(returns),
+    }
+    if modeled.empty or len(returns) < HORIZON_DAYS + 2:
+        return report
+
+    R = returns[columns].to_numpy()
+    w = modeled['exposure'].to_numpy()
+    cov = np.cov(R, rowvar=False).reshape(len(w), len(w))
+
+    # Volatilidade e contribuição para o risco (Euler): soma das contribuições = σ_p
+    sigma = float(np.sqrt(w @ cov @ w))
+    contribution = w * (cov @ w) / sigma if sigma > 0 else np.zeros_like(w)
+    by_class = pd.Series(contribution).groupby(modeled['Classe']).sum()
+
+    # Correlação por ativo e por Classe (retornos de cada Classe ponderados pela exposição)
+    sd = np.sqrt(np.diag(cov))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        corr = np.where(np.outer(sd, sd) > 0, cov / np.outer(sd, sd), 0.0)
+    np.fill_diagonal(corr, 1.0)
+    class_names = list(dict.fromkeys(modeled['Classe']))
+    onehot = (modeled['Classe'].to_numpy()[:, None] == np.array(class_names)[None, :]) * w[:, None]
+    class_returns = R @ (onehot / onehot.sum(axis=0))
+    class_corr = np.corrcoef(class_returns, rowvar=False).reshape(len(class_names), len(class_names))
+
+    pnl_1d = R @ w
+    pnl_10d = horizon_returns(R) @ w
+    mc_1d, mc_10d = monte_carlo_pnl(R, w, n_sims=n_sims, seed=seed)
+
+    value = float(w.sum())
+    report.update({
+        'vol_daily': sigma / value,
+        'vol_annual': sigma / value * np.sqrt(TRADING_DAYS_YEAR),
+        'var_hist_1d': historical_var(pnl_1d, confidence),
+        'var_hist_10d': historical_var(pnl_10d, confidence),
+        'var_mc_1d': historical_var(mc_1d, confidence),
+        'var_mc_10d': historical_var(mc_10d, confidence),
+        'confidence': confidence,
+        'n_sims': n_sims,
+        'risk_by_class': pd.DataFrame({
+            'Classe': by_class.index,
+            'Exposição (R$)': modeled.groupby('Classe')['exposure'].sum().reindex(by_class.index).to_numpy(),
+            'Contribuição (R$/dia)': by_class.to_numpy(),
+            'Contribuição (%)': by_class.to_numpy() / sigma * 100,
+        }),
+        'correlation': pd.DataFrame(corr, index=columns, columns=columns),
+        'class_correlation': pd.DataFrame(class_corr, index=class_names, columns=class_names),
+    })
+    return report
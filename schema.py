@@ -0,0 +1,177 @@
+"""
+Leitura tipada das abas (carteira, operações, prices, history, greeks, positions, runs).
+
+Cada aba tem um esquema declarado (coluna -> tipo) e vira DataFrame direto da
+matriz crua de valores (cabeçalho + linhas, como vem do values_batch_get ou do
+banco local), com a conversão feita por coluna inteira:
+
+- 'number': float; texto no formato brasileiro ('1.234,56', 'R$ 10,50', '12,5%')
+  também é aceito (vazio ou inválido vira NaN);
+- 'date': datetime (AAAA-MM-DD, DD/MM/AAAA, com ou sem hora, ou número serial
+  do Sheets);
+- 'day': data normalizada como texto AAAA-MM-DD, para colunas que voltam para a
+  planilha ou misturam marcadores (ex: Vencimento = 'Liquido'), que ficam como estão;
+- 'category': texto sem espaços nas pontas, como categoria (Classe, Moeda,
+  Ticker se repetem muito nas abas grandes).
+
+Colunas fora do esquema ficam como vieram (texto vazio para célula vazia).
+read_tabs lê várias abas numa única chamada ao armazenamento (storage.py).
+"""
+import re
+
+import pandas as pd
+from pandas.api.types import is_bool_dtype, is_datetime64_any_dtype, is_numeric_dtype
+
+# --- CONFIG ---
+SHEETS_EPOCH = pd.Timestamp('1899-12-30') # dia zero dos números seriais do Sheets
+
+_PRICES = {
+    'Ticker': 'category', 'Classe': 'category', 'Moeda': 'category',
+    'Quantidade': 'number', 'Preço Médio': 'number', 'Preço Atual': 'number',
+    'Total (Moeda Origem)': 'number', 'Total (BRL)': 'number',
+    'Lucro/Prej (R$)': 'number', 'Rentabilidade (%)': 'number', 'Vencimento': 'day',
+}
+
+# Esquema por aba (o prefixo do nome decide: 'prices_joao' usa o de 'prices')
+TAB_SCHEMAS = {
+    'wallet': {
+        'Ticker': 'category', 'Classe': 'category', 'Moeda': 'category',
+        'Quantidade': 'number', 'Preço Médio': 'number', 'Manual Price': 'number',
+        'Data Início': 'day', 'Vencimento': 'day',
+        # Colunas opcionais das opções (motor de gregas)
+        'Strike': 'number', 'Ativo Objeto': 'category', 'Tipo': 'category',
+    },
+    'trades': {
+        'Data': 'day', 'Quantidade': 'number', 'Preço': 'number', 'Taxas': 'number',
+    },
+    'prices': _PRICES,
+    'history': {
+        'Data': 'date', 'Categoria': 'category',
+        'Patrimonio': 'number', 'Investido': 'number', 'Resultado_R$': 'number', 'Rentabilidade_%': 'number',
+    },
+    'greeks': {
+        'Ticker': 'category', 'Ativo Objeto': 'category', 'Tipo': 'category', 'Vencimento': 'day',
+        'Quantidade': 'number', 'Strike': 'number', 'Spot': 'number', 'Dias Úteis': 'number',
+        'Preço Mercado': 'number', 'Preço Teórico': 'number', 'Vol Implícita (%)': 'number',
+        'Delta': 'number', 'Gamma': 'number', 'Vega': 'number', 'Theta': 'number',
+        'Delta (R$)': 'number', 'Gamma (R$)': 'number', 'Vega (R$)': 'number', 'Theta (R$/dia)': 'number',
+    },
+    'positions': {
+        'Ticker': 'category', 'Classe': 'category', 'Moeda': 'category',
+        'Quantidade': 'number', 'Preço Médio': 'number', 'Custo (Moeda Origem)': 'number',
+        'Lucro Realizado': 'number', 'Operações': 'number', 'Abertura': 'day', 'Última Operação': 'day',
+    },
+    'runs': {
+        'Início': 'date', 'Duração (s)': 'number', 'Posições': 'number', 'Chamadas': 'number',
+        'Falhas': 'number', 'Stale': 'number', 'Fallback Manual': 'number', 'Fallback Médio': 'number',
+        'Cache Hits': 'number',
+    },
+}
+
+_ISO_DATE = r'^\d{4}-\d{1,2}-\d{1,2}'
+_BR_DATE = r'^\d{1,2}/\d{1,2}/\d{4}'
+_SERIAL = r'^\d+(\.\d+)?$'
+
+
+def base_tab(tab):
+    """Nome da aba sem o sufixo da carteira ('history_joao' -> 'history')."""
+    return re.sub(r'_.*$', '', tab)
+
+
+def schema_for(tab):
+    return TAB_SCHEMAS.get(base_tab(tab), {})
+
+
+# --- CONVERSÕES (por coluna) ---
+def parse_numbers(series):
+    """
+    Coluna -> float. Números passam direto; texto com vírgula é lido no formato
+    brasileiro (ponto de milhar, vírgula decimal), sem vírgula como '1234.56'.
+    'R$', '%' e espaços são ignorados. Vazio ou inválido vira NaN.
+    """
+    values = pd.Series(series)
+    if is_numeric_dtype(values) and not is_bool_dtype(values):
+        return values.astype(float)
+    numbers = pd.to_numeric(values, errors='coerce').astype(float)
+    text_rows = numbers.isna() & values.notna()
+    if text_rows.any():
+        text = values[text_rows].astype(str).str.replace(r'R\$|%|\s', '', regex=True)
+        brazilian = text.str.contains(',', regex=False)
+        text = text.where(~brazilian, text.str.replace('.', '', regex=False).str.replace(',', '.', regex=False))
+        numbers[text_rows] = pd.to_numeric(text, errors='coerce')
+    return numbers
+
+
+def parse_dates(series):
+    """Coluna -> datetime (NaT no que não for data)."""
+    values = pd.Series(series)
+    if is_datetime64_any_dtype(values):
+        return values
+    text = values.astype(str).str.strip().str.replace('T', ' ', regex=False)
+    dates = pd.Series(pd.NaT, index=values.index, dtype='datetime64[ns]')
+    for pattern, formats in ((_ISO_DATE, ('%Y-%m-%d', '%Y-%m-%d %H:%M:%S')),
+                             (_BR_DATE, ('%d/%m/%Y', '%d/%m/%Y %H:%M:%S'))):
+        rows = text.str.match(pattern)
+        for fmt in formats:
+            todo = rows & dates.isna()
+            if todo.any():
+                dates[todo] = pd.to_datetime(text[todo], format=fmt, errors='coerce')
+    # Células de data lidas sem formatação chegam como número serial (dias desde 30/12/1899)
+    serial = dates.isna() & text.str.match(_SERIAL)
+    if serial.any():
+        dates[serial] = SHEETS_EPOCH + pd.to_timedelta(pd.to_numeric(text[serial]), unit='D')
+    return dates
+
+
+def parse_days(series):
+    """Coluna -> texto AAAA-MM-DD; o que não for data (vazio, 'Liquido') fica como estava."""
+    values = pd.Series(series)
+    dates = parse_dates(values)
+    text = values.astype(object).where(values.notna(), '').astype(str).str.strip()
+    return text.where(dates.isna(), dates.dt.strftime('%Y-%m-%d'))
+
+
+def parse_categories(series):
+    return pd.Series(series).astype(str).str.strip().astype('category')
+
+
+PARSERS = {
+    'number': parse_numbers,
+    'date': parse_dates,
+    'day': parse_days,
+    'category': parse_categories,
+}
+
+
+# --- ABAS ---
+def frame(values, tab):
+    """
+    Matriz crua da aba (cabeçalho + linhas) -> DataFrame tipado pelo esquema da aba.
+    None (aba inexistente) continua None; colunas sem nome no cabeçalho são descartadas.
+    """
+    if values is None:
+        return None
+    if not values:
+        return pd.DataFrame()
+    header = [str(h).strip() for h in values[0]]
+    width = len(header)
+    rows = values[1:]
+    if any(len(r) != width for r in rows):
+        rows = [list(r[:width]) + [''] * (width - len(r)) for r in rows]
+    df = pd.DataFrame(rows, columns=header, dtype=object)
+    df = df.loc[:, [bool(h) for h in header]]
+
+    schema = schema_for(tab)
+    for col in df.columns:
+        kind = schema.get(col)
+        if kind:
+            df[col] = PARSERS[kind](df[col])
+        else:
+            df[col] = df[col].where(df[col].notna(), '')
+    return df
+
+
+def read_tabs(store, tabs):
+    """{aba: DataFrame tipado ou None} de várias abas numa única leitura do armazenamento."""
+    values = store.read_values(tabs)
+    return {tab: frame(values.get(tab), tab) for tab in tabs}
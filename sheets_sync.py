@@ -0,0 +1,206 @@
+"""
+Escrita incremental no Google Sheets.
+
+Em vez de limpar a aba e reescrever tudo, lê o conteúdo atual, compara célula
+a célula (linhas casadas por chave, ex: Ticker/Classe) e envia só o que mudou
+num único batch_update. Linhas só são removidas/adicionadas quando as
+posições mudam, e a aba nunca fica vazia durante a atualização.
+
+Para abas que só crescem (histórico), upsert_rows atualiza no lugar as linhas
+cuja chave já existe e acrescenta as demais.
+
+Quem já conhece o conteúdo da aba (modo daemon) passa `current` e pula a
+leitura; hold_small_moves segura as linhas cujo preço quase não mudou.
+"""
+import math
+
+from gspread.utils import rowcol_to_a1
+
+# Células alteradas separadas por até este número de células iguais viram um único range
+MAX_RANGE_GAP = 2
+
+
+def _same(old, new):
+    """Compara o valor cru da planilha com o novo (números com tolerância)."""
+    if isinstance(new, float) and math.isnan(new):
+        new = ''
+    if isinstance(old, (int, float)) and isinstance(new, (int, float)) and not isinstance(new, bool):
+        return math.isclose(float(old), float(new), rel_tol=1e-9, abs_tol=1e-9)
+    return str(old) == str(new)
+
+
+def _row_keys(rows, key_indexes):
+    """Chave de cada linha; lotes repetidos do mesmo ativo ganham um contador."""
+    seen = {}
+    keys = []
+    for row in rows:
+        base = tuple(str(row[i]).strip() if i < len(row) else '' for i in key_indexes)
+        seen[base] = seen.get(base, 0) + 1
+        keys.append(base + (seen[base],))
+    return keys
+
+
+def _changed_ranges(row_number, old_row, new_row):
+    """Agrupa as células alteradas de uma linha em ranges contíguos."""
+    changed = [
+        col for col, value in enumerate(new_row)
+        if col >= len(old_row) or not _same(old_row[col], value)
+    ]
+    # Células que sobraram à direita (linha antiga mais larga) são limpas
+    changed += list(range(len(new_row), len(old_row)))
+    padded = list(new_row) + [''] * max(0, len(old_row) - len(new_row))
+
+    ranges = []
+    for col in changed:
+        if ranges and col - ranges[-1][1] <= MAX_RANGE_GAP + 1:
+            ranges[-1][1] = col
+        else:
+            ranges.append([col, col])
+    return [
+        {
+            'range': f"{rowcol_to_a1(row_number, start + 1)}:{rowcol_to_a1(row_number, end + 1)}",
+            'values': [padded[start:end + 1]],
+        }
+        for start, end in ranges
+    ]
+
+
+def sync_rows(ws, header, rows, key_columns, current=None):
+    """
+    Sincroniza a aba `ws` com `header` + `rows` enviando apenas as diferenças.
+    Linhas existentes mantêm a posição, novas posições vão para o final.
+    `current` (cabeçalho + linhas) evita reler a aba quando o conteúdo já é conhecido.
+    Retorna um resumo {'cells': ..., 'ranges': ..., 'added': ..., 'removed': ...,
+    'values': conteúdo da aba após a escrita}.
+    """
+    if current is None:
+        current = ws.get_all_values(value_render_option='UNFORMATTED_VALUE')
+    key_indexes = [header.index(col) for col in key_columns]
+
+    old_header = current[0] if current else []
+    if current and [str(h) for h in old_header] != list(header):
+        # Layout de colunas mudou: não dá para casar células, reescreve a aba
+        print("   [INFO] Cabeçalho diferente do atual, reescrevendo a aba inteira.")
+        ws.clear()
+        current = []
+
+    old_rows = current[1:]
+    old_keys = _row_keys(old_rows, key_indexes)
+    new_keys = _row_keys(rows, key_indexes)
+    new_by_key = dict(zip(new_keys, rows))
+
+    # 1. Remove linhas de posições que saíram da carteira (de baixo para cima, numa chamada só)
+    removed = [i for i, key in enumerate(old_keys) if key not in new_by_key]
+    if removed:
+        ws.spreadsheet.batch_update({'requests': [
+            {'deleteDimension': {'range': {
+                'sheetId': ws.id, 'dimension': 'ROWS', 'startIndex': i + 1, 'endIndex': i + 2
+            }}}
+            for i in sorted(removed, reverse=True)
+        ]})
+    kept = [(key, row) for key, row in zip(old_keys, old_rows) if key in new_by_key]
+
+    # 2. Layout final: linhas mantidas na posição atual + novas posições no final
+    kept_keys = {key for key, _ in kept}
+    added = [key for key in new_keys if key not in kept_keys]
+    layout = [(row, new_by_key[key]) for key, row in kept] + [([], new_by_key[key]) for key in added]
+
+    needed_rows = len(layout) + 1
+    if added and needed_rows > ws.row_count - len(removed):
+        ws.add_rows(needed_rows - (ws.row_count - len(removed)))
+
+    # 3. Diferenças célula a célula, enviadas num único batch_update
+    data = _changed_ranges(1, old_header if current else [], list(header))
+    for offset, (old_row, new_row) in enumerate(layout):
+        data += _changed_ranges(offset + 2, old_row, new_row)
+    if data:
+        ws.batch_update(data, raw=True)
+
+    return {
+        'cells': sum(len(d['values'][0]) for d in data),
+        'ranges': len(data),
+        'added': len(added),
+        'removed': len(removed),
+        'values': [list(header)] + [list(new_row) for _, new_row in layout],
+    }
+
+
+def hold_small_moves(current, header, rows, key_columns, column, threshold, derived_columns=()):
+    """
+    Linhas cujo `column` (ex: Preço Atual) variou menos que `threshold` (relativo)
+    em relação a `current` voltam com o conteúdo já publicado, e o sync_rows não
+    envia nada para elas. Só as `derived_columns` (calculadas a partir do preço)
+    podem diferir: qualquer outra mudança (ex: Quantidade) é sempre publicada.
+    Retorna (linhas, quantas foram seguradas).
+    """
+    if not current:
+        return rows, 0
+    key_indexes = [header.index(col) for col in key_columns]
+    col = header.index(column)
+    fixed = [i for i, name in enumerate(header) if name != column and name not in derived_columns]
+    published = dict(zip(_row_keys(current[1:], key_indexes), current[1:]))
+
+    held = 0
+    result = []
+    for key, row in zip(_row_keys(rows, key_indexes), rows):
+        old = published.get(key)
+        if (old is not None and len(old) == len(row) and _small_move(old[col], row[col], threshold)
+                and all(_same(old[i], row[i]) for i in fixed)):
+            result.append(list(old))
+            held += any(not _same(o, n) for o, n in zip(old, row))
+        else:
+            result.append(row)
+    return result, held
+
+
+def _small_move(old, new, threshold):
+    try:
+        old, new = float(old), float(new)
+    except (TypeError, ValueError):
+        return False
+    if math.isnan(old) or math.isnan(new):
+        return False
+    if old == 0:
+        return new == 0
+    return abs(new - old) / abs(old) < threshold
+
+
+def upsert_rows(ws, header, rows, key_columns):
+    """
+    Upsert idempotente: linhas cuja chave já existe na aba são atualizadas no
+    lugar, as demais são acrescentadas no final. Só as colunas-chave são lidas.
+    Retorna um resumo {'updated': ..., 'appended': ...}.
+    """
+    key_indexes = [header.index(col) for col in key_columns]
+    letters = [rowcol_to_a1(1, i + 1)[:-1] for i in key_indexes]
+    columns = ws.batch_get([f"{letter}:{letter}" for letter in letters])
+
+    n_rows = max((len(col) for col in columns), default=0)
+    if n_rows == 0:
+        # Aba vazia: cabeçalho + dados numa chamada
+        ws.append_rows([list(header)] + [list(r) for r in rows])
+        return {'updated': 0, 'appended': len(rows)}
+
+    def cell(col, r):
+        return str(col[r][0]).strip() if r < len(col) and col[r] else ''
+
+    # Chave -> número da linha na planilha (a última ocorrência vence)
+    existing = {}
+    for r in range(1, n_rows):
+        existing[tuple(cell(col, r) for col in columns)] = r + 1
+
+    last_col = rowcol_to_a1(1, len(header))[:-1]
+    data, appended = [], []
+    for row in rows:
+        key = tuple(str(row[i]).strip() for i in key_indexes)
+        if key in existing:
+            row_number = existing[key]
+            data.append({'range': f"A{row_number}:{last_col}{row_number}", 'values': [list(row)]})
+        else:
+            appended.append(list(row))
+
+    if data:
+        ws.batch_update(data, raw=True)
+    if appended:
+        ws.append_rows(appended)
+    return {'updated': len(data), 'appended': len(appended)}
@@ -0,0 +1,60 @@
+"""
+Registro das fontes externas de cotação, com import tardio.
+
+Cada fonte declara o módulo pesado de que depende (yfinance, ccxt, ...), e ele
+só é importado na primeira vez que a fonte é usada: uma carteira sem Cripto
+nunca paga o import do ccxt, uma sem Renda Fixa nunca carrega o fixed_income.
+"""
+import importlib
+import threading
+import time
+
+import telemetry
+
+# fonte -> módulo carregado sob demanda
+SOURCE_MODULES = {
+    'yfinance': 'yfinance',        # Acao, FII, ETF e o dólar (BRL=X)
+    'binance': 'ccxt',             # Cripto
+    'opcoes_net': 'opcoes_net',    # Opcao (requests + lxml)
+    'bcb': 'fixed_income',         # RendaFixa (séries do BCB)
+}
+
+_LOADED = {}
+_LOCK = threading.Lock()
+IMPORT_TIMES = {} # fonte -> segundos gastos no import
+
+
+def load(source):
+    """Devolve o módulo da fonte, importando-o na primeira chamada."""
+    with _LOCK:
+        if source not in _LOADED:
+            start = time.perf_counter()
+            _LOADED[source] = importlib.import_module(SOURCE_MODULES[source])
+            IMPORT_TIMES[source] = time.perf_counter() - start
+            telemetry.get().event('import', source=source, module=SOURCE_MODULES[source],
+                                  seconds=IMPORT_TIMES[source])
+        return _LOADED[source]
+
+
+def preload(names):
+    """
+    Importa as fontes de uma vez (na thread principal, antes do agendador).
+    Retorna as que não puderam ser carregadas, ex: pacote não instalado.
+    """
+    failed = []
+    for source in names:
+        try:
+            load(source)
+        except ImportError as e:
+            print(f"[WARN] Fonte '{source}' indisponível ({SOURCE_MODULES[source]}): {e}")
+            failed.append(source)
+    return failed
+
+
+def override(source, module):
+    """Troca o módulo de uma fonte (benchmarks com fontes falsas). Devolve o anterior; None desfaz."""
+    with _LOCK:
+        previous = _LOADED.pop(source, None)
+        if module is not None:
+            _LOADED[source] = module
+    return previous
@@ -0,0 +1,438 @@
+"""
+Armazenamento das abas do atualizador (wallet, trades, prices, history, greeks,
+positions, runs) atrás de uma interface única:
+
+- SheetsStore: Google Sheets via gspread (comportamento original: sync_rows /
+  upsert_rows, só as células que mudaram);
+- LocalStore: banco embutido (SQLite) com uma tabela por aba, leituras e
+  escritas em lote por coluna e índices nas chaves ((Data, Categoria) no
+  histórico, Ticker nas demais), que roda sem rede;
+- MirroredStore: o LocalStore é a fonte da verdade e cada escrita também é
+  enfileirada para o Sheets numa thread à parte (SheetsMirror), de modo que
+  a execução não espera a API do Sheets; o Sheets vira só a saída para o
+  Power BI.
+
+Interface comum (tabelas como DataFrame ou listas de linhas):
+    read_values(tabs) -> {aba: cabeçalho + linhas crus ou None}, todas numa só leitura
+    read(tab) -> DataFrame tipado pelo schema.py ou None (aba inexistente)
+    read_range(tab, first_row) -> (cabeçalho, linhas a partir da linha `first_row` da aba)
+    sync(tab, header, rows, key_columns, current=None) -> resumo do sync_rows
+    upsert(tab, header, rows, key_columns) -> {'updated', 'appended'}
+    append(tab, header, rows)
+    key(tab) -> identificador estável da aba (checkpoint do livro de operações)
+
+Uso:
+    python update_prices.py --storage local --import-sheets   # copia as abas do Sheets uma vez
+    python update_prices.py --storage local                   # roda offline sobre o banco local
+    python update_prices.py --storage local --mirror-sheets   # local + espelho assíncrono no Sheets
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import gspread
+import pandas as pd
+from gspread.utils import rowcol_to_a1
+
+import schema
+from sheets_sync import _row_keys, _same, sync_rows, upsert_rows
+
+# --- CONFIG ---
+STORAGE_ENV = 'PORTFOLIO_STORAGE'
+STORE_PATH = os.environ.get('PORTFOLIO_STORE_PATH', os.path.join('.cache', 'portfolio.sqlite'))
+STORE_DIR = os.path.dirname(STORE_PATH) or '.'
+MIRROR_FLUSH_TIMEOUT = 5 * 60 # espera máxima pelo espelho do Sheets no fim da execução
+# Leitura crua: números como número e datas como texto (o schema.py converte)
+SHEETS_READ_PARAMS = {'valueRenderOption': 'UNFORMATTED_VALUE', 'dateTimeRenderOption': 'FORMATTED_STRING'}
+
+# Índices do banco local por aba (o prefixo do nome da aba decide: 'history_joao' usa o do 'history').
+# Só o histórico tem chave única: na carteira o mesmo ativo pode ter vários lotes
+LOCAL_INDEXES = {
+    'history': (['Data', 'Categoria'], True),
+    'prices': (['Ticker', 'Classe'], False),
+    'greeks': (['Ticker'], False),
+    'positions': (['Ticker', 'Classe'], False),
+    'wallet': (['Ticker'], False),
+    'trades': (['Ticker'], False),
+}
+
+
+def local_path(sheet_name, default_sheet):
+    """Banco local de uma planilha: a planilha padrão usa STORE_PATH, as outras um arquivo próprio."""
+    if sheet_name == default_sheet:
+        return STORE_PATH
+    slug = re.sub(r'[^\w-]+', '_', sheet_name)
+    return os.path.join(STORE_DIR, f"portfolio_{slug}.sqlite")
+
+
+def _index_for(tab):
+    """(colunas, único) do índice da aba no banco local ('history_joao' usa o do 'history')."""
+    return LOCAL_INDEXES.get(schema.base_tab(tab), (None, False))
+
+
+def _quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _pad(values):
+    """Linhas completadas com '' até a largura da mais longa (a API corta as células vazias à direita)."""
+    width = max((len(r) for r in values), default=0)
+    return [r if len(r) == width else list(r) + [''] * (width - len(r)) for r in values]
+
+
+def _quote_a1(tab):
+    return "'" + str(tab).replace("'", "''") + "'"
+
+
+# --- GOOGLE SHEETS ---
+class SheetsStore:
+    """Abas de uma planilha do Google Sheets (gspread)."""
+
+    kind = 'sheets'
+
+    def __init__(self, sh):
+        self.sh = sh
+        self.title = sh.title
+
+    def key(self, tab):
+        return f"{getattr(self.sh, 'id', None) or self.title}:{tab}"
+
+    def worksheet(self, tab, header=None, rows=200):
+        """Aba existente; com `header`, a aba é criada vazia na primeira vez."""
+        try:
+            return self.sh.worksheet(tab)
+        except gspread.WorksheetNotFound:
+            if header is None:
+                raise
+            return self.sh.add_worksheet(title=tab, rows=rows, cols=len(header))
+
+    def tabs(self):
+        return [ws.title for ws in self.sh.worksheets()]
+
+    def read_values(self, tabs):
+        """
+        Várias abas num único values_batch_get. O intervalo é só o nome da aba, então a API
+        devolve todas as colunas preenchidas, seja qual for a largura. Se alguma aba não existir
+        a chamada inteira falha: aí as abas da planilha são listadas e a leitura é repetida só
+        com as que existem.
+        """
+        tabs = list(tabs)
+        if not tabs:
+            return {}
+        ranges = [_quote_a1(tab) for tab in tabs]
+        try:
+            result = self.sh.values_batch_get(ranges, params=SHEETS_READ_PARAMS)
+        except gspread.exceptions.APIError:
+            existing = set(self.tabs())
+            found = [tab for tab in tabs if tab in existing]
+            if len(found) == len(tabs):
+                raise
+            values = self.read_values(found)
+            return {tab: values.get(tab) for tab in tabs}
+        return {tab: _pad(r.get('values', [])) for tab, r in zip(tabs, result.get('valueRanges', []))}
+
+    def read(self, tab):
+        return schema.read_tabs(self, [tab])[tab]
+
+    def read_range(self, tab, first_row):
+        """
+        Cabeçalho e linhas a partir de `first_row` (1 = cabeçalho) numa única leitura,
+        até a última coluna da grade da aba (col_count, já vem com a aba).
+        """
+        options = {'value_render_option': 'UNFORMATTED_VALUE', 'date_time_render_option': 'FORMATTED_STRING'}
+        ws = self.worksheet(tab)
+        last = rowcol_to_a1(1, max(ws.col_count, 1)).rstrip('0123456789')
+        header, rows = ws.batch_get([f"A1:{last}1", f"A{first_row}:{last}"], **options)
+        return (header[0] if header else []), rows
+
+    def sync(self, tab, header, rows, key_columns, current=None):
+        return sync_rows(self.worksheet(tab, header), header, rows, key_columns, current=current)
+
+    def upsert(self, tab, header, rows, key_columns):
+        return upsert_rows(self.worksheet(tab, header, rows=1000), header, rows, key_columns)
+
+    def append(self, tab, header, rows):
+        try:
+            ws = self.sh.worksheet(tab)
+        except gspread.WorksheetNotFound:
+            ws = self.sh.add_worksheet(title=tab, rows=1000, cols=len(header))
+            ws.append_row(list(header))
+        ws.append_rows([list(r) for r in rows])
+
+
+# --- BANCO LOCAL ---
+class LocalStore:
+    """
+    Uma tabela SQLite por aba, com as mesmas colunas da planilha. As linhas ficam
+    na ordem de gravação (rowid), como na aba.
+    """
+
+    kind = 'local'
+
+    def __init__(self, path=STORE_PATH):
+        self.path = path
+        self.title = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS _meta (tab TEXT PRIMARY KEY, updated_at REAL NOT NULL)")
+        self.conn.commit()
+
+    def key(self, tab):
+        return f"local:{os.path.abspath(self.path)}:{tab}"
+
+    def tables(self):
+        names = self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name != '_meta'").fetchall()
+        return [n[0] for n in names]
+
+    def has(self, tab):
+        return tab in self.tables()
+
+    def columns(self, tab):
+        return [row[1] for row in self.conn.execute(f"PRAGMA table_info({_quote(tab)})")]
+
+    def last_modified(self):
+        """Última escrita em qualquer aba (epoch) ou None."""
+        row = self.conn.execute("SELECT MAX(updated_at) FROM _meta").fetchone()
+        return row[0] if row else None
+
+    def _ensure(self, tab, header):
+        """Cria a tabela (e o índice da aba) ou recria se o layout de colunas mudou."""
+        header = list(header)
+        existing = self.columns(tab)
+        if existing == header:
+            return
+        if existing:
+            print(f"   [INFO] Layout de colunas da tabela local '{tab}' mudou, recriando.")
+            self.conn.execute(f"DROP TABLE {_quote(tab)}")
+        self.conn.execute(f"CREATE TABLE {_quote(tab)} ({', '.join(_quote(c) for c in header)})")
+        columns, unique = _index_for(tab)
+        if columns and all(c in header for c in columns):
+            self.conn.execute(
+                f"CREATE {'UNIQUE ' if unique else ''}INDEX {_quote('idx_' + tab)} "
+                f"ON {_quote(tab)} ({', '.join(_quote(c) for c in columns)})"
+            )
+
+    def _touch(self, tab):
+        self.conn.execute("INSERT OR REPLACE INTO _meta VALUES (?, ?)", (tab, time.time()))
+
+    def _insert(self, tab, header, rows):
+        marks = ', '.join('?' for _ in header)
+        self.conn.executemany(
+            f"INSERT INTO {_quote(tab)} ({', '.join(_quote(c) for c in header)}) VALUES ({marks})",
+            [[None if isinstance(v, float) and v != v else v for v in row] for row in rows]
+        )
+
+    def values(self, tab, where=None, params=()):
+        """Cabeçalho + linhas (listas) na ordem de gravação, no formato do get_all_values; `where` usa os índices."""
+        if not self.has(tab):
+            return []
+        sql = f"SELECT * FROM {_quote(tab)}" + (f" WHERE {where}" if where else "") + " ORDER BY rowid"
+        cursor = self.conn.execute(sql, params)
+        return [[d[0] for d in cursor.description]] + [['' if v is None else v for v in row] for row in cursor]
+
+    def read_values(self, tabs):
+        existing = set(self.tables())
+        return {tab: self.values(tab) if tab in existing else None for tab in tabs}
+
+    def read(self, tab, where=None, params=()):
+        """Tabela inteira (ou filtrada por `where`) tipada pelo schema.py."""
+        if not self.has(tab):
+            return None
+        return schema.frame(self.values(tab, where, params), tab)
+
+    def read_range(self, tab, first_row):
+        """Como no Sheets: a linha 1 é o cabeçalho e a linha 2 o primeiro registro."""
+        if not self.has(tab):
+            raise gspread.WorksheetNotFound(tab)
+        cursor = self.conn.execute(
+            f"SELECT * FROM {_quote(tab)} ORDER BY rowid LIMIT -1 OFFSET ?", (max(first_row - 2, 0),)
+        )
+        return [d[0] for d in cursor.description], [['' if v is None else v for v in row] for row in cursor]
+
+    def sync(self, tab, header, rows, key_columns, current=None):
+        """
+        Substitui o conteúdo da tabela por `rows` numa transação.
+        O resumo conta as células que mudaram por chave, como o sync_rows.
+        """
+        key_indexes = [list(header).index(col) for col in key_columns]
+        if current is None:
+            current = self.values(tab)
+        old_rows = current[1:] if current and list(current[0]) == list(header) else []
+        old_by_key = dict(zip(_row_keys(old_rows, key_indexes), old_rows))
+        new_keys = _row_keys(rows, key_indexes)
+
+        cells, changed, added = 0, 0, 0
+        for key, row in zip(new_keys, rows):
+            old = old_by_key.get(key)
+            if old is None:
+                added += 1
+                cells += len(row)
+                continue
+            diff = sum(1 for o, n in zip(old, row) if not _same(o, n))
+            cells += diff
+            changed += diff > 0
+
+        with self.conn:
+            self._ensure(tab, header)
+            self.conn.execute(f"DELETE FROM {_quote(tab)}")
+            self._insert(tab, header, rows)
+            self._touch(tab)
+        return {
+            'cells': cells,
+            'ranges': changed + added,
+            'added': added,
+            'removed': len(set(old_by_key) - set(new_keys)),
+            'values': [list(header)] + [list(r) for r in rows],
+        }
+
+    def upsert(self, tab, header, rows, key_columns):
+        """Linhas com chave existente são substituídas, as demais acrescentadas (busca pelo índice das chaves)."""
+        key_indexes = [list(header).index(col) for col in key_columns]
+        with self.conn:
+            self._ensure(tab, header)
+            cols = ', '.join(_quote(c) for c in key_columns)
+            existing = {
+                tuple(str(v).strip() for v in row)
+                for row in self.conn.execute(f"SELECT {cols} FROM {_quote(tab)}")
+            }
+            updated = sum(1 for r in rows if tuple(str(r[i]).strip() for i in key_indexes) in existing)
+            where = ' AND '.join(f"{_quote(c)} = ?" for c in key_columns)
+            self.conn.executemany(f"DELETE FROM {_quote(tab)} WHERE {where}", [[r[i] for i in key_indexes] for r in rows])
+            self._insert(tab, header, rows)
+            self._touch(tab)
+        return {'updated': updated, 'appended': len(rows) - updated}
+
+    def append(self, tab, header, rows):
+        with self.conn:
+            if not self.has(tab):
+                self._ensure(tab, header)
+            self._insert(tab, header, rows)
+            self._touch(tab)
+
+    def write_values(self, tab, values):
+        """Grava a matriz crua da aba (cabeçalho + linhas) como a tabela inteira (importação do Sheets)."""
+        header = [str(h).strip() for h in values[0]]
+        rows = [list(r[:len(header)]) + [''] * (len(header) - len(r)) for r in values[1:]]
+        df = pd.DataFrame(rows, columns=header, dtype=object)
+        self.write_frame(tab, df.loc[:, [bool(h) for h in header]])
+
+    def write_frame(self, tab, df):
+        """Grava um DataFrame inteiro como a tabela da aba."""
+        columns, unique = _index_for(tab)
+        if unique and all(c in df.columns for c in columns):
+            # A aba pode ter a mesma chave repetida (ex: duas execuções no mesmo dia): vale a última
+            df = df.drop_duplicates(subset=columns, keep='last')
+        rows = df.astype(object).where(df.notna(), None).values.tolist()
+        with self.conn:
+            self._ensure(tab, [str(c) for c in df.columns])
+            self.conn.execute(f"DELETE FROM {_quote(tab)}")
+            self._insert(tab, [str(c) for c in df.columns], rows)
+            self._touch(tab)
+
+    def close(self):
+        self.conn.close()
+
+
+# --- ESPELHO ASSÍNCRONO ---
+class SheetsMirror:
+    """
+    Fila de escritas para o Sheets numa única thread (mantém a ordem das escritas).
+    Falhas viram aviso e não afetam a execução; close() espera o que falta.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sheets-mirror')
+        self.lock = threading.Lock()
+        self.pending = []
+        self.failures = 0
+
+    def submit(self, op, tab, *args):
+        def run():
+            try:
+                getattr(self.store, op)(tab, *args)
+            except Exception as e:
+                with self.lock:
+                    self.failures += 1
+                print(f"[WARN] Espelho do Sheets: falha ao gravar a aba '{tab}': {e}")
+        with self.lock:
+            self.pending = [f for f in self.pending if not f.done()]
+            self.pending.append(self.executor.submit(run))
+
+    def close(self, timeout=MIRROR_FLUSH_TIMEOUT):
+        """Espera as escritas pendentes (até `timeout`). Retorna quantas ficaram para trás."""
+        deadline = time.monotonic() + timeout
+        with self.lock:
+            pending = list(self.pending)
+        for future in pending:
+            try:
+                future.result(timeout=max(0.0, deadline - time.monotonic()))
+            except Exception:
+                break
+        left = sum(1 for f in pending if not f.done())
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        if left:
+            print(f"[WARN] Espelho do Sheets: {left} escrita(s) não concluída(s) em {timeout:.0f} s")
+        return left
+
+
+class MirroredStore:
+    """Banco local como fonte da verdade e o Sheets como espelho assíncrono das escritas."""
+
+    kind = 'mirrored'
+
+    def __init__(self, local, sheets):
+        self.local = local
+        self.sheets = sheets
+        self.mirror = SheetsMirror(sheets)
+        self.title = local.title
+
+    def key(self, tab):
+        return self.local.key(tab)
+
+    def read_values(self, tabs):
+        return self.local.read_values(tabs)
+
+    def read(self, tab):
+        return self.local.read(tab)
+
+    def read_range(self, tab, first_row):
+        return self.local.read_range(tab, first_row)
+
+    def sync(self, tab, header, rows, key_columns, current=None):
+        summary = self.local.sync(tab, header, rows, key_columns, current)
+        self.mirror.submit('sync', tab, header, rows, key_columns)
+        return summary
+
+    def upsert(self, tab, header, rows, key_columns):
+        summary = self.local.upsert(tab, header, rows, key_columns)
+        self.mirror.submit('upsert', tab, header, rows, key_columns)
+        return summary
+
+    def append(self, tab, header, rows):
+        self.local.append(tab, header, rows)
+        self.mirror.submit('append', tab, header, rows)
+
+    def close(self):
+        self.mirror.close()
+        self.local.close()
+
+
+def import_sheets(sheets, local, tabs=None):
+    """Copia as abas do Sheets (todas, por padrão) para o banco local numa única leitura. Retorna {aba: linhas}."""
+    copied = {}
+    for tab, values in sheets.read_values(tabs or sheets.tabs()).items():
+        if not values or not any(str(h).strip() for h in values[0]):
+            continue
+        local.write_values(tab, values)
+        copied[tab] = len(values) - 1
+    return copied
+
+
+def close_store(store):
+    if hasattr(store, 'close'):
+        store.close()
@@ -0,0 +1,181 @@
+"""
+Telemetria estruturada por execução do atualizador.
+
+Registra um span por fase (read_wallet, fetch, ...) e por chamada a fonte
+externa (latência, retries, erro), contadores de cache hit/miss e os motivos
+de fallback, e ao final gera um relatório JSON e uma linha de resumo para a
+aba 'runs'.
+
+Desligada, a telemetria ativa é um objeto nulo: cada chamada devolve um
+context manager compartilhado e não guarda nada.
+"""
+import json
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+import numpy as np
+
+RUNS_COLUMNS = [
+    "Início", "Duração (s)", "Posições", "Chamadas", "Falhas", "Stale",
+    "Fallback Manual", "Fallback Médio", "Cache Hits", "Fase Mais Lenta"
+]
+
+
+class _NullSpan(dict):
+    """Span descartável: aceita atributos mas não guarda nada."""
+
+    def __setitem__(self, key, value):
+        pass
+
+
+_NULL_CONTEXT = nullcontext(_NullSpan())
+
+
+class NullTelemetry:
+    enabled = False
+
+    def phase(self, name):
+        return _NULL_CONTEXT
+
+    def span(self, source, op, **attrs):
+        return _NULL_CONTEXT
+
+    def count(self, key, n=1):
+        pass
+
+    def event(self, kind, **data):
+        pass
+
+
+class Telemetry:
+    enabled = True
+
+    def __init__(self):
+        self.run_id = uuid.uuid4().hex[:12]
+        self.started_at = datetime.now()
+        self._t0 = time.perf_counter()
+        self.phases = []
+        self.spans = []
+        self.events = []
+        self.counters = Counter()
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.phases.append({'name': name, 'start_s': start - self._t0, 'duration_s': time.perf_counter() - start})
+
+    @contextmanager
+    def span(self, source, op, **attrs):
+        """Uma chamada a fonte externa; o dict devolvido aceita atributos extras (ex: retries)."""
+        span = {'source': source, 'op': op, 'retries': 0, 'ok': True}
+        span.update(attrs)
+        start = time.perf_counter()
+        try:
+            yield span
+        except Exception as e:
+            span['ok'] = False
+            span['error'] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span['start_s'] = start - self._t0
+            span['duration_ms'] = (time.perf_counter() - start) * 1000
+            with self.lock:
+                self.spans.append(span)
+
+    def count(self, key, n=1):
+        with self.lock:
+            self.counters[key] += n
+
+    def event(self, kind, **data):
+        with self.lock:
+            self.events.append(dict(kind=kind, at_s=time.perf_counter() - self._t0, **data))
+
+    # --- RELATÓRIO ---
+    def _sources(self):
+        sources = {}
+        for span in self.spans:
+            sources.setdefault(span['source'], []).append(span)
+
+        report = {}
+        for source, spans in sorted(sources.items()):
+            latencies = np.array([s['duration_ms'] for s in spans])
+            report[source] = {
+                'calls': len(spans),
+                'errors': sum(1 for s in spans if not s['ok']),
+                'retries': sum(s.get('retries', 0) for s in spans),
+                'p50_ms': float(np.percentile(latencies, 50)),
+                'p95_ms': float(np.percentile(latencies, 95)),
+                'max_ms': float(latencies.max()),
+            }
+        for key, value in self.counters.items():
+            parts = key.split('.')
+            if len(parts) == 3: # ex: cache.hit.yfinance, quote.stale.binance
+                entry = report.setdefault(parts[2], {})
+                entry[f"{parts[0]}_{parts[1]}"] = value
+        return report
+
+    def report(self):
+        return {
+            'run_id': self.run_id,
+            'started_at': self.started_at.isoformat(timespec='seconds'),
+            'duration_s': time.perf_counter() - self._t0,
+            'phases': self.phases,
+            'sources': self._sources(),
+            'counters': dict(self.counters),
+            'events': self.events,
+            'spans': self.spans,
+        }
+
+    def write_report(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, ensure_ascii=False, indent=2, default=str)
+
+    def summary_row(self):
+        """
+        Linha para a aba 'runs' (mesma ordem de RUNS_COLUMNS). Falhas, Stale e Fallback
+        contam cotações (tickers); os jobs que falharam ficam nos spans do relatório JSON.
+        """
+        counters = self.counters
+        slowest = max(self.phases, key=lambda p: p['duration_s'])['name'] if self.phases else ''
+        return [
+            self.started_at.strftime("%Y-%m-%d %H:%M:%S"),
+            round(time.perf_counter() - self._t0, 3),
+            counters['positions'],
+            len(self.spans),
+            sum(v for k, v in counters.items() if k.startswith('quote.failed.')),
+            sum(v for k, v in counters.items() if k.startswith('quote.stale.')),
+            counters['fallback.manual'],
+            counters['fallback.avg'],
+            sum(v for k, v in counters.items() if k.startswith('cache.hit.')),
+            slowest,
+        ]
+
+
+# --- TELEMETRIA ATIVA ---
+# Global (como o CURRENT_CDI_RATE): as threads do agendador enxergam a mesma instância
+_NULL = NullTelemetry()
+_CURRENT = _NULL
+
+
+def get():
+    return _CURRENT
+
+
+@contextmanager
+def activate(telemetry):
+    global _CURRENT
+    previous = _CURRENT
+    _CURRENT = telemetry
+    try:
+        yield telemetry
+    finally:
+        _CURRENT = previous
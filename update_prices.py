@@ -1,46 +1,201 @@
+import argparse
+import os
+import subprocess
+import sys
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
-import yfinance as yf
-import ccxt
+import numpy as np
 import pandas as pd
+import threading
 import time
-from datetime import datetime
-import requests
-from bs4 import BeautifulSoup
+from contextlib import nullcontext
+from datetime import date, datetime
+# yfinance, ccxt, opcoes_net e fixed_income são importados sob demanda (sources.py),
+# conforme as Classes presentes na carteira
+import sources
+from fetch_scheduler import FetchScheduler
+from quote_cache import QuoteCache, ttl_for
+from market_calendar import quote_still_valid
+from history_store import HISTORY_COLUMNS, HISTORY_KEY_COLUMNS, HISTORY_MIRROR_PATH, HistoryMirror
+import options
+import resilience
+import fx_rates
+import ledger
+import schema
+import storage
+import telemetry
+from telemetry import RUNS_COLUMNS, Telemetry
 
 # --- CONFIG ---
 SCOPE = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
 SHEET_NAME = "portifolio-management-sheet"
 TAB_WALLET = "wallet"
 TAB_PRICES = "prices"
+TAB_HISTORY = "history"
+TAB_RUNS = "runs"
+TAB_GREEKS = "greeks"
+TAB_LEDGER = "trades"       # livro de operações (opcional, ver ledger.py)
+TAB_POSITIONS = "positions" # posições derivadas do livro
+
+# Telemetria: ligada por --telemetry ou pela variável de ambiente
+TELEMETRY_ENV = "PORTFOLIO_TELEMETRY"
+TELEMETRY_REPORT_PATH = "run_report.json"
+
+# Layout da aba 'prices' (headers ricos para o Power BI)
+PRICES_COLUMNS = [
+    "Ticker", "Classe", "Moeda", "Quantidade", "Preço Médio",
+    "Preço Atual", "Total (Moeda Origem)", "Total (BRL)",
+    "Lucro/Prej (R$)", "Rentabilidade (%)", "Vencimento", "Atualização"
+]
+PRICES_KEY_COLUMNS = ["Ticker", "Classe"]
+
+# Classes cotadas na B3 via Yahoo Finance e tamanho máximo de cada download em lote
+B3_CLASSES = ['Acao', 'FII', 'ETF']
+B3_BATCH_SIZE = 50
+
+# Fonte de cotação de cada Classe (usada pelo agendador para aplicar o rate limit)
+CLASS_SOURCES = {
+    'Acao': 'yfinance',
+    'FII': 'yfinance',
+    'ETF': 'yfinance',
+    'Opcao': 'opcoes_net',
+    'Cripto': 'binance',
+}
+# Fontes em que 0.0 é resposta válida (opção sem negócio) e a falha chega como None:
+# o zero vai para o cache e não é trocado por uma cotação antiga
+ZERO_QUOTE_SOURCES = {'opcoes_net'}
+
+# Cadeia de fallback do preço por Classe: vale a primeira etapa com preço > 0.
+# quote = cotação desta execução (na B3 o get_b3_price já cai para o fechamento anterior
+# e o histórico recente), cache = última cotação boa do QuoteCache (stale),
+# model = preço teórico do motor de opções, manual = Manual Price, avg = Preço Médio
+FALLBACK_CHAINS = {
+    'Acao': ['quote', 'cache', 'manual', 'avg'],
+    'FII': ['quote', 'cache', 'manual', 'avg'],
+    'ETF': ['quote', 'cache', 'manual', 'avg'],
+    'Opcao': ['quote', 'cache', 'model', 'manual', 'avg'],
+    'Cripto': ['quote', 'cache', 'manual', 'avg'],
+}
+DEFAULT_FALLBACK_CHAIN = ['quote', 'manual', 'avg']
+
+# Cripto: moeda de cotação padrão e ativos usados como ponte quando não há par direto
+CRYPTO_QUOTE = 'USDT'
+CRYPTO_BRIDGE_ASSETS = ['USDT', 'BTC', 'ETH', 'BNB']
 
 # --- CONEXÃO ---
-def connect_sheets():
+def connect_client():
+    """Cliente gspread autenticado pela conta de serviço (credentials.json)."""
+    creds = ServiceAccountCredentials.from_json_keyfile_name('credentials.json', SCOPE)
+    return gspread.authorize(creds)
+
+def open_store(sheet=SHEET_NAME, kind='sheets', mirror=False, client=None):
+    """
+    Armazenamento das abas da planilha `sheet` (storage.py): o Google Sheets, o banco
+    local (sem rede) ou o banco local com o Sheets como espelho assíncrono.
+    """
+    local_path = storage.local_path(sheet, SHEET_NAME)
+    if kind == 'local' and not mirror:
+        return storage.LocalStore(local_path)
+    sheets = storage.SheetsStore((client or connect_client()).open(sheet))
+    if kind == 'sheets':
+        return sheets
+    return storage.MirroredStore(storage.LocalStore(local_path), sheets)
+
+def connect_store(args, sheet=SHEET_NAME):
     try:
-        creds = ServiceAccountCredentials.from_json_keyfile_name('credentials.json', SCOPE)
-        client = gspread.authorize(creds)
-        return client.open(SHEET_NAME)
+        return open_store(sheet, args.storage, args.mirror_sheets)
     except Exception as e:
         print(f"[FATAL] Erro de conexão: {e}")
         exit()
 
 # --- MOTORES DE BUSCA ---
-def get_crypto_price(ticker):
+# Exchange única por execução (evita recriar o cliente e recarregar os mercados)
+_EXCHANGE = None
+_EXCHANGE_LOCK = threading.Lock()
+
+def get_exchange():
+    global _EXCHANGE
+    with _EXCHANGE_LOCK:
+        if _EXCHANGE is None:
+            exchange = sources.load('binance').binance({'enableRateLimit': True})
+            exchange.load_markets()
+            _EXCHANGE = exchange
+    return _EXCHANGE
+
+def to_crypto_symbol(ticker):
+    # Tratamento para tickers comuns (ex: BTC vira BTC/USDT)
+    return ticker if '/' in ticker else f"{ticker}/{CRYPTO_QUOTE}"
+
+def _crypto_legs(symbol, markets):
+    """
+    Define quais pares precisam ser cotados para chegar ao preço de `symbol`.
+    Par direto -> [symbol]; sem par direto -> [BASE/PONTE, PONTE/QUOTE].
+    """
+    if symbol in markets:
+        return [symbol]
+
+    base, quote = symbol.split('/', 1)
+    if base == quote:
+        return [] # Ex: USDT/USDT vale 1
+
+    for bridge in CRYPTO_BRIDGE_ASSETS:
+        if bridge in (base, quote):
+            continue
+        first, second = f"{base}/{bridge}", f"{bridge}/{quote}"
+        if first in markets and second in markets:
+            return [first, second]
+    return None
+
+def get_crypto_prices(tickers):
+    """
+    Busca várias criptos com uma única chamada fetch_tickers na exchange compartilhada.
+    Retorna um dicionário {ticker: preço}.
+    """
+    unique_tickers = list(dict.fromkeys(tickers))
     try:
-        exchange = ccxt.binance()
-        # Tratamento para tickers comuns (ex: BTC vira BTC/USDT)
-        if '/' not in ticker: ticker = f"{ticker}/USDT"
-        ticker_data = exchange.fetch_ticker(ticker)
-        return float(ticker_data['last'])
-    except:
-        return 0.0
+        exchange = get_exchange()
+    except Exception as e:
+        print(f"[WARN] Falha ao conectar na Binance: {e}")
+        return {t: 0.0 for t in unique_tickers}
 
-def get_b3_price(ticker, classe):
+    plan = {t: _crypto_legs(to_crypto_symbol(t), exchange.markets) for t in unique_tickers}
+    symbols = sorted({leg for legs in plan.values() if legs for leg in legs})
+
+    try:
+        data = exchange.fetch_tickers(symbols) if symbols else {}
+    except Exception as e:
+        print(f"[WARN] Falha no fetch_tickers da Binance: {e}")
+        data = {}
+
+    prices = {}
+    for ticker, legs in plan.items():
+        if legs is None:
+            print(f"[WARN] Par não encontrado na Binance para {ticker}")
+            prices[ticker] = 0.0
+            continue
+
+        price = 1.0
+        for leg in legs:
+            last = (data.get(leg) or {}).get('last')
+            if not last:
+                price = 0.0
+                break
+            price *= float(last)
+        prices[ticker] = price
+    return prices
+
+def get_crypto_price(ticker):
+    return get_crypto_prices([ticker]).get(ticker, 0.0)
+
+def to_yahoo_b3(ticker):
     # Sufixo .SA para ativos brasileiros listados na B3 (exceto Opções que as vezes variam)
-    t = ticker if ticker.endswith('.SA') else f"{ticker}.SA"
+    return ticker if ticker.endswith('.SA') else f"{ticker}.SA"
+
+def get_b3_price(ticker, classe):
+    t = to_yahoo_b3(ticker)
     
     try:
-        asset = yf.Ticker(t)
+        asset = sources.load('yfinance').Ticker(t)
         # Prioridade: Preço regular -> Fechamento anterior -> Histórico recente
         price = asset.info.get('regularMarketPrice') or asset.info.get('previousClose')
         
@@ -54,122 +209,98 @@ def get_b3_price(ticker, classe):
     except:
         return 0.0
 
-import requests
-from bs4 import BeautifulSoup
+def _price_from_history(data, symbol):
+    """Extrai o preço de um ativo do DataFrame devolvido pelo yf.download."""
+    try:
+        if isinstance(data.columns, pd.MultiIndex):
+            closes = data[symbol]['Close']
+        else:
+            closes = data['Close']
+    except KeyError:
+        return 0.0
 
-import requests
-from bs4 import BeautifulSoup
+    if closes.empty:
+        return 0.0
 
-def get_price_opcoes_net(ticker):
-    clean_ticker = ticker.replace('.SA', '').upper()
-    url = f"https://opcoes.net.br/{clean_ticker}"
-    
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-    }
-    
-    try:
-        response = requests.get(url, headers=headers, timeout=10)
-        if response.status_code != 200:
-            return 0.0
+    # Mesma prioridade do get_b3_price:
+    # Preço regular (último pregão) -> Fechamento anterior -> Último fechamento válido
+    regular = closes.iloc[-1]
+    previous_close = closes.iloc[-2] if len(closes) > 1 else None
+    valid = closes.dropna()
+    last_close = valid.iloc[-1] if not valid.empty else None
 
-        soup = BeautifulSoup(response.content, 'html.parser')
-        
-        # 1. Localiza a tabela específica pela classe única "top-buffer-20"
-        # Isso evita pegar tabelas de resumo ou outras irrelevantes
-        table = soup.find('table', {'class': 'top-buffer-20'})
-        
-        if not table:
-            print(f"[WARN] Tabela principal não encontrada para {clean_ticker}")
-            return 0.0
-
-        # 2. Mapeamento do Cabeçalho
-        # A tabela tem 2 linhas de header. A segunda linha contém "Min, Pri, Med, Ult..."
-        thead = table.find('thead')
-        header_rows = thead.find_all('tr')
-        
-        # Pegamos a última linha do cabeçalho (onde estão os nomes das colunas)
-        col_names_row = header_rows[-1] 
-        cols = col_names_row.find_all(['td', 'th']) # O site usa td dentro do thead as vezes
-        
-        ult_index = -1
-        
-        # Procuramos o índice da coluna "Ult"
-        for i, col in enumerate(cols):
-            if "Ult" in col.get_text():
-                ult_index = i
-                break # IMPORTANTE: Parar no primeiro "Ult" (que é o da cotação, não volatilidade)
-        
-        if ult_index == -1:
-            print(f"[WARN] Coluna 'Ult' não encontrada no cabeçalho.")
-            return 0.0
+    for candidate in (regular, previous_close, last_close):
+        if candidate is not None and pd.notna(candidate) and candidate > 0:
+            return float(candidate)
+    return 0.0
 
-        # 3. Extração do Dado
-        tbody = table.find('tbody')
-        if not tbody: return 0.0
-        
-        first_row = tbody.find('tr')
-        if not first_row: return 0.0
-        
-        cells = first_row.find_all('td')
-        
-        # O TRUQUE DO OFFSET:
-        # A linha de dados tem uma célula a mais no início (a Data) que não existe 
-        # na segunda linha do cabeçalho (por causa do rowspan).
-        # Portanto, o índice do dado é ult_index + 1.
-        target_index = ult_index + 1
-        
-        if len(cells) > target_index:
-            raw_value = cells[target_index].get_text().strip() # Ex: "0,8000"
-            
-            # Tratamento Brasil -> Python
-            clean_value = raw_value.replace('.', '').replace(',', '.')
-            
-            # Validação para evitar erros de conversão com "-" ou vazio
-            if not clean_value or clean_value == '-':
-                return 0.0
-                
-            return float(clean_value)
-            
-        return 0.0
+def get_b3_prices(tickers, chunk_size=B3_BATCH_SIZE):
+    """
+    Busca as cotações de vários ativos da B3 com downloads em lote (yf.download).
+    Retorna um dicionário {ticker: preço}. Tickers que o lote não resolver
+    caem no get_b3_price individual.
+    """
+    unique_tickers = list(dict.fromkeys(tickers))
+    prices = {}
 
-    except Exception as e:
-        print(f"[ERRO SCRAPING] {clean_ticker}: {e}")
-        return 0.0
+    for start in range(0, len(unique_tickers), chunk_size):
+        chunk = unique_tickers[start:start + chunk_size]
+        symbols = [to_yahoo_b3(t) for t in chunk]
+        try:
+            data = sources.load('yfinance').download(
+                symbols, period="5d", interval="1d", group_by='ticker',
+                auto_adjust=False, progress=False, threads=True
+            )
+        except Exception as e:
+            print(f"[WARN] Falha no download em lote da B3: {e}")
+            data = pd.DataFrame()
+
+        for ticker, symbol in zip(chunk, symbols):
+            prices[ticker] = _price_from_history(data, symbol) if not data.empty else 0.0
+
+    # Fallback individual apenas para quem ficou sem preço no lote
+    missing = [t for t in unique_tickers if not prices.get(t)]
+    if missing:
+        print(f"[WARN] {len(missing)} ativo(s) sem cotação no lote, tentando individualmente...")
+    for ticker in missing:
+        prices[ticker] = get_b3_price(ticker, None)
+
+    return prices
+
+# Fallback de segurança quando nem a fonte nem o cache têm a taxa (câmbio: fx_rates.FALLBACK_RATES)
+CDI_FALLBACK_RATE = 0.149
 
-def get_usd_brl_rate():
-    try:
-        return float(yf.Ticker("BRL=X").info.get('regularMarketPrice', 5.0))
-    except:
-        return 5.0 # Fallback de segurança
-    
 # --- CACHE DA TAXA CDI ---
 # Variável global para não chamar a API do Banco Central 50 vezes
 CURRENT_CDI_RATE = None
 
+def fetch_cdi_rate():
+    """Busca a Taxa Selic/CDI Anualizada atual no Banco Central. Retorna 0.0 em caso de falha."""
+    try:
+        # API do BCB para a série 1178 (Selic anualizada)
+        return sources.load('bcb').fetch_bcb_latest(1178) / 100 # Vem 11.25, vira 0.1125
+    except Exception as e:
+        print(f"   [WARN] Falha ao buscar CDI: {e}")
+        return 0.0
+
 def get_current_cdi():
-    """Busca a Taxa Selic/CDI Anualizada atual no Banco Central."""
     global CURRENT_CDI_RATE
     if CURRENT_CDI_RATE is not None:
         return CURRENT_CDI_RATE
-        
-    try:
-        # API do BCB para a série 1178 (Selic anualizada)
-        url = "https://api.bcb.gov.br/dados/serie/bcdata.sgs.1178/dados/ultimos/1?formato=json"
-        response = requests.get(url, timeout=5)
-        data = response.json()
-        rate = float(data[0]['valor']) / 100 # Vem 11.25, vira 0.1125
+
+    rate = fetch_cdi_rate()
+    if rate > 0:
         CURRENT_CDI_RATE = rate
         print(f"   [INFO] Taxa CDI/Selic Atual: {rate*100:.2f}% a.a.")
         return rate
-    except Exception as e:
-        print(f"   [WARN] Falha ao buscar CDI: {e}. Usando fallback 14.9%.")
-        return 0.149
+    print(f"   [WARN] Usando fallback {CDI_FALLBACK_RATE*100:.1f}% para o CDI.")
+    return CDI_FALLBACK_RATE
 
 def calculate_fixed_income(valor_inicial, data_inicio, indexador):
     """
     Calcula o Valor Presente estimado baseada em Juros Compostos.
     Suporta: '105% CDI', '12% PRE'.
+    Usado apenas quando o FixedIncomeEngine não tem as séries que cobrem a posição.
     """
     if not data_inicio or not indexador:
         return valor_inicial
@@ -177,11 +308,8 @@ def calculate_fixed_income(valor_inicial, data_inicio, indexador):
     # 1. Calcular o Tempo (em Anos)
     try:
         dt_start = datetime.strptime(str(data_inicio), "%Y-%m-%d")
-        print(dt_start)
         dt_now = datetime.now()
-        print(dt_now)
         days_diff = (dt_now - dt_start).days
-        print("diff: ", days_diff)
         years = days_diff / 365.25 # Aproximação calendário
     except ValueError:
         print(f"   [ERRO] Formato de data inválido: {data_inicio}")
@@ -198,11 +326,9 @@ def calculate_fixed_income(valor_inicial, data_inicio, indexador):
     if 'CDI' in indexador:
         # Ex: "105%CDI" -> pega 105, divide por 100, multiplica pela taxa Selic atual
         percentage_str = indexador.split('%CDI')[0]
-        print("percentage_str:", percentage_str)
         try:
             percent_cdi = float(percentage_str) / 100
             market_rate = get_current_cdi()
-            print("market_rate:", market_rate)
             annual_rate = market_rate * percent_cdi
         except:
             annual_rate = 0.10 # Fallback 10%
@@ -233,178 +359,764 @@ def calculate_fixed_income(valor_inicial, data_inicio, indexador):
     
     return valor_atual
 
-# --- ORQUESTRAÇÃO ---
-def main():
-    print("--- Iniciando Orquestracao ---")
-    sh = connect_sheets()
-    
-    # Leitura da Carteira
-    ws_wallet = sh.worksheet(TAB_WALLET)
-    df = pd.DataFrame(ws_wallet.get_all_records())
-    
-    # Validar se colunas existem
-    required_cols = ['Ticker', 'Classe', 'Quantidade', 'Moeda', 'Preço Médio', 'Manual Price', 'Direção', 'Data Início', 'Indexador']
-    if not all(col in df.columns for col in required_cols):
-        print(f"[ERRO] Colunas faltando. Necessario: {required_cols}")
-        return
+# --- BUSCA CONCORRENTE ---
+# Fonte das taxas de câmbio (tickers <MOEDA>BRL, ficam fora do dicionário de cotações)
+FX_SOURCE = 'fx'
 
-    usd_rate = get_usd_brl_rate()
-    print(f"Dolar Base: R$ {usd_rate:.2f}")
-
-    results = []
-
-    for idx, row in df.iterrows():
-        ticker = str(row['Ticker']).strip()
-        classe = str(row['Classe']).strip() # Acao, FII, Cripto, RendaFixa
-        qty = float(row['Quantidade'] or 0)
-        avg_price = float(row['Preço Médio'] or 0)
-        currency = str(row['Moeda']).strip().upper()
-        manual_price = float(row['Manual Price'] or 0)
-        direction = str(row.get('Direção', 'C')).strip().upper() or 'C'
-        direction = direction if direction in ['C', 'V'] else 'C'
-        start_date = row.get('Data Início', '')
-        indexer = row.get('Indexador', '')
-        
-        current_price = 0.0
-        
-        print(f"[{idx+1}] Processando {classe}: {ticker}...")
+def fetch_option(ticker):
+    return {ticker: sources.load('opcoes_net').get_price_opcoes_net(ticker)}
 
-        # LÓGICA DE ROTEAMENTO (SWITCH)
-        if classe in ['Acao', 'FII', 'ETF']:
-            current_price = get_b3_price(ticker, classe)
-            print(current_price)
-        
-        elif classe == 'Opcao':
-            # Opções podem ter tickers variados, tentar direto
-            current_price = get_price_opcoes_net(ticker)
+def option_expiries(df):
+    """{ticker: vencimento (date)} das opções da carteira com Vencimento legível."""
+    if 'Vencimento' not in df.columns:
+        return {}
+    options = df['Classe'].astype(str).str.strip() == 'Opcao'
+    expiry = pd.to_datetime(df.loc[options, 'Vencimento'].astype(str), errors='coerce')
+    tickers = df.loc[options, 'Ticker'].astype(str).str.strip()
+    return {t: e.date() for t, e in zip(tickers, expiry) if pd.notna(e)}
 
-        
-        elif classe == 'Cripto':
-            current_price = get_crypto_price(ticker)
-        
-        elif classe == 'RendaFixa':
-            # O "Preço Atual" na Renda Fixa não é o valor de mercado unitário,
-            # mas sim o Valor Total Atualizado dividido pela quantidade.
-            # Se Qty = 1, Preço Atual = Valor Total.
-            
-            # 1. Calcula o Valor Total investido inicialmente neste aporte
-            investimento_inicial = qty * avg_price
-            
-            # 2. Calcula quanto esse dinheiro vale hoje
-            valor_atualizado_total = calculate_fixed_income(investimento_inicial, start_date, indexer)
-            
-            # 3. Reconverte para "Preço Unitário" para manter a lógica da planilha
-            current_price = valor_atualizado_total / qty if qty > 0 else 0.0
-            
-            print(f"   -> RF Calculada: R$ {investimento_inicial:.2f} virou R$ {valor_atualizado_total:.2f}")
-        
+def plan_reuse(cache, df, wanted, skip=()):
+    """
+    Cotações de `wanted` que não precisam ir à rede: a última busca foi depois do
+    último fechamento do mercado (market_calendar) ou a opção já venceu.
+    Retorna {(fonte, ticker): preço}.
+    """
+    now = time.time()
+    expiries = option_expiries(df)
+    planned = {}
+    for key, classe in wanted.items():
+        if key in skip:
+            continue
+        last = cache.get_stale(*key, max_age=float('inf'))
+        if last is None:
+            continue
+        expiry = expiries.get(key[1]) if classe == 'Opcao' else None
+        if quote_still_valid(key[0], last[1], now, expiry):
+            planned[key] = last[0]
+    return planned
+
+def fetch_quotes(df, cache=None, fixed_income=None, force=()):
+    """
+    Dispara em paralelo todas as chamadas de rede da carteira (B3, opções,
+    cripto, dólar e séries do BCB), cada fonte respeitando o seu próprio rate limit.
+
+    Com `cache`, cotações dentro do TTL da classe não vão para a rede, e uma
+    busca que falhar devolve a última cotação boa do cache (marcada em `stale`).
+    Classes em `force` ignoram o cache fresco e sempre vão à rede (modo daemon).
+    Retorna ({(fonte, ticker): preço}, {moeda: taxa em BRL}, {(fonte, ticker): fetched_at});
+    a tabela de câmbio tem o BRL e cada Moeda da carteira.
+    """
+    global CURRENT_CDI_RATE
+    tm = telemetry.get()
+    classes = df['Classe'].astype(str).str.strip()
+    tickers = df['Ticker'].astype(str).str.strip()
+
+    # (fonte, ticker) -> classe, na ordem da carteira e sem repetição
+    # Câmbio: um par <MOEDA>BRL para cada Moeda diferente do real
+    wanted = {}
+    currency_list = fx_rates.currencies(df['Moeda'])
+    for currency in currency_list:
+        wanted[(FX_SOURCE, fx_rates.pair(currency))] = 'FX'
+    for classe, ticker in zip(classes, tickers):
+        if classe in CLASS_SOURCES:
+            wanted.setdefault((CLASS_SOURCES[classe], ticker), classe)
+    # Ativo objeto das opções com Strike (motor de opções), mesmo que não esteja na carteira
+    if 'Strike' in df.columns:
+        for underlying in options.underlyings(df).values():
+            wanted.setdefault(('yfinance', underlying), 'Acao')
+
+    # Séries do BCB só são necessárias se existir Renda Fixa na carteira
+    rf_starts = pd.to_datetime(df.loc[classes == 'RendaFixa', 'Data Início'].astype(str), format="%Y-%m-%d", errors='coerce').dropna()
+
+    quotes = {}
+    if cache is not None:
+        for key, classe in wanted.items():
+            if classe in force:
+                continue
+            price = cache.get_fresh(*key, ttl_for(classe))
+            if price is not None:
+                quotes[key] = price
+    for source, _ in quotes:
+        tm.count(f"cache.hit.{source}")
+
+    # Planejamento: se o mercado não negociou desde a última busca (fim de semana,
+    # feriado da B3, opção vencida) a resposta não mudou e a última cotação vale
+    planned = plan_reuse(cache, df, wanted, quotes) if cache is not None else {}
+    for source, _ in planned:
+        tm.count(f"plan.skip.{source}")
+    quotes.update(planned)
+
+    pending = [key for key in wanted if key not in quotes]
+    for source, _ in pending:
+        tm.count(f"cache.miss.{source}")
+    print(f"Cache: {len(quotes) - len(planned)} cotação(ões) reaproveitada(s), "
+          f"{len(planned)} sem negociação desde a última busca, {len(pending)} para buscar")
+
+    pending_by_source = {}
+    for source, ticker in pending:
+        pending_by_source.setdefault(source, []).append(ticker)
+
+    # Só as fontes que a carteira usa são importadas; fonte sem pacote instalado é tratada como falha
+    # (o câmbio vem do Yahoo)
+    needed = set(pending_by_source) - {FX_SOURCE}
+    if FX_SOURCE in pending_by_source:
+        needed.add('yfinance')
+    unavailable = sources.preload(sorted(needed))
+    for source in unavailable:
+        pending_by_source.pop(source, None)
+    if 'yfinance' in unavailable:
+        pending_by_source.pop(FX_SOURCE, None)
+
+    fetched = {}
+    with FetchScheduler() as scheduler:
+        jobs = [] # (fonte, future que devolve {ticker: preço})
+
+        # Câmbio: todos os pares num único download
+        if FX_SOURCE in pending_by_source:
+            jobs.append((FX_SOURCE, scheduler.submit('yfinance', fx_rates.fetch_rates, pending_by_source[FX_SOURCE])))
+        rf_future = None
+        if fixed_income is not None and not rf_starts.empty:
+            rf_future = scheduler.submit('bcb', fixed_income.sync, rf_starts.min().date())
+
+        b3_tickers = pending_by_source.get('yfinance', [])
+        for start in range(0, len(b3_tickers), B3_BATCH_SIZE):
+            jobs.append(('yfinance', scheduler.submit('yfinance', get_b3_prices, b3_tickers[start:start + B3_BATCH_SIZE])))
+
+        # Cripto: todos os símbolos numa única chamada em lote
+        if pending_by_source.get('binance'):
+            jobs.append(('binance', scheduler.submit('binance', get_crypto_prices, pending_by_source['binance'])))
+
+        for ticker in pending_by_source.get('opcoes_net', []):
+            # 0.0 é opção sem negócio (resposta válida); só None (erro) conta como falha
+            jobs.append(('opcoes_net', scheduler.submit('opcoes_net', fetch_option, ticker,
+                                                        is_failure=resilience.missing_quote)))
+
+        # Job que esgotou tentativas/prazo ou com o circuito aberto: as cotações dele seguem a cadeia de fallback
+        for source, future in jobs:
+            try:
+                for ticker, price in future.result().items():
+                    if price is not None:
+                        fetched[(source, ticker)] = price
+            except Exception as e:
+                print(f"[WARN] Falha na busca em {source}: {e}")
+        if rf_future is not None:
+            try:
+                rf_future.result()
+            except Exception as e:
+                print(f"[WARN] Falha ao sincronizar as séries do BCB: {e}")
+
+    stale = {}
+    for key in pending:
+        price = fetched.get(key, 0.0)
+        if price > 0 or (key[0] in ZERO_QUOTE_SOURCES and key in fetched):
+            quotes[key] = price
+            continue
+        cached = cache.get_stale(*key) if cache is not None else None
+        if cached:
+            quotes[key], stale[key] = cached
+            tm.count(f"quote.stale.{key[0]}")
+            print(f"[WARN] Falha em {key[0]}:{key[1]}, usando última cotação do cache (stale)")
         else:
-            current_price = 0.0 # Classe desconhecida
-        
-        # CÁLCULOS FINANCEIROS
-        # Se falhou tudo, usa manual ou médio
-        final_price = current_price if current_price > 0 else (manual_price if manual_price > 0 else avg_price)
-        
-        # Total na moeda do ativo
-        total_native = qty * final_price 
-        
-        # Conversão BRL (Se for USD)
-        rate_cambio = usd_rate if currency == 'USD' else 1.0
-        total_brl = total_native * rate_cambio
-        
-        # Lucro/Prejuízo e Rentabilidade
-        cost_basis = qty * avg_price * rate_cambio # Quanto gastei
-        pnl_reais = total_brl - cost_basis
-        
-        if cost_basis > 0:
-            rentabilidade_pct = (pnl_reais / cost_basis) * 100 # Em porcentagem (ex: 15.5)
+            quotes[key] = 0.0
+            tm.count(f"quote.failed.{key[0]}")
+            tm.event('quote_failed', source=key[0], ticker=key[1])
+
+    if cache is not None:
+        for source in pending_by_source:
+            cache.put_many(source, {t: p for (s, t), p in fetched.items() if s == source},
+                           allow_zero=source in ZERO_QUOTE_SOURCES)
+
+    fx = {fx_rates.currency_of(t): quotes.pop((s, t)) for s, t in list(quotes) if s == FX_SOURCE}
+    fx = fx_rates.with_fallbacks(fx, currency_list)
+    # CDI anualizado da série local evita outra chamada ao BCB
+    if fixed_income is not None and CURRENT_CDI_RATE is None:
+        CURRENT_CDI_RATE = fixed_income.current_cdi_annual()
+
+    return quotes, fx, stale
+
+# --- OPÇÕES ---
+def price_options(df, quotes, stale, cache=None):
+    """
+    Roda o motor de opções (options.py) sobre as cotações já buscadas: calibra a vol
+    implícita das opções cotadas (guardada no cache) e calcula o preço teórico,
+    a etapa 'model' da cadeia de fallback.
+    Retorna (livro de opções ou None, {(fonte, ticker): preço teórico}).
+    """
+    if 'Strike' not in df.columns or not options.underlyings(df):
+        return None, {}
+    option_quotes = {t: p for (s, t), p in quotes.items() if s == 'opcoes_net'}
+    spot_quotes = {t: p for (s, t), p in quotes.items() if s == 'yfinance'}
+    cached_vols = {}
+    if cache is not None:
+        for ticker in option_quotes:
+            last = cache.get_stale(options.IV_CACHE_SOURCE, ticker, max_age=options.IV_CACHE_MAX_AGE)
+            if last:
+                cached_vols[ticker] = last[0]
+    try:
+        book = options.price_book(df, option_quotes, get_current_cdi(), spot_quotes,
+                                  {t for s, t in stale if s == 'opcoes_net'}, cached_vols)
+    except Exception as e:
+        print(f"[WARN] Falha no motor de opções: {e}")
+        return None, {}
+
+    calibrated = book[book['Fonte Vol'] == 'mercado']
+    if cache is not None and not calibrated.empty:
+        cache.put_many(options.IV_CACHE_SOURCE, dict(zip(calibrated['Ticker'], calibrated['Vol Implícita (%)'] / 100)))
+
+    model_quotes = {('opcoes_net', t): float(p) for t, p in zip(book['Ticker'], book['Preço Teórico']) if p > 0}
+    print(f"Opções: {len(book)} modelada(s), {len(calibrated)} com vol implícita de mercado, "
+          f"delta da carteira R$ {book['Delta (R$)'].sum():,.2f}")
+    return book, model_quotes
+
+# --- VALORIZAÇÃO ---
+def to_number(series):
+    """Coluna da planilha -> float (vazio ou inválido vira 0)."""
+    return pd.to_numeric(series.replace('', 0), errors='coerce').fillna(0.0).astype(float)
+
+def resolve_current_prices(df, quotes, stale, fixed_income=None, model_quotes=None):
+    """
+    Monta a coluna de preço atual (e a de atualização) na ordem da carteira.
+    Classes de mercado seguem a FALLBACK_CHAINS da Classe sobre `quotes` (cotações
+    da execução e do cache, em `stale`) e `model_quotes` (preço teórico das opções);
+    Renda Fixa é calculada localmente.
+    Retorna (preços, atualização, etapa da cadeia usada em cada linha).
+    """
+    model_quotes = model_quotes or {}
+    classes = df['Classe'].astype(str).str.strip()
+    tickers = df['Ticker'].astype(str).str.strip()
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    # LÓGICA DE ROTEAMENTO: Acao/FII/ETF, Opcao e Cripto já foram buscados pelo agendador
+    quote_keys = [(CLASS_SOURCES.get(c), t) for c, t in zip(classes, tickers)]
+    quoted = pd.Series([quotes.get(k, 0.0) for k in quote_keys], index=df.index, dtype=float)
+    from_cache = pd.Series([k in stale for k in quote_keys], index=df.index)
+    candidates = pd.DataFrame({
+        'quote': quoted.where(~from_cache),
+        'cache': quoted.where(from_cache),
+        'model': pd.Series([model_quotes.get(k, 0.0) for k in quote_keys], index=df.index, dtype=float),
+        'manual': to_number(df['Manual Price']),
+        'avg': to_number(df['Preço Médio']),
+    }, index=df.index)
+    candidates = candidates.where(candidates > 0)
+
+    prices = pd.Series(np.nan, index=df.index)
+    steps = pd.Series('', index=df.index, dtype=object)
+    for classe in classes.unique():
+        rows = classes == classe
+        for step in FALLBACK_CHAINS.get(classe, DEFAULT_FALLBACK_CHAIN):
+            take = rows & prices.isna() & candidates[step].notna()
+            prices[take] = candidates.loc[take, step]
+            steps[take] = step
+    prices = prices.fillna(0.0)
+
+    # Cotação antiga servida pelo cache ou preço teórico: a data de atualização reflete isso
+    updated_at = pd.Series([
+        datetime.fromtimestamp(stale[k]).strftime("%Y-%m-%d %H:%M:%S") + " (cache)" if step == 'cache'
+        else now + " (modelo)" if step == 'model' else now
+        for k, step in zip(quote_keys, steps)
+    ], index=df.index, dtype=object)
+
+    # O "Preço Atual" na Renda Fixa não é o valor de mercado unitário,
+    # mas sim o Valor Total Atualizado dividido pela quantidade.
+    rf = classes == 'RendaFixa'
+    if rf.any():
+        qty = to_number(df.loc[rf, 'Quantidade'])
+        investimento_inicial = qty * to_number(df.loc[rf, 'Preço Médio'])
+
+        # Todas as posições de uma vez a partir dos fatores acumulados do CDI/IPCA
+        if fixed_income is not None:
+            valor_atualizado = fixed_income.value_positions(
+                investimento_inicial, df.loc[rf, 'Data Início'], df.loc[rf, 'Indexador']
+            )
         else:
-            rentabilidade_pct = 0.0
-
-        if classe == 'Opcao' and direction == 'V':
-            pnl_reais *= -1
-            rentabilidade_pct *= -1
-
-        vencimento = row.get('Vencimento', '')
-        results.append([
-            ticker, classe, currency, qty, avg_price, 
-            final_price, total_native, total_brl, 
-            pnl_reais, rentabilidade_pct, vencimento,
-            datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        ])
-        
-        time.sleep(0.5) # Proteção de Rate Limit
+            valor_atualizado = pd.Series(np.nan, index=investimento_inicial.index)
+
+        # Posições fora da cobertura das séries locais usam a aproximação antiga
+        for idx in valor_atualizado.index[valor_atualizado.isna()]:
+            valor_atualizado[idx] = calculate_fixed_income(
+                investimento_inicial[idx], df.at[idx, 'Data Início'], df.at[idx, 'Indexador']
+            )
+
+        prices[rf] = (valor_atualizado / qty).where(qty > 0, 0.0)
+        steps[rf] = 'rf'
+        print(f"   -> RF Calculada: R$ {investimento_inicial.sum():.2f} virou R$ {valor_atualizado.sum():.2f} ({rf.sum()} posição(ões))")
+
+    return prices, updated_at, steps
+
+def valuate(df, prices, fx, updated_at=None):
+    """
+    Calcula todas as colunas da aba 'prices' de uma vez (operações por coluna).
+    `prices` e `fx` (taxa em BRL de cada linha) são Series alinhadas ao índice da carteira.
+    """
+    classes = df['Classe'].astype(str).str.strip()
+    qty = to_number(df['Quantidade'])
+    avg_price = to_number(df['Preço Médio'])
+    manual_price = to_number(df['Manual Price'])
+    prices = pd.Series(prices, index=df.index, dtype=float).fillna(0.0)
+    fx = pd.Series(fx, index=df.index, dtype=float)
+    direction = df['Direção'].astype(str).str.strip().str.upper() if 'Direção' in df.columns else pd.Series('C', index=df.index)
+
+    # Se falhou tudo, usa manual ou médio
+    final_price = prices.where(prices > 0, manual_price.where(manual_price > 0, avg_price))
+
+    # Total na moeda do ativo e conversão para BRL
+    total_native = qty * final_price
+    total_brl = total_native * fx
+
+    # Lucro/Prejuízo e Rentabilidade
+    cost_basis = qty * avg_price * fx # Quanto gastei
+    pnl_reais = total_brl - cost_basis
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rentabilidade_pct = (pnl_reais / cost_basis * 100).where(cost_basis > 0, 0.0) # Em porcentagem (ex: 15.5)
+
+    # Opção vendida (Direção = 'V'): o resultado tem sinal invertido
+    sign = np.where((classes == 'Opcao') & (direction == 'V'), -1.0, 1.0)
+    pnl_reais = pnl_reais * sign
+    rentabilidade_pct = rentabilidade_pct * sign
+
+    if updated_at is None:
+        updated_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    return pd.DataFrame({
+        "Ticker": df['Ticker'].astype(str).str.strip(),
+        "Classe": classes,
+        "Moeda": fx_rates.normalize(df['Moeda']),
+        "Quantidade": qty,
+        "Preço Médio": avg_price,
+        "Preço Atual": final_price,
+        "Total (Moeda Origem)": total_native,
+        "Total (BRL)": total_brl,
+        "Lucro/Prej (R$)": pnl_reais,
+        "Rentabilidade (%)": rentabilidade_pct,
+        "Vencimento": df['Vencimento'] if 'Vencimento' in df.columns else '',
+        "Atualização": updated_at,
+    }, index=df.index)[PRICES_COLUMNS]
+
+def build_history_rows(df_prices, today):
+    """Uma linha de histórico para o Total Geral e uma por Classe (na ordem da carteira)."""
+    totals = df_prices.groupby('Classe', sort=False)[["Total (BRL)", "Lucro/Prej (R$)"]].sum()
+    totals.loc["Total Geral"] = df_prices[["Total (BRL)", "Lucro/Prej (R$)"]].sum()
+    totals = totals.loc[["Total Geral"] + [c for c in totals.index if c != "Total Geral"]]
+
+    patrimonio = totals["Total (BRL)"]
+    lucro_total = totals["Lucro/Prej (R$)"]
+    # O investido é o valor atual menos o lucro (ou mais o prejuízo)
+    investido = patrimonio - lucro_total
+    # Evita divisão por zero
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rentab_perc = (lucro_total / investido * 100).where(investido > 0, 0.0)
+
+    return [
+        [today, categoria, float(p), float(i), float(l), float(r)]
+        for categoria, p, i, l, r in zip(totals.index, patrimonio, investido, lucro_total, rentab_perc)
+    ]
+
+# --- ORQUESTRAÇÃO ---
+REQUIRED_WALLET_COLUMNS = ['Ticker', 'Classe', 'Quantidade', 'Moeda', 'Preço Médio', 'Manual Price', 'Direção', 'Data Início', 'Indexador']
+
+def read_wallet(store, tab=TAB_WALLET, ledger_tab=TAB_LEDGER, positions_tab=TAB_POSITIONS, values=None):
+    """
+    Leitura da Carteira, tipada pelo esquema da carteira (schema.py). `values` é a matriz
+    crua da aba quando ela já veio numa leitura em lote. Retorna None se faltar a aba ou
+    alguma coluna obrigatória. Com a aba de operações, quantidade, preço médio e direção
+    vêm do livro (apply_ledger).
+    """
+    if values is None:
+        values = store.read_values([tab])[tab]
+    df = schema.frame(values, TAB_WALLET)
+    if df is None:
+        print(f"[ERRO] Aba '{tab}' não encontrada em '{store.title}'")
+        return None
+
+    # Validar se colunas existem
+    if not all(col in df.columns for col in REQUIRED_WALLET_COLUMNS):
+        print(f"[ERRO] Colunas faltando. Necessario: {REQUIRED_WALLET_COLUMNS}")
+        return None
+    return apply_ledger(store, df, ledger_tab, positions_tab)
+
+def apply_ledger(store, df, tab=TAB_LEDGER, positions_tab=TAB_POSITIONS):
+    """
+    Aplica as operações novas da aba `tab` ao checkpoint local e troca as colunas
+    manuais da carteira pelas posições derivadas. Sem a aba, a carteira fica como está;
+    com operações novas, a aba de posições (com o lucro realizado) é sincronizada.
+    """
+    try:
+        checkpoint = ledger.LedgerStore()
+        try:
+            positions, applied, rebuilt = ledger.sync(store, tab, checkpoint)
+        finally:
+            checkpoint.close()
+    except gspread.WorksheetNotFound:
+        return df
+    except Exception as e:
+        print(f"[WARN] Falha no livro de operações (aba '{tab}'), usando Quantidade/Preço Médio da carteira: {e}")
+        return df
+
+    trades = sum(s['trades'] for s in positions.values())
+    print(f"Livro de operações: {len(positions)} posição(ões), {trades} operação(ões), {applied} nova(s)")
+    if applied or rebuilt:
+        write_positions(store, ledger.positions_frame(positions), positions_tab)
+    return ledger.apply_positions(df, positions)
+
+def open_engines(df):
+    """
+    QuoteCache e motor de Renda Fixa da execução (None no que não abrir).
+    O motor de Renda Fixa (e o fixed_income) só é carregado se a carteira tiver RF.
+    """
+    try:
+        cache = QuoteCache()
+    except Exception as e:
+        print(f"[WARN] Cache local indisponível, seguindo sem cache: {e}")
+        cache = None
+    fixed_income = None
+    if (df['Classe'].astype(str).str.strip() == 'RendaFixa').any():
+        try:
+            fixed_income = sources.load('bcb').FixedIncomeEngine()
+        except Exception as e:
+            print(f"[WARN] Séries locais de Renda Fixa indisponíveis: {e}")
+    return cache, fixed_income
+
+def close_engines(cache, fixed_income):
+    if cache is not None:
+        cache.close()
+    if fixed_income is not None:
+        fixed_income.close()
+
+def fetch_all(df, cache, fixed_income):
+    """
+    Fase 'fetch': cotações, câmbio e preço teórico das opções.
+    Retorna (cotações, câmbio, stale, livro de opções ou None, preços teóricos).
+    """
+    # Todas as cotações são buscadas em paralelo antes do roteamento
+    quotes, fx, stale = fetch_quotes(df, cache, fixed_income)
+    book, model_quotes = price_options(df, quotes, stale, cache)
+    if len(fx) > 1:
+        print("Câmbio: " + ", ".join(f"{c} R$ {r:.4f}" for c, r in fx.items() if c != fx_rates.BASE_CURRENCY))
+    print(f"Cotações obtidas: {len(quotes)} ativo(s)")
+    return quotes, fx, stale, book, model_quotes
+
+def valuate_wallet(df, quotes, fx, stale, fixed_income=None, model_quotes=None):
+    """Fase 'valuate': preço pela cadeia de fallback e conversão para BRL. Retorna (df_prices, etapas)."""
+    prices, updated_at, steps = resolve_current_prices(df, quotes, stale, fixed_income, model_quotes)
+    # Conversão BRL: taxa de cada linha pela Moeda
+    return valuate(df, prices, fx_rates.rates_for(df['Moeda'], fx), updated_at), steps
 
-    # ESCRITA NO SHEETS
+def fetch_and_valuate(df, phase):
+    """
+    Busca as cotações (fase 'fetch') e monta a tabela da aba 'prices' (fase 'valuate').
+    Retorna (df_prices, livro de opções ou None).
+    """
+    cache, fixed_income = open_engines(df)
+    try:
+        with phase('fetch'):
+            quotes, fx, stale, book, model_quotes = fetch_all(df, cache, fixed_income)
+
+        # CÁLCULOS FINANCEIROS (uma única tabela para 'prices' e 'history')
+        with phase('valuate'):
+            df_prices, steps = valuate_wallet(df, quotes, fx, stale, fixed_income, model_quotes)
+        print(f"Carteira valorizada: {len(df_prices)} posição(ões)")
+        record_fallbacks(df, steps)
+    finally:
+        close_engines(cache, fixed_income)
+    return df_prices, book
+
+def record_fallbacks(df, steps):
+    """Telemetria e aviso: posições cujo preço veio de uma etapa de reserva da cadeia de fallback."""
+    tm = telemetry.get()
+    tm.count('positions', len(df))
+    for kind in ('model', 'manual', 'avg'):
+        mask = steps == kind
+        if not mask.any():
+            continue
+        tickers = df.loc[mask, 'Ticker'].astype(str).str.strip().tolist()
+        tm.count(f"fallback.{kind}", int(mask.sum()))
+        tm.event('fallback', reason=kind, tickers=tickers)
+        if kind == 'model':
+            print(f"[WARN] Sem cotação, usando o preço teórico (Black-Scholes): {', '.join(tickers)}")
+
+def write_prices(store, df_prices, tab=TAB_PRICES, current=None):
+    """
+    ESCRITA NO SHEETS (só as células que mudaram, linhas casadas por Ticker/Classe)
+    ou no banco local (storage.py). `current` é o conteúdo atual da aba, quando já foi
+    lido (evita reler a aba). Retorna o resumo do sync (None se falhar).
+    """
     try:
-        ws_prices = sh.worksheet(TAB_PRICES)
-        ws_prices.clear()
-        # Headers ricos para o Power BI
-        ws_prices.append_row([
-            "Ticker", "Classe", "Moeda", "Quantidade", "Preço Médio", 
-            "Preço Atual", "Total (Moeda Origem)", "Total (BRL)", 
-            "Lucro/Prej (R$)", "Rentabilidade (%)", "Vencimento", "Atualização"
-        ])
-        ws_prices.append_rows(results)
-        print("--- Sucesso! Dados exportados para aba 'prices' ---")
+        summary = store.sync(tab, PRICES_COLUMNS, df_prices.values.tolist(), PRICES_KEY_COLUMNS, current=current)
+        print(f"   -> {summary['cells']} célula(s) em {summary['ranges']} range(s), "
+              f"{summary['added']} linha(s) nova(s), {summary['removed']} removida(s)")
+        print(f"--- Sucesso! Dados exportados para aba '{tab}' ---")
+        return summary
     except Exception as e:
         print(f"[ERRO CRÍTICO] Falha ao salvar: {e}")
+        return None
 
-    # --- GRAVAÇÃO DE HISTÓRICO RICO (Patrimônio + Rentabilidade) ---
+def write_positions(store, df_positions, tab=TAB_POSITIONS):
+    """Posições derivadas do livro na aba 'positions', criada na primeira vez."""
+    try:
+        summary = store.sync(tab, ledger.POSITIONS_COLUMNS, df_positions.values.tolist(), ledger.POSITIONS_KEY_COLUMNS)
+        print(f"   -> Posições: {summary['cells']} célula(s) atualizada(s) na aba '{tab}'")
+    except Exception as e:
+        print(f"[WARN] Falha ao salvar as posições na aba '{tab}': {e}")
+
+def write_greeks(store, book, tab=TAB_GREEKS):
+    """Livro de opções (preço teórico, vol implícita e gregas) na aba 'greeks', criada na primeira vez."""
+    try:
+        rows = book.astype(object).where(book.notna(), '').values.tolist()
+        summary = store.sync(tab, options.GREEKS_COLUMNS, rows, options.GREEKS_KEY_COLUMNS)
+        print(f"   -> Gregas: {summary['cells']} célula(s) atualizada(s) na aba '{tab}'")
+    except Exception as e:
+        print(f"[WARN] Falha ao salvar as gregas na aba '{tab}': {e}")
+
+def write_history(store, df_prices, tab=TAB_HISTORY, mirror_root=HISTORY_MIRROR_PATH):
+    """GRAVAÇÃO DE HISTÓRICO RICO (Patrimônio + Rentabilidade) na aba e no espelho local."""
     print("--- Gerando Histórico Completo ---")
+    today = datetime.now().strftime("%Y-%m-%d")
+    summary = save_history_rows(store, build_history_rows(df_prices, today), tab, mirror_root)
+    if summary is not None:
+        print(f"   -> Historico salvo para {today}: {summary['updated']} atualizada(s), {summary['appended']} nova(s).")
+
+def save_history_rows(store, history_rows, tab=TAB_HISTORY, mirror_root=HISTORY_MIRROR_PATH):
+    """Upsert das linhas na aba 'history' e no espelho local. Retorna o resumo do upsert (None se falhar)."""
+    summary = None
     try:
-        ws_history = sh.worksheet("history")
-        today = datetime.now().strftime("%Y-%m-%d")
-        
-        # Recria DataFrame com os dados frescos
-        # Índices baseados na lista 'results': 
-        # [7]=Total(BRL), [8]=Lucro/Prej(R$)
-        # Se sua ordem mudou, confirme os índices!
-        df_current = pd.DataFrame(results, columns=[
-            "Ticker", "Classe", "Moeda", "Quantidade", "Preço Médio", 
-            "Preço Atual", "Total (Moeda Origem)", "Total (BRL)", 
-            "Lucro/Prej (R$)", "Rentabilidade (%)", "Vencimento", "Atualização"
-        ])
-        
-        history_rows = []
-        
-        # Função auxiliar para montar a linha
-        def montar_linha(nome_categoria, df_filtrado):
-            patrimonio = df_filtrado["Total (BRL)"].sum()
-            lucro_total = df_filtrado["Lucro/Prej (R$)"].sum()
-            
-            # O investido é o valor atual menos o lucro (ou mais o prejuízo)
-            investido = patrimonio - lucro_total
-            
-            # Evita divisão por zero
-            rentab_perc = (lucro_total / investido * 100) if investido > 0 else 0.0
-            
-            return [
-                today,
-                nome_categoria,
-                patrimonio,
-                investido,
-                lucro_total,
-                rentab_perc
-            ]
-
-        # 1. Linha do TOTAL GERAL
-        history_rows.append(montar_linha("Total Geral", df_current))
-        
-        # 2. Linhas por CATEGORIA (Agrupamento)
-        categorias = df_current["Classe"].unique()
-        for cat in categorias:
-            df_cat = df_current[df_current["Classe"] == cat]
-            history_rows.append(montar_linha(cat, df_cat))
-            
-        # 3. Salva no Google Sheets
-        ws_history.append_rows(history_rows)
-        print(f"   -> Historico salvo para {today} com dados de rentabilidade.")
-        
+        # Uma linha por (Data, Categoria): rodar de novo no mesmo dia sobrescreve
+        summary = store.upsert(tab, HISTORY_COLUMNS, history_rows, HISTORY_KEY_COLUMNS)
     except Exception as e:
         print(f"[ERRO HISTORICO] Falha ao salvar: {e}")
 
+    # Espelho local em Parquet (particionado por mês)
+    try:
+        mirror = HistoryMirror(mirror_root)
+        if not mirror.exists() and summary is not None:
+            # Primeira execução: baixa a aba inteira uma única vez
+            mirror.upsert(store.read(tab))
+        mirror.upsert(pd.DataFrame(history_rows, columns=HISTORY_COLUMNS))
+        print(f"   -> Espelho local do histórico atualizado em '{mirror.root}'.")
+    except Exception as e:
+        print(f"[WARN] Falha ao atualizar o espelho local do histórico: {e}")
+    return summary
+
+def _no_phase(name):
+    return nullcontext()
+
+def run_update(store, phase=_no_phase):
+    """
+    Pipeline completo sobre uma planilha já aberta.
+    `phase(nome)` devolve um context manager em volta de cada fase
+    (read_wallet, fetch, valuate, write_prices, write_greeks, write_history).
+    """
+    with phase('read_wallet'):
+        # Carteira e conteúdo atual da aba 'prices' (base do sync) numa única leitura
+        values = store.read_values([TAB_WALLET, TAB_PRICES])
+        df = read_wallet(store, values=values[TAB_WALLET])
+    if df is None:
+        return None
+
+    df_prices, book = fetch_and_valuate(df, phase)
+
+    with phase('write_prices'):
+        write_prices(store, df_prices, current=values[TAB_PRICES])
+    if book is not None:
+        with phase('write_greeks'):
+            write_greeks(store, book)
+    with phase('write_history'):
+        write_history(store, df_prices)
+    return df_prices
+
+def write_run_summary(store, tm):
+    """Acrescenta o resumo da execução na aba 'runs' (criada na primeira vez)."""
+    try:
+        store.append(TAB_RUNS, RUNS_COLUMNS, [tm.summary_row()])
+    except Exception as e:
+        print(f"[WARN] Falha ao registrar a execução na aba '{TAB_RUNS}': {e}")
+
+# --- PERFIL DE IMPORTS ---
+def _parse_importtime(stderr):
+    """Linhas do `python -X importtime` -> [(nível, módulo, cumulativo em ms)], na ordem impressa."""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, cumulative, name = line.split('|', 2)
+        name = name[1:] # espaço depois do '|'
+        level = (len(name) - len(name.lstrip())) // 2
+        entries.append((level, name.strip(), int(cumulative) / 1000))
+    return entries
+
+def profile_imports(top=8):
+    """
+    Mede, num interpretador limpo, quanto custa importar o núcleo do atualizador
+    e, em seguida, cada fonte do registro (o que a fonte acrescenta ao núcleo).
+    """
+    # `import` direto: o -X importtime não mede o importlib.import_module usado pelo registro
+    code = "\n".join(["import update_prices"] + [f"import {m}" for m in sources.SOURCE_MODULES.values()])
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode != 0:
+        print(f"[ERRO] Falha ao medir os imports:\n{result.stderr.strip().splitlines()[-1]}")
+        return None
+
+    # O -X importtime imprime os filhos antes do pai: os de nível 1 acumulados pertencem ao próximo nível 0
+    breakdown = {}
+    children = []
+    for level, name, ms in _parse_importtime(result.stderr):
+        if level == 1:
+            children.append((name, ms))
+        elif level == 0:
+            breakdown[name] = (ms, sorted(children, key=lambda c: -c[1]))
+            children = []
+
+    modules = {module: source for source, module in sources.SOURCE_MODULES.items()}
+    print("--- Tempo de import (interpretador limpo) ---")
+    core_ms, core_children = breakdown.get('update_prices', (0.0, []))
+    print(f"{'núcleo (update_prices)':<32} {core_ms:>9.1f} ms")
+    for name, ms in core_children[:top]:
+        print(f"   {name:<29} {ms:>9.1f} ms")
+    total = core_ms
+    for module, source in modules.items():
+        ms, module_children = breakdown.get(module, (0.0, []))
+        total += ms
+        print(f"{'fonte ' + source + ' (' + module + ')':<32} {ms:>9.1f} ms")
+        for name, child_ms in module_children[:3]:
+            print(f"   {name:<29} {child_ms:>9.1f} ms")
+    print(f"{'total com todas as fontes':<32} {total:>9.1f} ms")
+    print("Fontes só são importadas quando a carteira tem a Classe correspondente.")
+    return breakdown
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Atualiza as abas 'prices' e 'history' da carteira.")
+    parser.add_argument('--telemetry', action='store_true', default=bool(os.environ.get(TELEMETRY_ENV)),
+                        help=f"grava o relatório JSON da execução e a linha na aba '{TAB_RUNS}' (ou {TELEMETRY_ENV}=1)")
+    parser.add_argument('--report', default=TELEMETRY_REPORT_PATH, help="caminho do relatório JSON")
+    parser.add_argument('--profile-imports', action='store_true',
+                        help="mostra o tempo de import do núcleo e de cada fonte e sai (não acessa o Sheets)")
+    parser.add_argument('--backfill', type=date.fromisoformat, metavar='AAAA-MM-DD',
+                        help="recalcula a aba 'history' a partir desta data com cotações históricas (ver backfill.py)")
+    parser.add_argument('--backfill-end', type=date.fromisoformat, metavar='AAAA-MM-DD',
+                        help="último dia do backfill (padrão: ontem)")
+    parser.add_argument('--daemon', action='store_true',
+                        help="fica rodando e atualiza cada Classe no seu intervalo (ver daemon.py)")
+    parser.add_argument('--threshold', type=float, default=None,
+                        help="modo daemon: variação relativa mínima do preço para republicar a linha (ex: 0.001)")
+    parser.add_argument('--interval', action='append', default=[], metavar='CLASSE=SEG',
+                        help="modo daemon: intervalo de atualização de uma Classe (ex: Cripto=60)")
+    parser.add_argument('--portfolio', action='append', default=[], metavar='PLANILHA[:ABA]',
+                        help="modo lote: carteira a atualizar (repetível; ver portfolios.py)")
+    parser.add_argument('--portfolios', metavar='ARQUIVO',
+                        help="modo lote: arquivo com uma carteira PLANILHA[:ABA] por linha")
+    parser.add_argument('--storage', choices=['sheets', 'local'], default=os.environ.get(storage.STORAGE_ENV, 'sheets'),
+                        help=f"onde ler e gravar as abas: Google Sheets ou banco local (ou {storage.STORAGE_ENV}; ver storage.py)")
+    parser.add_argument('--mirror-sheets', action='store_true',
+                        help="com --storage local: espelha as escritas no Google Sheets em segundo plano")
+    parser.add_argument('--import-sheets', action='store_true',
+                        help="copia todas as abas do Google Sheets para o banco local e sai")
+    args = parser.parse_args(argv)
+    if args.mirror_sheets and args.storage != 'local':
+        parser.error("--mirror-sheets exige --storage local")
+    return args
+
+def run_daemon(args):
+    import daemon # só carregado no modo daemon
+
+    intervals = {}
+    for item in args.interval:
+        classe, seconds = item.split('=', 1)
+        intervals[classe.strip()] = float(seconds)
+    threshold = daemon.PRICE_THRESHOLD if args.threshold is None else args.threshold
+
+    store = connect_store(args)
+    print(f"--- Daemon iniciado (limite de publicação: {threshold:.2%}) ---")
+    try:
+        stats = daemon.PriceDaemon(store, intervals, threshold).run()
+    finally:
+        storage.close_store(store)
+    print(f"   -> {stats['ticks']} ciclo(s), {stats['refreshes']} atualização(ões) de Classe, "
+          f"{stats['cells']} célula(s) publicada(s)")
+
+def run_import(args):
+    """Copia as abas do Sheets para o banco local de cada planilha (a padrão ou as do modo lote)."""
+    sheets = [SHEET_NAME]
+    if args.portfolio or args.portfolios:
+        import portfolios # só carregado no modo lote
+        sheets = list(dict.fromkeys(p['sheet'] for p in portfolios.load_portfolios(args.portfolio, args.portfolios)))
+    try:
+        client = connect_client()
+    except Exception as e:
+        print(f"[FATAL] Erro de conexão: {e}")
+        exit()
+    for sheet in sheets:
+        local = storage.LocalStore(storage.local_path(sheet, SHEET_NAME))
+        try:
+            copied = storage.import_sheets(storage.SheetsStore(client.open(sheet)), local)
+            print(f"   -> '{sheet}' -> '{local.path}': " + ", ".join(f"{tab} ({n})" for tab, n in copied.items()))
+        except Exception as e:
+            print(f"[ERRO] Falha ao importar '{sheet}': {e}")
+        finally:
+            local.close()
+
+def run_portfolios(args, tm):
+    import portfolios # só carregado no modo lote
+
+    selected = portfolios.load_portfolios(args.portfolio, args.portfolios)
+    if not selected:
+        print("[ERRO] Nenhuma carteira informada")
+        return []
+    client = None
+    if args.storage == 'sheets' or args.mirror_sheets:
+        with tm.phase('connect'):
+            try:
+                client = connect_client()
+            except Exception as e:
+                print(f"[FATAL] Erro de conexão: {e}")
+                exit()
+    open_sheet = lambda sheet: open_store(sheet, args.storage, args.mirror_sheets, client)
+    results, errors, stores = portfolios.run_batch(open_sheet, selected, phase=tm.phase)
+    portfolios.print_summary(selected, results, errors)
+    return stores
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.profile_imports:
+        profile_imports()
+        return
+    print("--- Iniciando Orquestracao ---")
+    if args.import_sheets:
+        run_import(args)
+        print("--- Fim da Execução ---")
+        return
+    if args.daemon:
+        return run_daemon(args)
+    if args.backfill:
+        import backfill # só carregado no modo backfill
+        store = connect_store(args)
+        try:
+            backfill.run_backfill(store, args.backfill, args.backfill_end)
+        finally:
+            storage.close_store(store)
+        HistoryMirror().mark_synced()
+        print("--- Fim da Execução ---")
+        return
+    tm = Telemetry() if args.telemetry else telemetry.get()
+    with telemetry.activate(tm):
+        if args.portfolio or args.portfolios:
+            stores = run_portfolios(args, tm)
+        else:
+            with tm.phase('connect'):
+                stores = [connect_store(args)]
+            run_update(stores[0], phase=tm.phase)
+
+    if tm.enabled:
+        tm.write_report(args.report)
+        for store in stores:
+            write_run_summary(store, tm)
+        print(f"   -> Relatório da execução salvo em '{args.report}'.")
+    # Com o espelho no Sheets, espera as escritas pendentes
+    for store in stores:
+        storage.close_store(store)
+    if not (args.portfolio or args.portfolios):
+        # Depois da última escrita na planilha: o dashboard confere este horário com o da planilha
+        HistoryMirror().mark_synced()
     print("--- Fim da Execução ---")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()